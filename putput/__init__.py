@@ -1,4 +1,5 @@
 """Package settings for putput."""
+from putput.builder import PatternDefBuilder
 from putput.joiner import ComboOptions
 from putput.pipeline import Pipeline
 
@@ -0,0 +1,141 @@
+from collections import OrderedDict
+from typing import Dict  # pylint: disable=unused-import
+from typing import List  # pylint: disable=unused-import
+from typing import Mapping
+from typing import Optional
+from typing import Sequence
+from typing import Tuple
+from typing import Union
+from typing import cast
+
+# Utterance patterns are normalized to tuples of strings as they are added
+_UTTERANCE_PATTERN = Tuple[str, ...]
+
+class PatternDefBuilder:
+    """Builds a pattern definition in memory, in the shape of the pattern definition yaml file.
+
+    Each method returns the builder, so calls can be chained. The result of 'build'
+    is passed to 'Pipeline.from_pattern_def', which validates it.
+
+    Examples:
+        >>> from putput.pipeline import Pipeline
+        >>> pattern_def = (PatternDefBuilder()
+        ...                .add_base_tokens('PRONOUNS', ('she', 'he'))
+        ...                .add_static_token_patterns('ADD', ((('can', 'may'), 'PRONOUNS', ('get',)),))
+        ...                .add_dynamic_tokens('ITEM')
+        ...                .add_group('ADD_ITEM', ('ADD', 'ITEM'))
+        ...                .add_entities('ITEM')
+        ...                .add_utterance_patterns((('ADD_ITEM',),), intent='ADD_INTENT')
+        ...                .build())
+        >>> pattern_def['utterance_patterns']
+        [{'ADD_INTENT': [['ADD_ITEM']]}]
+        >>> p = Pipeline.from_pattern_def(pattern_def, dynamic_token_patterns_map={'ITEM': ('fries',)})
+        >>> for utterance, tokens, groups in p.flow(disable_progress_bar=True):
+        ...     print(utterance)
+        ...     break
+        can she get fries
+    """
+    def __init__(self) -> None:
+        self._base_tokens = OrderedDict() # type: Dict[str, Sequence[str]]
+        self._static_token_patterns = OrderedDict() # type: Dict[str, List[Sequence[Union[str, Sequence[str]]]]]
+        self._dynamic_tokens = [] # type: List[str]
+        self._groups = OrderedDict() # type: Dict[str, Sequence[str]]
+        self._entities = [] # type: List[str]
+        self._utterance_patterns = [] # type: List[Union[_UTTERANCE_PATTERN, Dict[str, List[_UTTERANCE_PATTERN]]]]
+        self._intent_patterns = {} # type: Dict[str, List[_UTTERANCE_PATTERN]]
+
+    def add_base_tokens(self, base_token: str, phrases: Sequence[str]) -> 'PatternDefBuilder':
+        """Adds a base token that static token patterns may use in place of phrases.
+
+        Args:
+            base_token: Name of the base token.
+
+            phrases: Phrases the base token can be replaced by.
+        """
+        self._base_tokens[base_token] = phrases
+        return self
+
+    def add_static_token_patterns(self,
+                                  token: str,
+                                  token_patterns: Sequence[Sequence[Union[str, Sequence[str]]]]
+                                  ) -> 'PatternDefBuilder':
+        """Adds token patterns to a static token.
+
+        Args:
+            token: Name of the token.
+
+            token_patterns: Token patterns, each a sequence of phrases or base tokens.
+        """
+        self._static_token_patterns.setdefault(token, []).extend(token_patterns)
+        return self
+
+    def add_dynamic_tokens(self, *tokens: str) -> 'PatternDefBuilder':
+        """Adds tokens whose token patterns are specified in 'dynamic_token_patterns_map'."""
+        self._dynamic_tokens.extend(tokens)
+        return self
+
+    def add_group(self, group: str, tokens: Sequence[str]) -> 'PatternDefBuilder':
+        """Adds a group of tokens that utterance patterns and groups may use in place of tokens.
+
+        Args:
+            group: Name of the group.
+
+            tokens: Tokens, ranges, optionals, and groups that make up the group.
+        """
+        self._groups[group] = tokens
+        return self
+
+    def add_entities(self, *entities: str) -> 'PatternDefBuilder':
+        """Adds tokens that are entities of the intents of utterance patterns."""
+        self._entities.extend(entities)
+        return self
+
+    def add_utterance_patterns(self,
+                               utterance_patterns: Sequence[Sequence[Union[str, int]]],
+                               *,
+                               intent: Optional[str] = None
+                               ) -> 'PatternDefBuilder':
+        """Adds utterance patterns, optionally labeled with an intent.
+
+        Args:
+            utterance_patterns: Utterance patterns, each a sequence of tokens, ranges, optionals, and groups.
+
+            intent: Intent of the utterance patterns. Utterance patterns added with the
+                same intent are listed together.
+        """
+        normalized_patterns = [tuple(map(str, utterance_pattern))
+                               for utterance_pattern in utterance_patterns] # type: List[_UTTERANCE_PATTERN]
+        if intent is None:
+            self._utterance_patterns.extend(normalized_patterns)
+        elif intent in self._intent_patterns:
+            self._intent_patterns[intent].extend(normalized_patterns)
+        else:
+            self._intent_patterns[intent] = normalized_patterns
+            self._utterance_patterns.append({intent: normalized_patterns})
+        return self
+
+    def build(self) -> Mapping:
+        """Returns the pattern definition, with sequences as lists as if loaded from yaml."""
+        token_patterns = [] # type: List[Mapping]
+        if self._static_token_patterns:
+            token_patterns.append({'static': [{token: patterns}
+                                              for token, patterns in self._static_token_patterns.items()]})
+        if self._dynamic_tokens:
+            token_patterns.append({'dynamic': self._dynamic_tokens})
+        pattern_def = OrderedDict() # type: Dict[str, object]
+        if self._base_tokens:
+            pattern_def['base_tokens'] = [{base_token: phrases} for base_token, phrases in self._base_tokens.items()]
+        pattern_def['token_patterns'] = token_patterns
+        if self._groups:
+            pattern_def['groups'] = [{group: tokens} for group, tokens in self._groups.items()]
+        if self._entities:
+            pattern_def['entities'] = self._entities
+        pattern_def['utterance_patterns'] = self._utterance_patterns
+        return cast(Mapping, _to_lists(pattern_def))
+
+def _to_lists(item: object) -> object:
+    if isinstance(item, Mapping):
+        return {key: _to_lists(value) for key, value in item.items()}
+    if isinstance(item, (list, tuple)):
+        return [_to_lists(value) for value in item]
+    return item
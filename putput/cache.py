@@ -0,0 +1,84 @@
+from collections import OrderedDict
+from typing import Dict  # pylint: disable=unused-import
+from typing import Hashable
+from typing import Iterator
+from typing import MutableMapping
+from typing import NamedTuple
+from typing import Optional
+from typing import TypeVar
+
+K = TypeVar('K', bound=Hashable)
+V = TypeVar('V')
+
+CacheInfo = NamedTuple('CacheInfo', [('hits', int), ('misses', int), ('maxsize', Optional[int]), ('currsize', int)])
+
+class LRUCache(MutableMapping[K, V]):
+    """A mapping that evicts its least recently used items once it holds 'maxsize' items.
+
+    Lookups are counted as hits or misses so that the size of the cache can be tuned
+    against the cost of recomputing evicted items. Membership tests are not counted
+    and do not change how recently an item was used.
+
+    Args:
+        maxsize: Ceiling for the number of items in the cache. If None, the cache is unbounded.
+
+    Raises:
+        ValueError: If maxsize <= 0.
+
+    Examples:
+        >>> cache = LRUCache(maxsize=2)
+        >>> cache['WAKE'] = ('hi', 'hey')
+        >>> cache['PLAY'] = ('play',)
+        >>> cache.get('WAKE')
+        ('hi', 'hey')
+        >>> cache['ARTIST'] = ('kanye',)
+        >>> 'PLAY' in cache
+        False
+        >>> cache.get('PLAY')
+        >>> cache.info()
+        CacheInfo(hits=1, misses=1, maxsize=2, currsize=2)
+    """
+    def __init__(self, *, maxsize: Optional[int] = 128) -> None:
+        if maxsize is not None and maxsize <= 0:
+            raise ValueError('maxsize = {}, but needs to be > 0'.format(maxsize))
+        self._maxsize = maxsize
+        self._items = OrderedDict() # type: Dict[K, V]
+        self._hits = 0
+        self._misses = 0
+
+    @property
+    def maxsize(self) -> Optional[int]:
+        """Ceiling for the number of items in the cache."""
+        return self._maxsize
+
+    def info(self) -> CacheInfo:
+        """Returns hits, misses, maxsize, and current size of the cache."""
+        return CacheInfo(self._hits, self._misses, self._maxsize, len(self._items))
+
+    def __getitem__(self, key: K) -> V:
+        try:
+            value = self._items[key]
+        except KeyError:
+            self._misses += 1
+            raise
+        self._hits += 1
+        self._items.move_to_end(key) # type: ignore
+        return value
+
+    def __setitem__(self, key: K, value: V) -> None:
+        self._items[key] = value
+        self._items.move_to_end(key) # type: ignore
+        if self._maxsize is not None and len(self._items) > self._maxsize:
+            self._items.popitem(last=False) # type: ignore
+
+    def __delitem__(self, key: K) -> None:
+        del self._items[key]
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._items
+
+    def __iter__(self) -> Iterator[K]:
+        return iter(self._items)
+
+    def __len__(self) -> int:
+        return len(self._items)
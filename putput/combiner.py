@@ -1,15 +1,183 @@
+from collections import OrderedDict
+from functools import partial
 from functools import reduce
-from itertools import repeat
+from itertools import islice
+from typing import Any
 from typing import Callable
+from typing import Dict  # pylint: disable=unused-import
 from typing import Iterable
+from typing import Iterator
+from typing import List  # pylint: disable=unused-import
 from typing import Mapping
+from typing import MutableMapping
 from typing import Optional
 from typing import Sequence
 from typing import Tuple
+from typing import TypeVar
+from typing import Union
 
+from putput.cache import LRUCache
 from putput.joiner import ComboOptions
 from putput.joiner import join_combo
+from putput.joiner import join_combo_indices
 
+FIELDS = ('utterance', 'handled_tokens', 'handled_groups')
+
+_PURE_ATTRIBUTE = '__putput_pure__'
+_BATCH_ATTRIBUTE = '__putput_batch__'
+_SPANS_ATTRIBUTE = '__putput_spans__'
+
+# Ceiling for the number of results of each kind of pure handler cached in one flow
+_HANDLER_CACHE_SIZE = 2 ** 16
+
+H = TypeVar('H', bound=Callable[..., str])
+F = TypeVar('F', bound=Callable)
+# Fields that were not requested from 'combine' are None
+_COMBINATION = Tuple[Optional[str], Optional[Sequence[str]], Optional[Sequence[str]]]
+# Followed by token spans and group spans if 'combine' is called with spans
+_COMBINATION_WITH_SPANS = Tuple[Optional[str], Optional[Sequence[str]], Optional[Sequence[str]],
+                                Sequence[Tuple[str, int, int]], Sequence[Tuple[str, int, int]]]
+
+def pure(handler: H) -> H:
+    """Marks a token or group handler as pure, so that its results can be cached.
+
+    A pure handler's result depends only on its arguments, i.e. (token, phrase) for a token
+    handler and (group name, handled tokens) for a group handler. Within a flow of 'Pipeline',
+    each pure handler is called once per distinct arguments instead of once per utterance.
+    Partials of a pure handler are pure too.
+
+    Args:
+        handler: A token or group handler.
+
+    Returns:
+        The handler.
+
+    Examples:
+        >>> @pure
+        ... def _upper_token_handler(token: str, phrase: str) -> str:
+        ...     return '[{}({})]'.format(token, phrase.upper())
+        >>> token_handler_cache = {}
+        >>> _, generator = combine((('can she get', 'may she get'), ('fries',)),
+        ...                        ('ADD', 'ITEM'),
+        ...                        (('ADD_ITEM', 2),),
+        ...                        token_handler_map={'DEFAULT': _upper_token_handler},
+        ...                        token_handler_cache=token_handler_cache)
+        >>> _ = list(generator)
+        >>> sorted(token_handler_cache)
+        [('ADD', 'can she get'), ('ADD', 'may she get'), ('ITEM', 'fries')]
+    """
+    setattr(handler, _PURE_ATTRIBUTE, True)
+    return handler
+
+def is_pure(handler: Callable[..., str]) -> bool:
+    """Returns whether handler, or the handler it is a partial of, is marked with 'pure'."""
+    return _is_marked(handler, _PURE_ATTRIBUTE)
+
+def batch(handler_or_hook: F) -> F:
+    """Marks a token handler, group handler, or combo hook as handling a batch at a time.
+
+    A batch token handler is called with (token, phrases generated by token) and returns
+    a handled token per phrase. A batch group handler is called with (group name, handled
+    tokens of the group per utterance) and returns a handled group per utterance. A batch
+    combo hook is called with a list of (utterance, handled tokens, handled groups), or the
+    results of the previous hook, and returns a result per item. Batches hold up to
+    'batch_size' utterances of one utterance pattern, and a single utterance otherwise.
+    Partials of a batch handler or hook are batch too.
+
+    Args:
+        handler_or_hook: A token handler, group handler, or combo hook.
+
+    Returns:
+        The handler or hook.
+
+    Examples:
+        >>> @batch
+        ... def _upper_token_handler(token: str, phrases: Sequence[str]) -> Sequence[str]:
+        ...     print('handling {} phrases'.format(len(phrases)))
+        ...     return ['[{}({})]'.format(token, phrase.upper()) for phrase in phrases]
+        >>> _, generator = combine((('can she get', 'may she get'), ('fries',)),
+        ...                        ('ADD', 'ITEM'),
+        ...                        (('ADD_ITEM', 2),),
+        ...                        token_handler_map={'DEFAULT': _upper_token_handler},
+        ...                        batch_size=2)
+        >>> for _, handled_tokens, _ in generator:
+        ...     print(handled_tokens)
+        handling 2 phrases
+        handling 2 phrases
+        ('[ADD(CAN SHE GET)]', '[ITEM(FRIES)]')
+        ('[ADD(MAY SHE GET)]', '[ITEM(FRIES)]')
+    """
+    setattr(handler_or_hook, _BATCH_ATTRIBUTE, True)
+    return handler_or_hook
+
+def is_batch(handler_or_hook: Callable) -> bool:
+    """Returns whether handler_or_hook, or the callable it is a partial of, is marked with 'batch'."""
+    return _is_marked(handler_or_hook, _BATCH_ATTRIBUTE)
+
+def with_spans(hook: F) -> F:
+    """Marks a combo hook as taking the character spans of tokens and groups in the utterance.
+
+    In addition to its usual arguments, the hook is called with the keyword arguments
+    'token_spans' and 'group_spans', each a tuple of (token or group name, start, end),
+    where utterance[start:end] is the phrase generated by the token or group. A batch hook
+    is called with a list of each instead. Spans are only computed for utterance patterns
+    that have a hook marked with 'with_spans'. Partials of a marked hook are marked too.
+
+    Args:
+        hook: A combo hook.
+
+    Returns:
+        The hook.
+
+    Examples:
+        >>> _, generator = combine((('can she get', 'may she get'), ('fries',)),
+        ...                        ('ADD', 'ITEM'),
+        ...                        (('ADD_ITEM', 2),),
+        ...                        spans=True)
+        >>> utterance, handled_tokens, handled_groups, token_spans, group_spans = next(generator)
+        >>> token_spans
+        (('ADD', 0, 11), ('ITEM', 12, 17))
+        >>> group_spans
+        (('ADD_ITEM', 0, 17),)
+    """
+    setattr(hook, _SPANS_ATTRIBUTE, True)
+    return hook
+
+def is_with_spans(hook: Callable) -> bool:
+    """Returns whether hook, or the hook it is a partial of, is marked with 'with_spans'."""
+    return _is_marked(hook, _SPANS_ATTRIBUTE)
+
+def split_words(phrase: str) -> Sequence[str]:
+    """Splits a phrase into words on whitespace, keeping contractions such as "'s" with the previous word.
+
+    Results are not cached here. Pure handlers that label words, such as those of the IOB2 preset,
+    call it once per distinct phrase, since their results are cached per flow, see 'create_handler_caches'.
+
+    Args:
+        phrase: A phrase generated by a token.
+
+    Returns:
+        The words of phrase.
+
+    Examples:
+        >>> split_words("play kanye 's songs")
+        ('play', "kanye's", 'songs')
+    """
+    return tuple(phrase.replace(" '", "'").split())
+
+def _is_marked(handler: Callable, attribute: str) -> bool:
+    while isinstance(handler, partial):
+        if getattr(handler, attribute, False):
+            return True
+        handler = handler.func
+    return getattr(handler, attribute, False)
+
+
+def create_handler_caches() -> Tuple[LRUCache, LRUCache]:
+    """Returns a 'token_handler_cache' and a 'group_handler_cache' for 'combine', bounded so that
+    the least recently used results are evicted first. Share them between the calls of one flow.
+    """
+    return LRUCache(maxsize=_HANDLER_CACHE_SIZE), LRUCache(maxsize=_HANDLER_CACHE_SIZE)
 
 def combine(utterance_combo: Sequence[Sequence[str]],
             tokens: Sequence[str],
@@ -17,8 +185,14 @@ def combine(utterance_combo: Sequence[Sequence[str]],
             *,
             token_handler_map: Optional[Mapping[str, Callable[[str, str], str]]] = None,
             group_handler_map: Optional[Mapping[str, Callable[[str, Sequence[str]], str]]] = None,
-            combo_options: Optional[ComboOptions] = None
-            ) -> Tuple[int, Iterable[Tuple[str, Sequence[str], Sequence[str]]]]:
+            combo_options: Optional[ComboOptions] = None,
+            labeled_utterances: bool = False,
+            fields: Optional[Sequence[str]] = None,
+            token_handler_cache: Optional[MutableMapping[Tuple[str, str], str]] = None,
+            group_handler_cache: Optional[MutableMapping[Tuple[str, Sequence[str]], str]] = None,
+            batch_size: Optional[int] = None,
+            spans: bool = False
+            ) -> Tuple[int, Iterable[Union[_COMBINATION, _COMBINATION_WITH_SPANS, 'LabeledUtterance']]]:
     """Generates an utterance, handled tokens, and handled groups.
 
     Args:
@@ -35,9 +209,37 @@ def combine(utterance_combo: Sequence[Sequence[str]],
 
         combo_options: Options for randomly sampling the combination of 'utterance_combo'.
 
+        labeled_utterances: Option to generate 'LabeledUtterance' records, which build the
+            utterance, handled tokens, and handled groups only when they are first accessed.
+
+        fields: Names of the fields to compute, from 'FIELDS'. Fields that are not specified
+            are None, so their token handlers, group handlers, or joins are skipped. Handled
+            tokens are computed for handled groups even if they are not specified. If None,
+            every field is computed.
+
+        token_handler_cache: A mapping between (token, phrase) and the handled token, in which
+            the results of token handlers marked with 'pure' are cached. Share it between
+            calls with the same 'token_handler_map' to reuse results across utterance combos.
+
+        group_handler_cache: Same as 'token_handler_cache', but between (group name, handled
+            tokens) and the handled group, for group handlers marked with 'pure'.
+
+        batch_size: Number of utterances whose tokens and groups are handled together, so
+            handlers marked with 'batch' are called once per token and group of a batch. Does
+            not apply to 'labeled_utterances', which handle tokens one utterance at a time.
+            If None, utterances are handled one at a time.
+
+        spans: Option to append the spans of tokens and groups in the utterance to each
+            result, see 'with_spans'. Does not apply to 'labeled_utterances', which have
+            'token_spans' and 'group_spans' properties instead.
+
+    Raises:
+        ValueError: If fields includes a name that is not in 'FIELDS', or batch_size <= 0.
+
     Returns:
-        The length of the Iterable, and the Iterable consisting of an utterance
-        and handled tokens.
+        The length of the Iterable, and the Iterable consisting of an utterance,
+        handled tokens, and handled groups, or of 'LabeledUtterance' records if
+        labeled_utterances is True.
 
     Examples:
         >>> def _iob_token_handler(token: str, phrase: str) -> str:
@@ -71,24 +273,343 @@ def combine(utterance_combo: Sequence[Sequence[str]],
         ('B-ADD I-ADD I-ADD', 'B-ITEM')
         ('[ADD_ITEM]',)
     """
+    fields = _validate_fields(fields)
+    if batch_size is not None and batch_size <= 0:
+        raise ValueError('batch_size = {}, but needs to be > 0'.format(batch_size))
     sample_size = reduce(lambda x, y: x * y, (len(item) for item in utterance_combo))
     if combo_options:
         sample_size = combo_options.max_sample_size
 
-    def _combine() -> Iterable[Tuple[str, Sequence[str], Sequence[str]]]:
+    if labeled_utterances:
+        source = _LabeledUtteranceSource(utterance_combo,
+                                         tokens,
+                                         groups,
+                                         token_handler_map,
+                                         group_handler_map,
+                                         fields,
+                                         token_handler_cache,
+                                         group_handler_cache)
+        component_lengths = tuple(len(item) for item in utterance_combo)
+        return sample_size, (LabeledUtterance(source, component_indices) for component_indices
+                             in join_combo_indices(component_lengths, combo_options=combo_options))
+
+    def _combine() -> Iterable[Union[_COMBINATION, _COMBINATION_WITH_SPANS]]:
+        for utterance_components in join_combo(utterance_combo, combo_options=combo_options):
+            handled_tokens = _compute_handled_tokens(utterance_components,
+                                                     tokens,
+                                                     token_handler_map=token_handler_map,
+                                                     token_handler_cache=token_handler_cache)
+            handled_groups = _compute_handled_groups(groups,
+                                                     handled_tokens,
+                                                     group_handler_map,
+                                                     group_handler_cache=group_handler_cache)
+            if spans:
+                yield (' '.join(utterance_components), handled_tokens, handled_groups,
+                       *_compute_spans(utterance_components, tokens, groups))
+            else:
+                yield ' '.join(utterance_components), handled_tokens, handled_groups
+
+    def _combine_fields() -> Iterable[Union[_COMBINATION, _COMBINATION_WITH_SPANS]]:
+        compute_utterance = 'utterance' in fields
+        compute_handled_groups = 'handled_groups' in fields
+        compute_handled_tokens = compute_handled_groups or 'handled_tokens' in fields
         for utterance_components in join_combo(utterance_combo, combo_options=combo_options):
-            handled_tokens = _compute_handled_tokens(utterance_components, tokens, token_handler_map=token_handler_map)
-            handled_groups = _compute_handled_groups(groups, handled_tokens, group_handler_map)
-            yield ' '.join(utterance_components), handled_tokens, handled_groups
-    return sample_size, _combine()
+            utterance = ' '.join(utterance_components) if compute_utterance else None
+            handled_tokens = handled_groups = None # type: Optional[Sequence[str]]
+            if compute_handled_tokens:
+                computed_tokens = _compute_handled_tokens(utterance_components,
+                                                          tokens,
+                                                          token_handler_map=token_handler_map,
+                                                          token_handler_cache=token_handler_cache)
+                if 'handled_tokens' in fields:
+                    handled_tokens = computed_tokens
+                if compute_handled_groups:
+                    handled_groups = _compute_handled_groups(groups,
+                                                             computed_tokens,
+                                                             group_handler_map,
+                                                             group_handler_cache=group_handler_cache)
+            if spans:
+                yield (utterance, handled_tokens, handled_groups, *_compute_spans(utterance_components, tokens, groups))
+            else:
+                yield utterance, handled_tokens, handled_groups
+
+    def _combine_batches() -> Iterable[Union[_COMBINATION, _COMBINATION_WITH_SPANS]]:
+        combos = iter(join_combo(utterance_combo, combo_options=combo_options))
+        while True:
+            batch_components = list(islice(combos, batch_size))
+            if not batch_components:
+                return
+            results = _combine_batch(batch_components,
+                                     tokens,
+                                     groups,
+                                     fields,
+                                     token_handler_map=token_handler_map,
+                                     group_handler_map=group_handler_map,
+                                     token_handler_cache=token_handler_cache,
+                                     group_handler_cache=group_handler_cache)
+            if spans:
+                for result, utterance_components in zip(results, batch_components):
+                    yield result + _compute_spans(utterance_components, tokens, groups)
+            else:
+                yield from results
+
+    if batch_size is not None:
+        return sample_size, _combine_batches()
+    return sample_size, _combine_fields() if fields != FIELDS else _combine()
+
+class LabeledUtterance:
+    """An utterance, handled tokens, and handled groups, each built when it is first accessed.
+
+    A record keeps the index of each of its phrases in the utterance_combo it came from,
+    so consumers that only read the utterance never handle tokens, and records held in
+    memory, e.g. for shuffling or batching, cost little more than their indices. Records
+    unpack, iterate, index, and compare like a tuple of the utterance, handled tokens,
+    and handled groups, with None in place of fields that were not requested from 'combine'.
+
+    Examples:
+        >>> _, generator = combine((('can she get', 'may she get'), ('fries',)),
+        ...                        ('ADD', 'ITEM'),
+        ...                        (('ADD_ITEM', 2),),
+        ...                        labeled_utterances=True)
+        >>> labeled_utterance = next(generator)
+        >>> labeled_utterance.utterance
+        'can she get fries'
+        >>> utterance, handled_tokens, handled_groups = labeled_utterance
+        >>> handled_tokens
+        ('[ADD(can she get)]', '[ITEM(fries)]')
+    """
+    __slots__ = ('_source', '_component_indices', '_utterance', '_handled_tokens', '_handled_groups')
+
+    def __init__(self, source: '_LabeledUtteranceSource', component_indices: Sequence[int]) -> None:
+        self._source = source
+        self._component_indices = component_indices
+        self._utterance = None # type: Optional[str]
+        self._handled_tokens = None # type: Optional[Sequence[str]]
+        self._handled_groups = None # type: Optional[Sequence[str]]
+
+    @property
+    def utterance_components(self) -> Sequence[str]:
+        """Read-only phrases that make up the utterance, one per token."""
+        utterance_combo = self._source.utterance_combo
+        return tuple(utterance_combo[component_index][item_index]
+                     for component_index, item_index in enumerate(self._component_indices))
+
+    @property
+    def tokens(self) -> Sequence[str]:
+        """Read-only tokens of the utterance pattern the utterance came from."""
+        return self._source.tokens
+
+    @property
+    def words(self) -> Sequence[Sequence[str]]:
+        """Read-only words of each phrase that makes up the utterance, see 'split_words'."""
+        return tuple(map(split_words, self.utterance_components))
+
+    @property
+    def word_counts(self) -> Sequence[int]:
+        """Read-only number of words of each phrase that makes up the utterance, see 'split_words'."""
+        return tuple(len(split_words(utterance_component)) for utterance_component in self.utterance_components)
+
+    @property
+    def token_spans(self) -> Sequence[Tuple[str, int, int]]:
+        """Read-only (token, start, end) of each token in the utterance, see 'with_spans'."""
+        return _compute_spans(self.utterance_components, self._source.tokens, self._source.groups)[0]
+
+    @property
+    def group_spans(self) -> Sequence[Tuple[str, int, int]]:
+        """Read-only (group name, start, end) of each group in the utterance, see 'with_spans'."""
+        return _compute_spans(self.utterance_components, self._source.tokens, self._source.groups)[1]
+
+    @property
+    def utterance(self) -> str:
+        """Read-only utterance."""
+        if self._utterance is None:
+            self._utterance = ' '.join(self.utterance_components)
+        return self._utterance
+
+    @property
+    def handled_tokens(self) -> Sequence[str]:
+        """Read-only handled tokens."""
+        if self._handled_tokens is None:
+            self._handled_tokens = _compute_handled_tokens(self.utterance_components,
+                                                           self._source.tokens,
+                                                           token_handler_map=self._source.token_handler_map,
+                                                           token_handler_cache=self._source.token_handler_cache)
+        return self._handled_tokens
+
+    @property
+    def handled_groups(self) -> Sequence[str]:
+        """Read-only handled groups."""
+        if self._handled_groups is None:
+            self._handled_groups = _compute_handled_groups(self._source.groups,
+                                                           self.handled_tokens,
+                                                           self._source.group_handler_map,
+                                                           group_handler_cache=self._source.group_handler_cache)
+        return self._handled_groups
+
+    def __iter__(self) -> Iterator[Any]:
+        fields = self._source.fields
+        yield self.utterance if 'utterance' in fields else None
+        yield self.handled_tokens if 'handled_tokens' in fields else None
+        yield self.handled_groups if 'handled_groups' in fields else None
+
+    def __len__(self) -> int:
+        return 3
+
+    def __getitem__(self, index: Any) -> Any:
+        return tuple(self)[index]
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, (LabeledUtterance, tuple)):
+            return tuple(self) == tuple(other)
+        return NotImplemented
+
+    def __hash__(self) -> int:
+        return hash(tuple(self))
+
+    def __repr__(self) -> str:
+        return '{}{}'.format(type(self).__name__, tuple(self))
+
+class _LabeledUtteranceSource:
+    # Shared by every record combined from the same utterance_combo, so records only hold their indices
+    __slots__ = ('utterance_combo', 'tokens', 'groups', 'token_handler_map', 'group_handler_map', 'fields',
+                 'token_handler_cache', 'group_handler_cache')
+
+    def __init__(self,
+                 utterance_combo: Sequence[Sequence[str]],
+                 tokens: Sequence[str],
+                 groups: Sequence[Tuple[str, int]],
+                 token_handler_map: Optional[Mapping[str, Callable[[str, str], str]]],
+                 group_handler_map: Optional[Mapping[str, Callable[[str, Sequence[str]], str]]],
+                 fields: Sequence[str],
+                 token_handler_cache: Optional[MutableMapping[Tuple[str, str], str]],
+                 group_handler_cache: Optional[MutableMapping[Tuple[str, Sequence[str]], str]]
+                 ) -> None:
+        self.utterance_combo = utterance_combo
+        self.tokens = tokens
+        self.groups = groups
+        self.token_handler_map = token_handler_map
+        self.group_handler_map = group_handler_map
+        self.fields = fields
+        self.token_handler_cache = token_handler_cache
+        self.group_handler_cache = group_handler_cache
+
+def _validate_fields(fields: Optional[Sequence[str]]) -> Sequence[str]:
+    if fields is None:
+        return FIELDS
+    invalid_fields = [field for field in fields if field not in FIELDS]
+    if invalid_fields:
+        raise ValueError('fields = {}, but each field needs to be one of {}'.format(invalid_fields, FIELDS))
+    return tuple(field for field in FIELDS if field in fields)
+
+def _compute_spans(utterance_components: Sequence[str],
+                   tokens: Sequence[str],
+                   groups: Sequence[Tuple[str, int]]
+                   ) -> Tuple[Sequence[Tuple[str, int, int]], Sequence[Tuple[str, int, int]]]:
+    # Components are joined by single spaces, so each starts one character after the previous one ends
+    token_spans = []
+    start = 0
+    for utterance_component, token in zip(utterance_components, tokens):
+        end = start + len(utterance_component)
+        token_spans.append((token, start, end))
+        start = end + 1
+    group_spans = []
+    start_index = 0
+    for group_name, end_index in groups:
+        group_spans.append((group_name, token_spans[start_index][1], token_spans[start_index + end_index - 1][2]))
+        start_index += end_index
+    return tuple(token_spans), tuple(group_spans)
 
 def _compute_handled_tokens(utterance_components: Sequence[str],
                             tokens: Sequence[str],
                             *,
-                            token_handler_map: Optional[Mapping[str, Callable[[str, str], str]]]
+                            token_handler_map: Optional[Mapping[str, Callable[[str, str], str]]],
+                            token_handler_cache: Optional[MutableMapping[Tuple[str, str], str]] = None
                             ) -> Sequence[str]:
-    return tuple(map(lambda utc, token, th_map: _get_token_handler(token, token_handler_map=th_map)(token, utc),
-                     utterance_components, tokens, repeat(token_handler_map)))
+    handled_tokens = []
+    for utterance_component, token in zip(utterance_components, tokens):
+        token_handler = _get_token_handler(token, token_handler_map=token_handler_map)
+        handled_tokens.append(_call_handler(token_handler, token, utterance_component, token_handler_cache))
+    return tuple(handled_tokens)
+
+def _combine_batch(batch_components: Sequence[Sequence[str]],
+                   tokens: Sequence[str],
+                   groups: Sequence[Tuple[str, int]],
+                   fields: Sequence[str],
+                   *,
+                   token_handler_map: Optional[Mapping[str, Callable[[str, str], str]]],
+                   group_handler_map: Optional[Mapping[str, Callable[[str, Sequence[str]], str]]],
+                   token_handler_cache: Optional[MutableMapping[Tuple[str, str], str]],
+                   group_handler_cache: Optional[MutableMapping[Tuple[str, Sequence[str]], str]]
+                   ) -> Iterable[_COMBINATION]:
+    nones = (None,) * len(batch_components)
+    utterances = nones # type: Sequence[Optional[str]]
+    if 'utterance' in fields:
+        utterances = [' '.join(utterance_components) for utterance_components in batch_components]
+    handled_tokens_batch = handled_groups_batch = nones # type: Sequence[Optional[Sequence[str]]]
+    # Handled tokens are computed for handled groups even if they are not a field
+    if 'handled_tokens' in fields or 'handled_groups' in fields:
+        computed_tokens_batch = _compute_handled_tokens_batch(batch_components,
+                                                              tokens,
+                                                              token_handler_map=token_handler_map,
+                                                              token_handler_cache=token_handler_cache)
+        if 'handled_tokens' in fields:
+            handled_tokens_batch = computed_tokens_batch
+        if 'handled_groups' in fields:
+            handled_groups_batch = _compute_handled_groups_batch(groups,
+                                                                 computed_tokens_batch,
+                                                                 group_handler_map,
+                                                                 group_handler_cache=group_handler_cache)
+    return zip(utterances, handled_tokens_batch, handled_groups_batch)
+
+def _compute_handled_tokens_batch(batch_components: Sequence[Sequence[str]],
+                                  tokens: Sequence[str],
+                                  *,
+                                  token_handler_map: Optional[Mapping[str, Callable[[str, str], str]]],
+                                  token_handler_cache: Optional[MutableMapping[Tuple[str, str], str]] = None
+                                  ) -> Sequence[Sequence[str]]:
+    handled_token_columns = []
+    for i, token in enumerate(tokens):
+        token_handler = _get_token_handler(token, token_handler_map=token_handler_map)
+        phrases = [utterance_components[i] for utterance_components in batch_components]
+        handled_token_columns.append(_call_handler_on_batch(token_handler, token, phrases, token_handler_cache))
+    return list(zip(*handled_token_columns))
+
+def _call_handler(handler: Callable[[str, Any], str],
+                  name: str,
+                  arg: Any,
+                  handler_cache: Optional[MutableMapping[Tuple[str, Any], str]]
+                  ) -> str:
+    if handler_cache is None or not is_pure(handler):
+        return handler(name, [arg])[0] if is_batch(handler) else handler(name, arg)
+    key = (name, arg)
+    result = handler_cache.get(key)
+    if result is None:
+        result = handler(name, [arg])[0] if is_batch(handler) else handler(name, arg)
+        handler_cache[key] = result
+    return result
+
+def _call_handler_on_batch(handler: Callable[[str, Any], Any],
+                           name: str,
+                           args: Sequence[Any],
+                           handler_cache: Optional[MutableMapping[Tuple[str, Any], str]]
+                           ) -> Sequence[str]:
+    if not is_batch(handler):
+        return [_call_handler(handler, name, arg, handler_cache) for arg in args]
+    if handler_cache is None or not is_pure(handler):
+        return list(handler(name, args))
+    # Only distinct arguments that are not cached are handled
+    results = {} # type: Dict[Any, str]
+    uncached_args = [] # type: List[Any]
+    for arg in OrderedDict.fromkeys(args):
+        result = handler_cache.get((name, arg))
+        if result is None:
+            uncached_args.append(arg)
+        else:
+            results[arg] = result
+    if uncached_args:
+        for arg, result in zip(uncached_args, handler(name, uncached_args)):
+            results[arg] = handler_cache[(name, arg)] = result
+    return [results[arg] for arg in args]
 
 def _get_token_handler(token: str,
                        *,
@@ -101,18 +622,44 @@ def _get_token_handler(token: str,
 
 def _compute_handled_groups(groups: Sequence[Tuple[str, int]],
                             handled_tokens: Sequence[str],
-                            group_handler_map: Optional[Mapping[str, Callable[[str, Sequence[str]], str]]]
+                            group_handler_map: Optional[Mapping[str, Callable[[str, Sequence[str]], str]]],
+                            *,
+                            group_handler_cache: Optional[MutableMapping[Tuple[str, Sequence[str]], str]] = None
                             ) -> Sequence[str]:
     start_index = 0
     handled_groups = []
     for group in groups:
         group_name, end_index = group
         group_handler = _get_group_handler(group_name, group_handler_map)
-        handled_group = group_handler(group_name, handled_tokens[start_index: start_index + end_index])
+        handled_group = _call_handler(group_handler,
+                                      group_name,
+                                      handled_tokens[start_index: start_index + end_index],
+                                      group_handler_cache)
         handled_groups.append(handled_group)
         start_index += end_index
     return tuple(handled_groups)
 
+def _compute_handled_groups_batch(groups: Sequence[Tuple[str, int]],
+                                  handled_tokens_batch: Sequence[Sequence[str]],
+                                  group_handler_map: Optional[Mapping[str, Callable[[str, Sequence[str]], str]]],
+                                  *,
+                                  group_handler_cache: Optional[MutableMapping[Tuple[str, Sequence[str]], str]] = None
+                                  ) -> Sequence[Sequence[str]]:
+    start_index = 0
+    handled_group_columns = []
+    for group_name, end_index in groups:
+        group_handler = _get_group_handler(group_name, group_handler_map)
+        group_handled_tokens = [handled_tokens[start_index: start_index + end_index]
+                                for handled_tokens in handled_tokens_batch]
+        handled_group_columns.append(_call_handler_on_batch(group_handler,
+                                                            group_name,
+                                                            group_handled_tokens,
+                                                            group_handler_cache))
+        start_index += end_index
+    if not handled_group_columns:
+        return [()] * len(handled_tokens_batch)
+    return list(zip(*handled_group_columns))
+
 def _get_group_handler(group_name: str,
                        group_handler_map: Optional[Mapping[str, Callable[[str, Sequence[str]], str]]]
                        ) -> Callable[[str, Sequence[str]], str]:
@@ -0,0 +1,289 @@
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+import tempfile
+from array import array
+from copy import deepcopy
+from pathlib import Path
+from typing import Any
+from typing import Callable
+from typing import Dict  # pylint: disable=unused-import
+from typing import Iterable
+from typing import List  # pylint: disable=unused-import
+from typing import Mapping
+from typing import NamedTuple
+from typing import Optional
+from typing import Sequence
+from typing import Tuple
+from typing import Union
+
+import yaml
+
+from putput.joiner import PhrasePool
+from putput.joiner import PooledSequence
+from putput.joiner import StringPool
+from putput.validator import validate_pattern_def
+
+_MAGIC = b'PUTPUT\x00\x01'
+# magic, length of the json header that follows
+_PREAMBLE = struct.Struct('<8sQ')
+# offsets are native unsigned 64-bit integers and phrase ids native unsigned ints, which memoryview.cast reads in place
+_OFFSET_SIZE = 8
+_YAML_LOADER = yaml.CBaseLoader if yaml.__with_libyaml__ else yaml.BaseLoader # type: ignore
+# Part of every compiled pattern definition's digest, so changing it orphans compiled files on disk
+_COMPILED_PATTERN_DEF_VERSION = b'1'
+
+CompiledPatternDef = NamedTuple('CompiledPatternDef', [('digest', str),
+                                                       ('pattern_def', Mapping),
+                                                       ('path', Optional[Path])])
+
+def write_compiled_expansion(compiled_path: Path,
+                             expansion: Iterable[Tuple[Sequence[Sequence[str]],
+                                                       Sequence[str],
+                                                       Sequence[Tuple[str, int]]]],
+                             *,
+                             metadata: Optional[Mapping[str, Any]] = None
+                             ) -> None:
+    """Writes the result of expander.expand to a binary file that 'CompiledExpansion' memory maps.
+
+    Each distinct phrase is written once to a pool shared by every utterance
+    component. Each distinct utterance component is written once as an array of
+    phrase ids, and utterance patterns refer to their components by index.
+
+    Args:
+        compiled_path: Path to write the binary file to.
+
+        expansion: The Iterable from expander.expand.
+
+        metadata: A json serializable mapping stored alongside the expansion.
+
+    Examples:
+        >>> import tempfile
+        >>> expansion = [((('can she get', 'may she get'), ('fries',)), ('ADD', 'ITEM'), (('ADD_ITEM', 2),))]
+        >>> with tempfile.TemporaryDirectory() as compiled_dir:
+        ...     compiled_path = Path(compiled_dir) / 'expansion.bin'
+        ...     write_compiled_expansion(compiled_path, expansion)
+        ...     num_utterance_patterns, generator = CompiledExpansion(compiled_path).expand()
+        ...     print(num_utterance_patterns)
+        ...     print(next(iter(generator)))
+        1
+        ((('can she get', 'may she get'), ('fries',)), ('ADD', 'ITEM'), (('ADD_ITEM', 2),))
+    """
+    utterance_patterns = [] # type: List[Sequence[str]]
+    groups = [] # type: List[Sequence[Tuple[str, int]]]
+    combos = [] # type: List[Sequence[int]]
+    string_pool = StringPool()
+    components_ids = [] # type: List[array]
+    # Components are shared between utterance patterns through the components cache, so they are pooled by identity
+    components_indices = {} # type: Dict[int, int]
+    pooled_components = [] # type: List[Sequence[str]]
+    for utterance_combo, tokens, pattern_groups in expansion:
+        combo = []
+        for components in utterance_combo:
+            if id(components) not in components_indices:
+                components_indices[id(components)] = len(components_ids)
+                components_ids.append(array('I', map(string_pool.intern, components)))
+                pooled_components.append(components)
+            combo.append(components_indices[id(components)])
+        utterance_patterns.append(tokens)
+        groups.append(pattern_groups)
+        combos.append(combo)
+
+    offsets_length = len(string_pool.offsets) * _OFFSET_SIZE
+    position = _align(offsets_length + len(string_pool.buffer))
+    components_positions = []
+    for ids in components_ids:
+        components_positions.append((position, len(ids)))
+        position = _align(position + len(ids) * ids.itemsize)
+    header = json.dumps({'byteorder': sys.byteorder,
+                         'id_size': array('I').itemsize,
+                         'metadata': metadata or {},
+                         'utterance_patterns': utterance_patterns,
+                         'groups': groups,
+                         'combos': combos,
+                         'pool': (len(string_pool), offsets_length, len(string_pool.buffer)),
+                         'components': components_positions}).encode('utf-8')
+
+    with compiled_path.open('wb') as compiled_file:
+        compiled_file.write(_PREAMBLE.pack(_MAGIC, len(header)))
+        compiled_file.write(header)
+        compiled_file.write(_padding(_PREAMBLE.size + len(header)))
+        compiled_file.write(string_pool.offsets.tobytes()) # type: ignore
+        compiled_file.write(string_pool.buffer)
+        compiled_file.write(_padding(offsets_length + len(string_pool.buffer)))
+        for ids in components_ids:
+            compiled_file.write(ids.tobytes())
+            compiled_file.write(_padding(len(ids) * ids.itemsize))
+
+class CompiledExpansion:
+    """Memory mapped expansion written by 'write_compiled_expansion'.
+
+    Phrases are read from the mapped file as they are used, so processes that
+    open the same file share its pages instead of each holding every phrase.
+    Utterance components are arrays of ids into one 'PhrasePool' of distinct phrases.
+
+    Args:
+        compiled_path: Path to a file written by 'write_compiled_expansion'.
+
+    Raises:
+        ValueError: If the file was not written by 'write_compiled_expansion',
+            or was written on a machine with a different byte order or int size.
+    """
+    def __init__(self, compiled_path: Path) -> None:
+        self._path = compiled_path
+        with compiled_path.open('rb') as compiled_file:
+            self._mmap = mmap.mmap(compiled_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, header_length = _PREAMBLE.unpack_from(self._mmap)
+        if magic != _MAGIC:
+            raise ValueError('{} is not a compiled expansion'.format(compiled_path))
+        header = json.loads(self._mmap[_PREAMBLE.size:_PREAMBLE.size + header_length].decode('utf-8'))
+        if header['byteorder'] != sys.byteorder or header['id_size'] != array('I').itemsize:
+            raise ValueError('{} was compiled on a machine with a different byte order or int size'.format(
+                compiled_path))
+
+        data = memoryview(self._mmap)[_align(_PREAMBLE.size + header_length):]
+        _, offsets_length, buffer_length = header['pool']
+        phrase_pool = PhrasePool(data[offsets_length:offsets_length + buffer_length],
+                                 data[:offsets_length].cast('Q'))
+        id_size = header['id_size']
+        components = tuple(PooledSequence(phrase_pool, data[position:position + num_ids * id_size].cast('I'))
+                           for position, num_ids in header['components'])
+        self._metadata = header['metadata']
+        self._utterance_patterns = tuple(map(tuple, header['utterance_patterns']))
+        self._groups = tuple(tuple(map(tuple, pattern_groups)) for pattern_groups in header['groups'])
+        self._utterance_combos = tuple(tuple(components[components_index] for components_index in combo)
+                                       for combo in header['combos'])
+
+    @property
+    def path(self) -> Path:
+        """Read-only path of the mapped file."""
+        return self._path
+
+    @property
+    def metadata(self) -> Mapping[str, Any]:
+        """Read-only metadata written alongside the expansion."""
+        return self._metadata
+
+    def expand(self,
+               *,
+               selector: Optional[Callable[[Sequence[str]], bool]] = None
+               ) -> Tuple[int, Iterable[Tuple[Sequence[Sequence[str]], Sequence[str], Sequence[Tuple[str, int]]]]]:
+        """Same as expander.expand, but reads the expansion from the mapped file.
+
+        Args:
+            selector: See expander.expand.
+
+        Returns:
+            See expander.expand.
+        """
+        expansion = tuple(zip(self._utterance_combos, self._utterance_patterns, self._groups))
+        if selector:
+            expansion = tuple(filter(lambda combo_tokens_groups: selector(combo_tokens_groups[1]), expansion))
+        return len(expansion), iter(expansion)
+
+def _align(position: int) -> int:
+    return position + len(_padding(position))
+
+def _padding(position: int) -> bytes:
+    return b'\x00' * (-position % _OFFSET_SIZE)
+
+def load_pattern_def(pattern_def_path: Path) -> Mapping:
+    """Loads a pattern definition yaml file, with every scalar as str.
+
+    Args:
+        pattern_def_path: Path to the pattern definition.
+
+    Examples:
+        >>> pattern_def_path = Path(__file__).parent.parent / 'tests' / 'doc' / 'example_pattern_definition.yml'
+        >>> load_pattern_def(pattern_def_path)['groups']
+        [{'ADD_ITEM': ['ADD', 'ITEM']}]
+    """
+    with pattern_def_path.open(encoding='utf-8') as pattern_def_file:
+        pattern_def = yaml.load(pattern_def_file, Loader=_YAML_LOADER)
+    return pattern_def
+
+def compile_pattern_def(pattern_def_source: Union[Path, Mapping],
+                        *,
+                        cache_dir: Optional[Path] = None,
+                        compiled_expansion: Optional[CompiledExpansion] = None
+                        ) -> CompiledPatternDef:
+    """Parses and validates a pattern definition.
+
+    If cache_dir is specified, compiled pattern definitions are written to it as json under
+    the digest of their content, and loaded from it instead of being parsed and validated again.
+    Every call returns a pattern definition of its own, so pass the result to every
+    'Pipeline' of the same pattern definition instead of compiling it again.
+
+    Args:
+        pattern_def_source: Path to a pattern definition yaml file, or an in-memory pattern definition.
+
+        cache_dir: Directory of compiled pattern definitions.
+
+        compiled_expansion: An expansion written by 'write_compiled_expansion'. If it was
+            compiled from the same content, the pattern definition stored with it is
+            validated and copied instead of being parsed.
+
+    Returns:
+        The digest of the pattern definition's content, the pattern definition, and
+        the path of the pattern definition, or None if it is in-memory.
+
+    Raises:
+        PatternDefinitionValidationError: If the pattern definition fails validation rules in validator.
+
+    Examples:
+        >>> pattern_def_path = Path(__file__).parent.parent / 'tests' / 'doc' / 'example_pattern_definition.yml'
+        >>> compile_pattern_def(pattern_def_path).pattern_def['groups']
+        [{'ADD_ITEM': ['ADD', 'ITEM']}]
+    """
+    if isinstance(pattern_def_source, Path):
+        content = pattern_def_source.read_bytes()
+    else:
+        pattern_def_source = _normalize_pattern_def(pattern_def_source)
+        content = json.dumps(pattern_def_source).encode('utf-8')
+    digest = hashlib.sha256(_COMPILED_PATTERN_DEF_VERSION + content).hexdigest()
+    compiled_path = cache_dir / '{}.json'.format(digest) if cache_dir else None
+    if compiled_expansion and compiled_expansion.metadata.get('pattern_def_digest') == digest:
+        # The file may have been written by anyone, so its pattern definition is validated like a parsed one
+        pattern_def = deepcopy(compiled_expansion.metadata['pattern_def'])
+        validate_pattern_def(pattern_def)
+    elif compiled_path and compiled_path.exists():
+        pattern_def = json.loads(compiled_path.read_text(encoding='utf-8'))
+    else:
+        if isinstance(pattern_def_source, Path):
+            pattern_def = yaml.load(content.decode('utf-8'), Loader=_YAML_LOADER)
+        else:
+            pattern_def = pattern_def_source
+        validate_pattern_def(pattern_def)
+        if compiled_path:
+            write_atomically(compiled_path, (json.dumps(pattern_def),))
+    return CompiledPatternDef(digest, pattern_def, pattern_def_source if isinstance(pattern_def_source, Path) else None)
+
+def write_atomically(path: Path, chunks: Iterable[str]) -> None:
+    """Writes chunks of text to a temporary file that replaces path once it is complete,
+    so concurrent jobs never load a partially written file.
+
+    Args:
+        path: Path to write to. Its parent directories are created.
+
+        chunks: Text to write.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    file_descriptor, temp_path = tempfile.mkstemp(dir=str(path.parent), suffix='.tmp')
+    try:
+        with os.fdopen(file_descriptor, 'w', encoding='utf-8') as temp_file:
+            temp_file.writelines(chunks)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    os.replace(temp_path, str(path))
+
+def _normalize_pattern_def(pattern_def: Any) -> Any:
+    # In the same shape as yaml loaded with BaseLoader: dicts, lists, and str
+    if isinstance(pattern_def, Mapping):
+        return {str(key): _normalize_pattern_def(value) for key, value in pattern_def.items()}
+    if isinstance(pattern_def, (list, tuple)):
+        return [_normalize_pattern_def(item) for item in pattern_def]
+    return str(pattern_def)
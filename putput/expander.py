@@ -1,26 +1,44 @@
+import hashlib
 import re
-from functools import lru_cache
+from array import array
+from collections import OrderedDict
 from itertools import chain
 from itertools import product
 from itertools import repeat
-from typing import Dict  # pylint: disable=unused-import
+from typing import Callable
+from typing import Dict
 from typing import Iterable
+from typing import Iterator
+from typing import List  # pylint: disable=unused-import
 from typing import Mapping
+from typing import MutableMapping
 from typing import Optional
 from typing import Sequence
+from typing import Set  # pylint: disable=unused-import
 from typing import Tuple
 from typing import Union
 from typing import cast
 
-from putput.joiner import join_combo
+from putput.joiner import ChainSequence
+from putput.joiner import PooledSequence
+from putput.joiner import ProductSequence
+from putput.joiner import StringPool
 from putput.validator import OPTIONAL_REGEX
 from putput.validator import RANGE_REGEX
+from putput.validator import order_groups
 
 
 def expand(pattern_def: Mapping,
            *,
-           dynamic_token_patterns_map: Optional[Mapping[str, Sequence[str]]] = None
-           ) -> Tuple[int, Iterable[Tuple[Sequence[Sequence[str]], Sequence[str], Sequence[Tuple[str, int]]]]]:
+           dynamic_token_patterns_map: Optional[Mapping[str, Sequence[str]]] = None,
+           selector: Optional[Callable[[Sequence[str]], bool]] = None,
+           streaming: bool = False,
+           components_cache: Optional[MutableMapping[str, Sequence[str]]] = None,
+           expanded_group_map: Optional[Mapping[str, Sequence[Sequence[str]]]] = None,
+           dedupe_phrases: bool = False,
+           string_pool: Optional[StringPool] = None
+           ) -> Tuple[Optional[int],
+                      Iterable[Tuple[Sequence[Sequence[str]], Sequence[str], Sequence[Tuple[str, int]]]]]:
     """Expands the pattern_def to prepare for combination.
 
     Args:
@@ -30,16 +48,46 @@ def expand(pattern_def: Mapping,
             pattern definition. This mapping between token and token patterns is useful in
             scenarios where tokens and token patterns cannot be known before runtime.
 
+        selector: A function with args (tokens of an expanded utterance pattern) that returns
+            whether the utterance pattern should be kept. Utterance patterns that are not
+            selected are skipped before their utterance_combo is computed.
+
+        streaming: Option to expand utterance patterns lazily, as the Iterable is consumed,
+            instead of expanding, de-duplicating, and sorting all of them up front. The first
+            utterance_combo is available immediately, but the length of the Iterable is
+            unknown, so None is returned in its place.
+
+        components_cache: A mapping between a token and its expanded utterance components
+            that is shared across calls. Tokens in the cache are not expanded again, no matter
+            how many utterance patterns they appear in, so callers must remove a token from the
+            cache when its static or dynamic token patterns change. If not specified, each call
+            uses its own cache.
+
+        expanded_group_map: The result of 'expand_group_map' for the groups in pattern_def.
+            If specified, groups are not expanded again.
+
+        dedupe_phrases: Option to remove duplicate phrases from each utterance component,
+            keeping the first occurrence, for tokens whose token patterns overlap. Components
+            are built up front instead of lazily, so lazy dynamic token patterns, such as
+            providers, are read in full. Tokens in components_cache must have been
+            expanded with the same option.
+
+        string_pool: A pool that phrases of utterance components are interned into. If
+            specified, components are built up front and stored as arrays of ids into the
+            pool, so each distinct phrase is stored once across tokens and calls, without
+            the overhead of a str object per phrase. Lazy dynamic token patterns, such as
+            providers, are read in full.
+
     Returns:
-        The length of the Iterable, and the Iterable consisting of
+        The length of the Iterable (None if streaming), and the Iterable consisting of
         an utterance_combo, tokens (that have yet to be handled),
         and groups (that have yet to be handled).
 
     Examples:
         >>> from pathlib import Path
-        >>> from putput.pipeline import _load_pattern_def
+        >>> from putput.compiled import load_pattern_def
         >>> pattern_def_path = Path(__file__).parent.parent / 'tests' / 'doc' / 'example_pattern_definition.yml'
-        >>> pattern_def = _load_pattern_def(pattern_def_path)
+        >>> pattern_def = load_pattern_def(pattern_def_path)
         >>> dynamic_token_patterns_map = {'ITEM': ('fries',)}
         >>> num_utterance_patterns, generator = expand(pattern_def,
         ...                                            dynamic_token_patterns_map=dynamic_token_patterns_map)
@@ -53,16 +101,35 @@ def expand(pattern_def: Mapping,
         ('ADD', 'ITEM', 'ADD', 'ITEM', 'CONJUNCTION', 'ITEM')
         (('ADD_ITEM', 2), ('ADD_ITEM', 2), ('None', 1), ('None', 1))
     """
-    utterance_patterns = tuple(_extract_utterance_patterns(pattern_def))
-    utterance_patterns_expanded_ranges_and_groups, groups = expand_utterance_patterns_ranges_and_groups(
-        utterance_patterns, get_base_item_map(pattern_def, 'groups'))
+    utterance_patterns = _extract_utterance_patterns(pattern_def)
+    group_map = get_base_item_map(pattern_def, 'groups')
+    if streaming:
+        patterns_and_groups = stream_utterance_patterns_ranges_and_groups(
+            utterance_patterns,
+            group_map,
+            expanded_group_map=expanded_group_map) # type: Iterable[Tuple[Sequence[str], Sequence[Tuple[str, int]]]]
+    else:
+        patterns_and_groups = tuple(zip(*expand_utterance_patterns_ranges_and_groups(
+            tuple(utterance_patterns), group_map, expanded_group_map=expanded_group_map)))
+    if selector:
+        patterns_and_groups = filter(lambda pattern_and_group: selector(pattern_and_group[0]), # type: ignore
+                                     patterns_and_groups)
+        if not streaming:
+            patterns_and_groups = tuple(patterns_and_groups)
 
     def _expand() -> Iterable[Tuple[Sequence[Sequence[str]], Sequence[str], Sequence[Tuple[str, int]]]]:
-        token_patterns_map = _get_token_patterns_map(pattern_def, dynamic_token_patterns_map=dynamic_token_patterns_map)
-        for utterance_pattern, group in zip(utterance_patterns_expanded_ranges_and_groups, groups):
-            utterance_combo = _compute_utterance_combo(utterance_pattern, token_patterns_map)
+        cache = {} if components_cache is None else components_cache # type: MutableMapping[str, Sequence[str]]
+        token_patterns_map = _LazyTokenPatternsMap(pattern_def, dynamic_token_patterns_map=dynamic_token_patterns_map)
+        for utterance_pattern, group in patterns_and_groups:
+            utterance_combo = _compute_utterance_combo(utterance_pattern,
+                                                       token_patterns_map,
+                                                       cache,
+                                                       dedupe_phrases=dedupe_phrases,
+                                                       string_pool=string_pool)
             yield utterance_combo, tuple(utterance_pattern), tuple(group)
-    return len(utterance_patterns_expanded_ranges_and_groups), _expand()
+    if streaming:
+        return None, _expand()
+    return len(cast(Sequence, patterns_and_groups)), _expand()
 
 def _extract_utterance_patterns(pattern_def: Mapping) -> Iterable[Sequence[str]]:
     for utterance_pattern_or_intent in pattern_def['utterance_patterns']:
@@ -74,7 +141,10 @@ def _extract_utterance_patterns(pattern_def: Mapping) -> Iterable[Sequence[str]]
             yield utterance_pattern_or_intent
 
 def expand_utterance_patterns_ranges_and_groups(utterance_patterns: Sequence[Sequence[str]],
-                                                group_map: Mapping[str, Sequence[str]]
+                                                group_map: Mapping[str, Sequence[str]],
+                                                *,
+                                                expanded_group_map: Optional[Mapping[str,
+                                                                                     Sequence[Sequence[str]]]] = None
                                                 ) -> Tuple[Sequence[Sequence[str]],
                                                            Sequence[Sequence[Tuple[str, int]]]]:
     """Expands ranges and groups in utterance patterns, ensuring each utterance pattern is unique.
@@ -84,6 +154,9 @@ def expand_utterance_patterns_ranges_and_groups(utterance_patterns: Sequence[Seq
 
         group_map: A mapping between a group name and the tokens that make up the group.
 
+        expanded_group_map: The result of 'expand_group_map' for group_map. If specified,
+            group_map is not expanded again.
+
     Returns:
         A tuple of utterance patterns with group names and ranges replaced by tokens, and
         groups which are tuples of (group_name, number of tokens the group spans).
@@ -97,23 +170,96 @@ def expand_utterance_patterns_ranges_and_groups(utterance_patterns: Sequence[Seq
         >>> tuple(sorted(groups, key=lambda item: len(item)))
         ((('None', 1), ('PLAY_ARTIST', 2)), (('None', 1), ('PLAY_ARTIST', 2), ('PLAY_ARTIST', 2)))
     """
-    expanded_ranges = _expand_utterance_patterns_ranges(utterance_patterns)
-    expanded_ranges_groups, groups = _expand_utterance_patterns_groups(expanded_ranges, group_map)
-    deduped_expanded_ranges_groups, groups = zip(*sorted(set(zip(expanded_ranges_groups, groups))))
+    deduped_expanded_ranges_groups, groups = zip(*sorted(stream_utterance_patterns_ranges_and_groups(
+        utterance_patterns, group_map, expanded_group_map=expanded_group_map)))
     return deduped_expanded_ranges_groups, groups
 
-def _expand_utterance_patterns_ranges(utterance_patterns: Sequence[Sequence[str]]) -> Sequence[Sequence[str]]:
-    utterance_patterns_expanded_optional = tuple(chain.from_iterable(map(_expand_optional, utterance_patterns)))
-    return tuple(chain.from_iterable(map(_expand_ranges, utterance_patterns_expanded_optional)))
+def stream_utterance_patterns_ranges_and_groups(utterance_patterns: Iterable[Sequence[str]],
+                                               group_map: Mapping[str, Sequence[str]],
+                                               *,
+                                               expanded_group_map: Optional[Mapping[str,
+                                                                                    Sequence[Sequence[str]]]] = None
+                                               ) -> Iterable[Tuple[Sequence[str], Sequence[Tuple[str, int]]]]:
+    """Lazily expands ranges and groups in utterance patterns, yielding each unique utterance pattern once.
+
+    Expansions are yielded in generation order: the order of 'utterance_patterns', then the order
+    of their optionals, ranges, and groups. Rather than collecting and sorting every expansion,
+    duplicates are detected with a 16 byte digest of each expansion already yielded, so the first
+    expansion is available immediately. Different utterance patterns can expand to the same
+    expansion, so the digests are kept for the whole generator: memory grows by 16 bytes per
+    unique expansion, regardless of how many tokens the expansion has.
+
+    Args:
+        utterance_patterns: utterance_patterns section of pattern_def.
+
+        group_map: A mapping between a group name and the tokens that make up the group.
+
+        expanded_group_map: The result of 'expand_group_map' for group_map. If specified,
+            group_map is not expanded again.
+
+    Yields:
+        An utterance pattern with group names and ranges replaced by tokens, and its
+        groups which are tuples of (group_name, number of tokens the group spans).
+
+    Examples:
+        >>> utterance_patterns = [['WAKE', 'PLAY_ARTIST', '1-2'], ['WAKE', 'PLAY_ARTIST']]
+        >>> group_map = {'PLAY_ARTIST': ('PLAY', 'ARTIST')}
+        >>> for pattern, groups in stream_utterance_patterns_ranges_and_groups(utterance_patterns, group_map):
+        ...     print(pattern, groups)
+        ('WAKE', 'PLAY', 'ARTIST') (('None', 1), ('PLAY_ARTIST', 2))
+        ('WAKE', 'PLAY', 'ARTIST', 'PLAY', 'ARTIST') (('None', 1), ('PLAY_ARTIST', 2), ('PLAY_ARTIST', 2))
+    """
+    if expanded_group_map is None:
+        expanded_group_map = expand_group_map(group_map)
+    seen_digests = set() # type: Set[bytes]
+    for utterance_pattern in utterance_patterns:
+        for utterance_pattern_expanded_optional in _iter_optional(utterance_pattern):
+            for utterance_pattern_expanded_ranges in _iter_ranges(utterance_pattern_expanded_optional):
+                for expanded_pattern, groups in _iter_groups(utterance_pattern_expanded_ranges, expanded_group_map):
+                    digest = _digest(expanded_pattern, groups)
+                    if digest not in seen_digests:
+                        seen_digests.add(digest)
+                        yield expanded_pattern, groups
+
+def expand_utterance_pattern_keys(keys: Iterable[str],
+                                  expanded_group_map: Mapping[str, Sequence[Sequence[str]]]
+                                  ) -> Mapping[str, Sequence[str]]:
+    """Expands keys of maps with utterance patterns as keys, such as 'combo_hooks_map', in one pass.
+
+    Every key shares 'expanded_group_map', so groups are expanded once for all keys
+    rather than once per key. The key 'DEFAULT' is not an utterance pattern and is skipped.
+
+    Args:
+        keys: Utterance patterns as ', ' separated tokens.
+
+        expanded_group_map: The result of 'expand_group_map'.
+
+    Returns:
+        A mapping between each key and the keys of its expanded utterance patterns.
+
+    Examples:
+        >>> expanded_group_map = expand_group_map({'PLAY_ARTIST': ('PLAY', 'ARTIST')})
+        >>> expand_utterance_pattern_keys(['WAKE, PLAY_ARTIST, 1-2', 'DEFAULT'], expanded_group_map)
+        {'WAKE, PLAY_ARTIST, 1-2': ('WAKE, PLAY, ARTIST', 'WAKE, PLAY, ARTIST, PLAY, ARTIST')}
+    """
+    return {key: tuple(dict.fromkeys(', '.join(pattern) for pattern, _ in stream_utterance_patterns_ranges_and_groups(
+        (key.split(', '),), {}, expanded_group_map=expanded_group_map)))
+            for key in keys if key != 'DEFAULT'}
+
+def _digest(utterance_pattern: Sequence[str], groups: Sequence[Tuple[str, int]]) -> bytes:
+    return hashlib.sha256(repr((utterance_pattern, groups)).encode('utf-8')).digest()[:16]
 
 def _expand_ranges(utterance_pattern: Sequence[str]) -> Sequence[Sequence[str]]:
+    return tuple(_iter_ranges(utterance_pattern))
+
+def _iter_ranges(utterance_pattern: Sequence[str]) -> Iterable[Sequence[str]]:
     ranges = tuple(map(_parse_ranges, utterance_pattern))
     aligned_ranges_and_tokens = zip(ranges[1:] + ((0, 0),), utterance_pattern)
     aligned_range_tokens = map(lambda r_and_t: r_and_t[0] + (r_and_t[1],), aligned_ranges_and_tokens)
     range_tokens = filter(lambda r_and_t: not re.match(RANGE_REGEX, r_and_t[2]), aligned_range_tokens)
-    utterance_pattern_expanded_ranges = tuple(map(tuple, map(chain.from_iterable, product( # type: ignore
-        *map(_expand_tokens, range_tokens)))))  # type: ignore
-    return cast(Sequence[Sequence[str]], utterance_pattern_expanded_ranges)
+    utterance_pattern_expanded_ranges = map(tuple, map(chain.from_iterable, product( # type: ignore
+        *map(_expand_tokens, range_tokens))))  # type: ignore
+    return cast(Iterable[Sequence[str]], utterance_pattern_expanded_ranges)
 
 def _parse_ranges(token: str) -> Tuple[int, int]:
     if re.match(RANGE_REGEX, token):
@@ -146,6 +292,34 @@ def _get_token_patterns_map(pattern_def: Mapping,
         token_patterns_map.update(_expand_dynamic_token_patterns_map(dynamic_token_patterns_map))
     return token_patterns_map
 
+class _LazyTokenPatternsMap(Mapping[str, Sequence[Sequence[Sequence[str]]]]):
+    # Expands tokens on lookup, so expansions served from a cache expand nothing,
+    # and a dynamic token that changed is expanded without the static tokens
+    def __init__(self,
+                 pattern_def: Mapping,
+                 *,
+                 dynamic_token_patterns_map: Optional[Mapping[str, Sequence[str]]] = None
+                 ) -> None:
+        self._pattern_def = pattern_def
+        self._dynamic_token_patterns_map = dynamic_token_patterns_map or {}
+        self._static_token_patterns_map = None # type: Optional[Mapping[str, Sequence[Sequence[Sequence[str]]]]]
+
+    def _get_static_token_patterns_map(self) -> Mapping[str, Sequence[Sequence[Sequence[str]]]]:
+        if self._static_token_patterns_map is None:
+            self._static_token_patterns_map = _get_static_token_patterns_map(self._pattern_def)
+        return self._static_token_patterns_map
+
+    def __getitem__(self, token: str) -> Sequence[Sequence[Sequence[str]]]:
+        if token in self._dynamic_token_patterns_map:
+            return _expand_dynamic_token_patterns_map({token: self._dynamic_token_patterns_map[token]})[token]
+        return self._get_static_token_patterns_map()[token]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(set(self._get_static_token_patterns_map()) | set(self._dynamic_token_patterns_map))
+
+    def __len__(self) -> int:
+        return len(set(self._get_static_token_patterns_map()) | set(self._dynamic_token_patterns_map))
+
 def get_base_item_map(pattern_def: Mapping, base_key: str) -> Mapping[str, Sequence[str]]:
     """Returns base item map or an empty dictionary if one does not exist.
 
@@ -156,9 +330,9 @@ def get_base_item_map(pattern_def: Mapping, base_key: str) -> Mapping[str, Seque
 
     Examples:
         >>> from pathlib import Path
-        >>> from putput.pipeline import _load_pattern_def
+        >>> from putput.compiled import load_pattern_def
         >>> pattern_def_path = Path(__file__).parent.parent / 'tests' / 'doc' / 'example_pattern_definition.yml'
-        >>> pattern_def = _load_pattern_def(pattern_def_path)
+        >>> pattern_def = load_pattern_def(pattern_def_path)
         >>> get_base_item_map(pattern_def, 'groups')
         {'ADD_ITEM': ('ADD', 'ITEM')}
         >>> get_base_item_map(pattern_def, 'base_tokens')
@@ -171,6 +345,39 @@ def get_base_item_map(pattern_def: Mapping, base_key: str) -> Mapping[str, Seque
                 for base_item_map in pattern_def[base_key]}
     return {}
 
+def get_intent_map(pattern_def: Mapping) -> Mapping[str, str]:
+    """Returns a mapping between each utterance pattern with an intent and its intent.
+
+    Args:
+        pattern_def: A dictionary representation of the pattern definition.
+
+    Examples:
+        >>> get_intent_map({'utterance_patterns': [{'ADD_INTENT': [['ADD_ITEM', 'ITEM']]}, ['WAKE']]})
+        {'ADD_ITEM, ITEM': 'ADD_INTENT'}
+    """
+    intent_map = {}
+    for utterance_pattern_tokens in pattern_def['utterance_patterns']:
+        if isinstance(utterance_pattern_tokens, dict):
+            for intent, utterance_patterns in utterance_pattern_tokens.items():
+                for utterance_pattern in utterance_patterns:
+                    utterance_pattern_key = ', '.join(utterance_pattern)
+                    intent_map[utterance_pattern_key] = intent
+    return intent_map
+
+def get_dynamic_tokens(pattern_def: Mapping) -> Sequence[str]:
+    """Returns the dynamic tokens of a pattern definition.
+
+    Args:
+        pattern_def: A dictionary representation of the pattern definition.
+
+    Examples:
+        >>> get_dynamic_tokens({'token_patterns': [{'static': [{'WAKE': [['hi']]}]}, {'dynamic': ['ITEM']}]})
+        ['ITEM']
+    """
+    return [token
+            for token_type_map in pattern_def['token_patterns']
+            for token in token_type_map.get('dynamic', ())]
+
 def _get_static_token_patterns_map(pattern_def: Mapping) -> Mapping[str, Sequence[Sequence[Sequence[str]]]]:
     return {
         token: _expand_static_token_patterns(pattern_def, token_patterns)
@@ -183,7 +390,9 @@ def _get_static_token_patterns_map(pattern_def: Mapping) -> Mapping[str, Sequenc
 
 def _expand_dynamic_token_patterns_map(dynamic_token_patterns: Mapping[str, Sequence[str]]
                                        ) -> Mapping[str, Sequence[Sequence[Sequence[str]]]]:
-    return {token: ((tuple(patterns),),) for token, patterns in dynamic_token_patterns.items()}
+    # Sequences, such as the lazy providers in putput.providers, are used as is, so catalogs are never copied
+    return {token: ((patterns if isinstance(patterns, Sequence) else tuple(patterns),),)
+            for token, patterns in dynamic_token_patterns.items()}
 
 def _expand_static_token_patterns(pattern_def: Mapping,
                                   token_patterns: Sequence[Sequence[Union[str, Sequence[str]]]]
@@ -203,40 +412,60 @@ def _expand_base_tokens(pattern_def: Mapping,
     return tuple(tuple(base_token_map[component] if isinstance(component, str) else component
                        for component in token_pattern) for token_pattern in token_patterns)
 
-def _expand_utterance_patterns_groups(utterance_patterns: Sequence[Sequence[str]],
-                                      group_map: Mapping[str, Sequence[str]]
-                                      ) -> Tuple[Sequence[Sequence[str]], Sequence[Sequence[Tuple[str, int]]]]:
-    expanded_group_map = _expand_group_map(group_map)
-    utterance_pattern_expanded_groups = tuple(chain.from_iterable(map(_expand_groups,
-                                                                      utterance_patterns, repeat(expanded_group_map))))
-    expanded_groups = tuple(chain.from_iterable(map(_create_groups,
-                                                    utterance_patterns, repeat(expanded_group_map))))
-    return utterance_pattern_expanded_groups, expanded_groups
-
-def _expand_group_map(group_map: Mapping[str, Sequence[str]]) -> Mapping[str, Sequence[Sequence[str]]]:
+def expand_group_map(group_map: Mapping[str, Sequence[str]]) -> Mapping[str, Sequence[Sequence[str]]]:
+    """Expands optionals, ranges, and nested groups in each group.
+
+    Args:
+        group_map: A mapping between a group name and the tokens that make up the group.
+
+    Returns:
+        A mapping between a group name and every sequence of tokens the group can be replaced by.
+
+    Raises:
+        PatternDefinitionValidationError: If groups reference each other in a cycle.
+
+    Examples:
+        >>> expand_group_map({'PLAYS': ('PLAY', '1-2'), 'PLAY_PHRASE': ('(|START)', 'PLAYS')})
+        {'PLAYS': (('PLAY',), ('PLAY', 'PLAY')), 'PLAY_PHRASE': (('PLAY',), ('PLAY', 'PLAY'),
+        ('START', 'PLAY'), ('START', 'PLAY', 'PLAY'))}
+    """
     group_map_expanded_optional = {name: _expand_optional(pattern) for name, pattern in group_map.items()}
     group_map_expanded_optional_and_range = {name: tuple(chain(*map(_expand_ranges, patterns)))
                                              for name, patterns in group_map_expanded_optional.items()}
-    expanded_group_map = {name : _expand_group_map_groups(patterns, group_map_expanded_optional_and_range)
-                          for name, patterns in group_map_expanded_optional_and_range.items()}
+    group_references = {name: {token for pattern in patterns for token in pattern
+                               if token in group_map_expanded_optional_and_range}
+                        for name, patterns in group_map_expanded_optional_and_range.items()}
+    # Groups form a DAG: each group is expanded once, after the groups it references,
+    # and its expansion is reused by every group that references it.
+    expanded_group_map = {} # type: Dict[str, Sequence[Sequence[str]]]
+    for name in order_groups(group_references):
+        expanded_group_map[name] = tuple(chain.from_iterable(map(_expand_groups,
+                                                                 group_map_expanded_optional_and_range[name],
+                                                                 repeat(expanded_group_map))))
     return expanded_group_map
 
 def _expand_optional(utterance_pattern: Sequence[str]) -> Sequence[Sequence[str]]:
-    optional_parsed = map(_parse_optional, utterance_pattern)
-    return cast(Sequence[Sequence[str]], tuple(map(lambda x: tuple(filter(None, x)), product(*optional_parsed))))
+    return tuple(_iter_optional(utterance_pattern))
 
-def _expand_group_map_groups(patterns: Sequence[Sequence[str]],
-                             expanded_group_map: Mapping[str, Sequence[Sequence[str]]]) -> Sequence[Sequence[str]]:
-    if not any(token in expanded_group_map for pattern in patterns for token in pattern):
-        return patterns
-    expanded_patterns = tuple(chain.from_iterable(map(_expand_groups, patterns, repeat(expanded_group_map))))
-    return _expand_group_map_groups(expanded_patterns, expanded_group_map)
-
-def _create_groups(utterance_pattern: Sequence[str],
-                   expanded_group_map: Mapping[str, Sequence[Sequence[str]]]
-                   ) -> Iterable[Sequence[Tuple[str, int]]]:
-    groups = map(_get_groups, utterance_pattern, repeat(expanded_group_map))
-    return product(*groups)
+def _iter_optional(utterance_pattern: Sequence[str]) -> Iterable[Sequence[str]]:
+    optional_parsed = map(_parse_optional, utterance_pattern)
+    return cast(Iterable[Sequence[str]], map(lambda x: tuple(filter(None, x)), product(*optional_parsed)))
+
+def _iter_groups(utterance_pattern: Sequence[str],
+                 expanded_group_map: Mapping[str, Sequence[Sequence[str]]]
+                 ) -> Iterable[Tuple[Sequence[str], Sequence[Tuple[str, int]]]]:
+    # Each choice pairs the tokens a group name is replaced by with the group that spans them
+    choices = map(_get_group_choices, utterance_pattern, repeat(expanded_group_map))
+    for choice in product(*choices):
+        yield (tuple(chain.from_iterable(tokens for tokens, _ in choice)),
+               tuple(group for _, group in choice))
+
+def _get_group_choices(token: str,
+                       expanded_group_map: Mapping[str, Sequence[Sequence[str]]]
+                       ) -> Sequence[Tuple[Sequence[str], Tuple[str, int]]]:
+    if token not in expanded_group_map:
+        return (((token,), ('None', 1)),)
+    return tuple((group, (token, len(group))) for group in expanded_group_map[token])
 
 def _expand_groups(utterance_pattern: Sequence[str],
                    expanded_group_map: Mapping[str, Sequence[Sequence[str]]]
@@ -246,25 +475,187 @@ def _expand_groups(utterance_pattern: Sequence[str],
     expanded_groups = map(tuple, map(chain.from_iterable, product(*utterance_pattern_replaced_groups))) # type: ignore
     return cast(Iterable[Sequence[str]], expanded_groups)
 
-def _get_groups(token: str, expanded_group_map: Mapping[str, Sequence[Sequence[str]]]) -> Iterable[Tuple[str, int]]:
-    if token not in expanded_group_map:
-        return (('None', 1),)
-    return map(lambda token, group: (token, len(group)), repeat(token), expanded_group_map[token])
-
 def _compute_utterance_combo(utterance_pattern: Sequence[str],
-                             token_patterns_map: Mapping[str, Sequence[Sequence[Sequence[str]]]]
+                             token_patterns_map: Mapping[str, Sequence[Sequence[Sequence[str]]]],
+                             components_cache: Optional[MutableMapping[str, Sequence[str]]] = None,
+                             *,
+                             dedupe_phrases: bool = False,
+                             string_pool: Optional[StringPool] = None
                              ) -> Sequence[Sequence[str]]:
-    expanded_utterance_pattern = tuple(token_patterns_map[token] for token in utterance_pattern)
-    utterance_combo = tuple(map(_expand_utterance_components, expanded_utterance_pattern))
+    if components_cache is None:
+        components_cache = {}
+    utterance_combo = tuple(_get_utterance_components(token,
+                                                      token_patterns_map,
+                                                      components_cache,
+                                                      dedupe_phrases=dedupe_phrases,
+                                                      string_pool=string_pool)
+                            for token in utterance_pattern)
     return utterance_combo
 
-def _expand_utterance_components(token_patterns: Sequence[Sequence[Sequence[str]]]) -> Sequence[str]:
-    hashable_token_patterns = _convert_token_patterns_to_tuples(token_patterns)
-    expanded_token_patterns = tuple(_expand_token_pattern(token_pattern)
-                                    for token_pattern in hashable_token_patterns)
-    utterance_components = tuple(chain.from_iterable(expanded_token_patterns))
-    return utterance_components
+def _get_utterance_components(token: str,
+                              token_patterns_map: Mapping[str, Sequence[Sequence[Sequence[str]]]],
+                              components_cache: MutableMapping[str, Sequence[str]],
+                              *,
+                              dedupe_phrases: bool = False,
+                              string_pool: Optional[StringPool] = None
+                              ) -> Sequence[str]:
+    components = components_cache.get(token)
+    if components is None:
+        components = _expand_utterance_components(token_patterns_map[token],
+                                                  dedupe_phrases=dedupe_phrases,
+                                                  string_pool=string_pool)
+        components_cache[token] = components
+    return components
+
+def _expand_utterance_components(token_patterns: Sequence[Sequence[Sequence[str]]],
+                                 *,
+                                 dedupe_phrases: bool = False,
+                                 string_pool: Optional[StringPool] = None
+                                 ) -> Sequence[str]:
+    expanded_token_patterns = tuple(map(_expand_token_pattern, token_patterns))
+    if len(expanded_token_patterns) == 1:
+        components = expanded_token_patterns[0]
+    else:
+        components = ChainSequence(expanded_token_patterns)
+    if string_pool is not None:
+        ids = map(string_pool.intern, components)
+        if dedupe_phrases:
+            ids = OrderedDict.fromkeys(ids) # type: ignore
+        return PooledSequence(string_pool, array('I', ids))
+    if dedupe_phrases:
+        return tuple(OrderedDict.fromkeys(components))
+    return components
+
+def expand_delta(utterance_combo: Sequence[Sequence[str]],
+                 tokens: Sequence[str],
+                 delta: Mapping[str, Sequence[str]],
+                 *,
+                 partitions_cache: Optional[MutableMapping[str, Tuple[Sequence[str],
+                                                                      Tuple[Sequence[str],
+                                                                            Sequence[str],
+                                                                            Sequence[str]]]]] = None
+                 ) -> Iterable[Sequence[Sequence[str]]]:
+    """Splits an utterance_combo into utterance_combos that only produce combinations with new phrases.
+
+    Together, the utterance_combos produce every combination of utterance_combo that has
+    at least one of the new phrases in delta, and each such combination once. Each
+    utterance_combo fixes the first new phrase to one position of a token in delta:
+    earlier positions of tokens in delta keep only old phrases, and later positions
+    keep all phrases. New phrases missing from a token's components are added to them.
 
-@lru_cache(maxsize=None)
-def _expand_token_pattern(token_pattern: Tuple[Tuple[str, ...], ...]) -> Sequence[str]:
-    return tuple(' '.join(phrase) for phrase in join_combo(token_pattern))
+    Args:
+        utterance_combo: An utterance_combo from expand.
+
+        tokens: Tokens of utterance_combo.
+
+        delta: A mapping between a token and its new phrases.
+
+        partitions_cache: A mapping between a token and its components, with their old,
+            new, and all phrases, that is shared across calls. Entries are only used
+            for the components they were computed for.
+
+    Yields:
+        utterance_combos, with no empty components.
+
+    Examples:
+        >>> utterance_combo = (('hi', 'hey'), ('kanye', 'nico'), ('and',), ('kanye', 'nico'))
+        >>> tokens = ('WAKE', 'ARTIST', 'CONJUNCTION', 'ARTIST')
+        >>> for delta_combo in expand_delta(utterance_combo, tokens, {'ARTIST': ('nico',)}):
+        ...     print(delta_combo)
+        (('hi', 'hey'), ('nico',), ('and',), ('kanye', 'nico'))
+        (('hi', 'hey'), ('kanye',), ('and',), ('nico',))
+    """
+    if partitions_cache is None:
+        partitions_cache = {}
+    partitions = [] # type: List[Optional[Tuple[Sequence[str], Sequence[str], Sequence[str]]]]
+    for token, components in zip(tokens, utterance_combo):
+        if token not in delta:
+            partitions.append(None)
+            continue
+        cached = partitions_cache.get(token)
+        if cached is None or cached[0] is not components:
+            cached = (components, _partition_components(components, delta[token]))
+            partitions_cache[token] = cached
+        partitions.append(cached[1])
+
+    for first_new_position, first_new_partition in enumerate(partitions):
+        if first_new_partition is None:
+            continue
+        delta_combo = []
+        for position, (components, partition) in enumerate(zip(utterance_combo, partitions)):
+            if partition is None:
+                delta_combo.append(components)
+            else:
+                old_phrases, new_phrases, all_phrases = partition
+                if position < first_new_position:
+                    delta_combo.append(old_phrases)
+                elif position == first_new_position:
+                    delta_combo.append(new_phrases)
+                else:
+                    delta_combo.append(all_phrases)
+        if all(delta_combo):
+            yield tuple(delta_combo)
+
+def _partition_components(components: Sequence[str],
+                          new_phrases: Sequence[str]
+                          ) -> Tuple[Sequence[str], Sequence[str], Sequence[str]]:
+    deduped_new_phrases = tuple(OrderedDict.fromkeys(new_phrases))
+    new_phrase_set = set(deduped_new_phrases)
+    found_new_phrases = set() # type: Set[str]
+    old_phrases = []
+    for phrase in components:
+        if phrase in new_phrase_set:
+            found_new_phrases.add(phrase)
+        else:
+            old_phrases.append(phrase)
+    if found_new_phrases == new_phrase_set:
+        return tuple(old_phrases), deduped_new_phrases, components
+    return tuple(old_phrases), deduped_new_phrases, tuple(old_phrases) + deduped_new_phrases
+
+def get_overlapping_token_patterns(pattern_def: Mapping,
+                                   *,
+                                   dynamic_token_patterns_map: Optional[Mapping[str, Sequence[str]]] = None
+                                   ) -> Mapping[str, Sequence[Tuple[int, int]]]:
+    """Reports token patterns that expand to at least one of the same phrases.
+
+    Overlapping token patterns produce duplicate utterances, which can be removed
+    at expansion time with the 'dedupe_phrases' option. Every phrase is read,
+    including those of lazy dynamic token patterns, such as providers.
+
+    Args:
+        pattern_def: A dictionary representation of the pattern definition.
+
+        dynamic_token_patterns_map: The 'dynamic' counterpart to the 'static' section in the
+            pattern definition.
+
+    Returns:
+        A mapping between a token and pairs of indices of its overlapping token patterns.
+        A pair with the same index twice is a token pattern that repeats its own phrases.
+        Tokens without overlapping token patterns are not included.
+
+    Examples:
+        >>> pattern_def = {'token_patterns': [{'static': [{'ADD': [[['can'], ['get']],
+        ...                                                        [['can', 'may'], ['get']]]}]}]}
+        >>> get_overlapping_token_patterns(pattern_def)
+        {'ADD': ((0, 1),)}
+    """
+    token_patterns_map = _get_token_patterns_map(pattern_def, dynamic_token_patterns_map=dynamic_token_patterns_map)
+    overlapping_token_patterns = {} # type: Dict[str, Sequence[Tuple[int, int]]]
+    for token, token_patterns in token_patterns_map.items():
+        phrase_owners = {} # type: Dict[str, List[int]]
+        overlaps = set() # type: Set[Tuple[int, int]]
+        for index, token_pattern in enumerate(token_patterns):
+            for phrase in _expand_token_pattern(token_pattern):
+                owners = phrase_owners.setdefault(phrase, [])
+                overlaps.update((owner, index) for owner in owners)
+                if not owners or owners[-1] != index:
+                    owners.append(index)
+        if overlaps:
+            overlapping_token_patterns[token] = tuple(sorted(overlaps))
+    return overlapping_token_patterns
+
+def _expand_token_pattern(token_pattern: Sequence[Sequence[str]]) -> Sequence[str]:
+    if len(token_pattern) == 1:
+        return token_pattern[0]
+    # Phrases are joined lazily, so only those that are sampled are ever built
+    return ProductSequence(token_pattern)
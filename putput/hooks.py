@@ -0,0 +1,211 @@
+from difflib import SequenceMatcher
+from itertools import islice
+from typing import Any
+from typing import Callable
+from typing import Iterable
+from typing import List  # pylint: disable=unused-import
+from typing import Mapping
+from typing import Optional
+from typing import Sequence
+from typing import Tuple
+
+from putput.combiner import LabeledUtterance
+from putput.combiner import is_batch
+from putput.combiner import is_with_spans
+
+SPAN = Tuple[str, int, int]
+_SPANS = Tuple[Sequence[SPAN], Sequence[SPAN]]
+_HOOKS_MAP = Mapping[str, Sequence[Callable]]
+
+def get_hooks(tokens: Sequence[str], hooks_map: Optional[_HOOKS_MAP]) -> Sequence[Callable]:
+    """Returns the hooks of an utterance pattern, or the 'DEFAULT' hooks if it has none.
+
+    Args:
+        tokens: Tokens of an expanded utterance pattern.
+
+        hooks_map: 'expansion_hooks_map' or 'combo_hooks_map' of a Pipeline.
+
+    Examples:
+        >>> get_hooks(('WAKE', 'ARTIST'), {'WAKE, ARTIST': (print,), 'DEFAULT': ()})
+        (<built-in function print>,)
+    """
+    if not hooks_map:
+        return ()
+    key = ', '.join(tokens)
+    return hooks_map.get(key, hooks_map.get('DEFAULT', ()))
+
+def apply_combo_hooks(tokens: Sequence[str],
+                      results: Iterable[Any],
+                      hooks_map: Optional[_HOOKS_MAP],
+                      *,
+                      spans: bool = False,
+                      batch_size: Optional[int] = None
+                      ) -> Iterable[Any]:
+    """Applies the combo hooks of an utterance pattern to each result of combiner.combine.
+
+    Args:
+        tokens: Tokens of an expanded utterance pattern.
+
+        results: Results of combiner.combine for the utterance pattern.
+
+        hooks_map: 'combo_hooks_map' of a Pipeline.
+
+        spans: Whether results were combined with spans, which are split off and given
+            to hooks marked with combiner.with_spans.
+
+        batch_size: If specified, results are passed to 'execute_batch_hooks' in batches of this size.
+
+    Yields:
+        The output of the last hook for each result.
+    """
+    if hooks_map and batch_size:
+        results = iter(results)
+        batch_results = list(islice(results, batch_size))
+        while batch_results:
+            batch_spans = None # type: Optional[List[_SPANS]]
+            if spans:
+                split_results = [split_spans(result) for result in batch_results]
+                batch_results = [result for result, _ in split_results]
+                batch_spans = [result_spans for _, result_spans in split_results]
+            yield from execute_batch_hooks(tokens, batch_results, hooks_map, batch_spans=batch_spans)
+            batch_results = list(islice(results, batch_size))
+    else:
+        for result in results:
+            result_spans = None # type: Optional[_SPANS]
+            if spans:
+                result, result_spans = split_spans(result)
+            yield execute_hooks(tokens, result, hooks_map, spans=result_spans) if hooks_map else result
+
+def execute_hooks(tokens: Sequence[str],
+                  args: Any,
+                  hooks_map: _HOOKS_MAP,
+                  *,
+                  spans: Optional[_SPANS] = None
+                  ) -> Any:
+    """Applies the hooks of an utterance pattern in order, where the output of a hook is the input to the next.
+
+    Args:
+        tokens: Tokens of an expanded utterance pattern.
+
+        args: The input to the first hook.
+
+        hooks_map: 'expansion_hooks_map' or 'combo_hooks_map' of a Pipeline.
+
+        spans: Token spans and group spans of the utterance in args, given to hooks
+            marked with combiner.with_spans. If an earlier hook changes the utterance,
+            spans are realigned to it with 'realign_spans' first.
+
+    Returns:
+        The output of the last hook, or args if there are no hooks.
+    """
+    spans_args = args
+    for hook in get_hooks(tokens, hooks_map):
+        if spans is not None and is_with_spans(hook) and args is not spans_args:
+            spans, spans_args = _realign_spans_to_args(spans, spans_args, args), args
+        args = _call_hook(hook, args, spans)
+    return args
+
+def execute_batch_hooks(tokens: Sequence[str],
+                        batch_args: Sequence[Any],
+                        hooks_map: _HOOKS_MAP,
+                        *,
+                        batch_spans: Optional[Sequence[_SPANS]] = None
+                        ) -> Sequence[Any]:
+    """Same as 'execute_hooks', but for a batch of combinations of the same utterance pattern.
+
+    Hooks marked with combiner.batch are called once with the whole batch, and other
+    hooks once per combination.
+
+    Args:
+        tokens: Tokens of an expanded utterance pattern.
+
+        batch_args: The input to the first hook of each combination.
+
+        hooks_map: 'combo_hooks_map' of a Pipeline.
+
+        batch_spans: Token spans and group spans of each combination, realigned like in 'execute_hooks'.
+
+    Returns:
+        The output of the last hook of each combination.
+    """
+    spans_batch_args = batch_args
+    for hook in get_hooks(tokens, hooks_map):
+        if batch_spans is not None and is_with_spans(hook) and batch_args is not spans_batch_args:
+            batch_spans = [_realign_spans_to_args(spans, spans_args, args)
+                           for spans, spans_args, args in zip(batch_spans, spans_batch_args, batch_args)]
+            spans_batch_args = batch_args
+        if not is_batch(hook):
+            batch_args = [_call_hook(hook, args, spans)
+                          for args, spans in zip(batch_args, batch_spans or (None,) * len(batch_args))]
+        elif batch_spans is not None and is_with_spans(hook):
+            token_spans, group_spans = zip(*batch_spans)
+            batch_args = list(hook(batch_args, token_spans=list(token_spans), group_spans=list(group_spans)))
+        else:
+            batch_args = list(hook(batch_args))
+    return batch_args
+
+def split_spans(result: Any) -> Tuple[Any, _SPANS]:
+    """Splits token spans and group spans from a result of combiner.combine with spans.
+
+    Examples:
+        >>> split_spans(('hi', ('[WAKE(hi)]',), ('{[WAKE(hi)]}',), (('WAKE', 0, 2),), (('None', 0, 2),)))
+        (('hi', ('[WAKE(hi)]',), ('{[WAKE(hi)]}',)), ((('WAKE', 0, 2),), (('None', 0, 2),)))
+    """
+    if isinstance(result, LabeledUtterance):
+        return result, (result.token_spans, result.group_spans)
+    return result[:3], result[3:]
+
+def realign_spans(utterance: str, new_utterance: str, spans: _SPANS) -> _SPANS:
+    """Moves token spans and group spans of utterance to the same text in new_utterance.
+
+    Offsets in text that a hook kept are shifted by what the hook inserted or removed before
+    them. A span whose text the hook replaced, e.g. with a synonym, covers the replacement.
+
+    Args:
+        utterance: The utterance that spans were computed for.
+
+        new_utterance: The utterance after a hook changed it.
+
+        spans: Token spans and group spans of utterance.
+
+    Examples:
+        >>> realign_spans('get fries', 'um get fries', ((('ADD', 0, 3), ('ITEM', 4, 9)), (('None', 0, 9),)))
+        ((('ADD', 3, 6), ('ITEM', 7, 12)), (('None', 3, 12),))
+        >>> realign_spans('get fries', 'acquire fries', ((('ADD', 0, 3), ('ITEM', 4, 9)), ()))
+        ((('ADD', 0, 7), ('ITEM', 8, 13)), ())
+    """
+    opcodes = SequenceMatcher(None, utterance, new_utterance, autojunk=False).get_opcodes()
+
+    def _realign(position: int, is_end: bool) -> int:
+        for tag, start, end, new_start, new_end in opcodes:
+            if start == end:
+                # Text inserted at a position belongs to neither the span that ends nor the one that starts there
+                continue
+            if (start < position <= end) if is_end else (start <= position < end):
+                if tag == 'equal':
+                    return new_start + position - start
+                return new_end if is_end else new_start
+        return len(new_utterance) if position else 0
+
+    token_spans, group_spans = spans
+    return (tuple((name, _realign(start, False), _realign(end, True)) for name, start, end in token_spans),
+            tuple((name, _realign(start, False), _realign(end, True)) for name, start, end in group_spans))
+
+def _realign_spans_to_args(spans: _SPANS, spans_args: Any, args: Any) -> _SPANS:
+    utterance, new_utterance = _get_utterance(spans_args), _get_utterance(args)
+    if utterance is None or new_utterance is None or utterance == new_utterance:
+        return spans
+    return realign_spans(utterance, new_utterance, spans)
+
+def _get_utterance(args: Any) -> Optional[str]:
+    if isinstance(args, (tuple, list, LabeledUtterance)) and len(args) and isinstance(args[0], str):
+        return args[0]
+    return None
+
+def _call_hook(hook: Callable, args: Any, spans: Optional[_SPANS]) -> Any:
+    if spans is not None and is_with_spans(hook):
+        token_spans, group_spans = spans
+        if is_batch(hook):
+            return hook([args], token_spans=[token_spans], group_spans=[group_spans])[0]
+        return hook(*args, token_spans=token_spans, group_spans=group_spans)
+    return hook([args])[0] if is_batch(hook) else hook(*args)
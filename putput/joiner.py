@@ -1,11 +1,19 @@
 import itertools
 import random
 import sys
+from array import array
+from bisect import bisect_right
 from functools import reduce
+from typing import Any
 from typing import Iterable
+from typing import Iterator
+from typing import Mapping
 from typing import Optional
 from typing import Sequence
+from typing import Tuple
 from typing import TypeVar
+from typing import Union
+from typing import overload
 
 from putput.logger import get_logger
 
@@ -40,6 +48,25 @@ class ComboOptions:
         """Option to include duplicates when randomly sampling."""
         return self._with_replacement
 
+def get_combo_options(tokens: Sequence[str],
+                      combo_options_map: Optional[Mapping[str, ComboOptions]]
+                      ) -> Optional[ComboOptions]:
+    """Returns the combo options of an utterance pattern, or the 'DEFAULT' options if it has none.
+
+    Args:
+        tokens: Tokens of an expanded utterance pattern.
+
+        combo_options_map: 'combo_options_map' of a Pipeline.
+
+    Examples:
+        >>> combo_options = get_combo_options(('WAKE',), {'DEFAULT': ComboOptions(max_sample_size=1,
+        ...                                                                        with_replacement=False)})
+        >>> combo_options.max_sample_size
+        1
+    """
+    combo_options_map = combo_options_map or {}
+    return combo_options_map.get(', '.join(tokens)) or combo_options_map.get('DEFAULT')
+
 def join_combo(combo: Sequence[Sequence[T]], *, combo_options: Optional[ComboOptions] = None) -> Iterable[Sequence[T]]:
     """Generates the product of a combo, subject to 'combo_options'.
 
@@ -77,16 +104,50 @@ def join_combo(combo: Sequence[Sequence[T]], *, combo_options: Optional[ComboOpt
         return _join_with_sampling(combo, combo_options)
     return _join_without_sampling(combo)
 
+def join_combo_indices(component_lengths: Sequence[int],
+                       *,
+                       combo_options: Optional[ComboOptions] = None
+                       ) -> Iterable[Sequence[int]]:
+    """Generates the indices of the items that make up each joined combo, subject to 'combo_options'.
+
+    Indices are generated in the same order, and from the same random draws, as the
+    joined combos of 'join_combo', so items can be looked up only when they are needed.
+
+    Args:
+        component_lengths: The length of each Sequence in the combo.
+
+        combo_options: Options for randomly sampling.
+
+    Yields:
+        The index of an item in each Sequence of the combo.
+
+    Examples:
+        >>> tuple(join_combo_indices((2, 1)))
+        ((0, 0), (1, 0))
+    """
+    if not all(component_lengths):
+        raise ValueError('Invalid combo: components must not be empty.')
+    if combo_options:
+        return _join_indices_with_sampling(component_lengths, combo_options)
+    return itertools.product(*map(range, component_lengths))
+
 def _join_without_sampling(combo: Sequence[Sequence[T]]) -> Iterable[Sequence[T]]:
     return itertools.product(*combo)
 
 def _join_with_sampling(combo: Sequence[Sequence[T]], combo_options: ComboOptions) -> Iterable[Sequence[T]]:
+    component_lengths = tuple(len(item) for item in combo)
+    for component_indices in _join_indices_with_sampling(component_lengths, combo_options):
+        yield tuple(combo[component_index][item_index]
+                    for component_index, item_index in enumerate(component_indices))
+
+def _join_indices_with_sampling(component_lengths: Sequence[int],
+                                combo_options: ComboOptions
+                                ) -> Iterable[Sequence[int]]:
     # Given ((hey speaker, hi speaker), (play, start)), there are 4 possible combinations (2x2=4)
     # choose a random number [0, 3] to represent a random combination.
     # Map that chosen number back to the indices that make the combination.
     # For instance, 0 could map to (0, 0), which would yield "hey speaker play"
     # 1 could map to (1, 0), which would yield "hi speaker play", etc.
-    component_lengths = tuple(len(item) for item in combo)
     num_unique_samples = _mul(component_lengths)
 
     if combo_options.with_replacement:
@@ -96,7 +157,7 @@ def _join_with_sampling(combo: Sequence[Sequence[T]], combo_options: ComboOption
         if num_unique_samples <= sys.maxsize:
             sample_size = min(combo_options.max_sample_size, num_unique_samples)
             if sample_size == num_unique_samples:
-                yield from _join_without_sampling(combo)
+                yield from itertools.product(*map(range, component_lengths))
                 return
         else:
             num_unique_samples = sys.maxsize
@@ -108,15 +169,12 @@ def _join_with_sampling(combo: Sequence[Sequence[T]], combo_options: ComboOption
             logger.warning(warning_msg)
 
             if sample_size == sys.maxsize: # pragma: no cover
-                yield from _join_without_sampling(combo)
+                yield from itertools.product(*map(range, component_lengths))
                 return
         flat_item_indices = tuple(random.sample(range(num_unique_samples), sample_size))
 
     for flat_item_index in flat_item_indices:
-        component_indices = _one_d_to_mult_d(flat_item_index, component_lengths)
-        combo_components = tuple(combo[component_index][item_index]
-                                 for component_index, item_index in enumerate(component_indices))
-        yield combo_components
+        yield tuple(_one_d_to_mult_d(flat_item_index, component_lengths))
 
 def _one_d_to_mult_d(one_d: int, component_lengths: Sequence[int]) -> Sequence[int]:
     # https://stackoverflow.com/questions/12429492/how-to-convert-a-monodimensional-index-to-corresponding-indices-in-a-multidimens
@@ -131,3 +189,296 @@ def _one_d_to_mult_d(one_d: int, component_lengths: Sequence[int]) -> Sequence[i
 
 def _mul(component_lengths: Sequence[int]) -> int:
     return reduce(lambda x, y: x * y, component_lengths)
+
+class LazySequence(Sequence[T]):
+    """Base for sequences that compute items on access but compare, hash, and print like tuples.
+
+    Subclasses implement '__len__' and '_get_item', which is called with a non-negative index
+    in range. Dynamic token patterns that are lazy sequences, such as the providers in
+    putput.providers, are used as utterance components without being copied.
+    """
+    __slots__ = ()
+
+    @overload
+    def __getitem__(self, index: int) -> T:
+        pass # pragma: no cover
+
+    @overload
+    def __getitem__(self, index: slice) -> Tuple[T, ...]:
+        pass # pragma: no cover
+
+    def __getitem__(self, index: Union[int, slice]) -> Union[T, Tuple[T, ...]]:
+        if isinstance(index, slice):
+            return tuple(self._get_item(i) for i in range(*index.indices(len(self))))
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('{} index out of range'.format(type(self).__name__))
+        return self._get_item(index)
+
+    def _get_item(self, index: int) -> T:
+        raise NotImplementedError # pragma: no cover
+
+    def __len__(self) -> int:
+        raise NotImplementedError # pragma: no cover
+
+    def __eq__(self, other: Any) -> bool:
+        if isinstance(other, str) or not isinstance(other, Sequence):
+            return NotImplemented
+        return len(self) == len(other) and all(item == other_item for item, other_item in zip(self, other))
+
+    def __hash__(self) -> int:
+        return hash(tuple(self))
+
+    def __repr__(self) -> str:
+        return repr(tuple(self))
+
+class ProductSequence(LazySequence[str]):
+    """The product of a combo, joined with spaces, computed one index at a time.
+
+    Behaves like tuple(' '.join(joined) for joined in join_combo(combo)), but
+    only joins the phrases for the indices that are accessed. Indices map to
+    the product through mixed-radix decomposition of the component lengths.
+
+    Args:
+        combo: Sequences of phrases to join.
+
+    Examples:
+        >>> product_sequence = ProductSequence((('hey', 'ok'), ('speaker', 'sound system')))
+        >>> len(product_sequence)
+        4
+        >>> product_sequence[1]
+        'hey sound system'
+        >>> product_sequence
+        ('hey speaker', 'hey sound system', 'ok speaker', 'ok sound system')
+    """
+    __slots__ = ('_combo', '_strides', '_len')
+
+    def __init__(self, combo: Sequence[Sequence[str]]) -> None:
+        self._combo = tuple(combo)
+        strides = []
+        stride = 1
+        for component in reversed(self._combo):
+            strides.append(stride)
+            stride *= len(component)
+        self._strides = tuple(reversed(strides))
+        self._len = stride
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __iter__(self) -> Iterator[str]:
+        return map(' '.join, itertools.product(*self._combo))
+
+    def _get_item(self, index: int) -> str:
+        phrases = []
+        for component, stride in zip(self._combo, self._strides):
+            component_index, index = divmod(index, stride)
+            phrases.append(component[component_index])
+        return ' '.join(phrases)
+
+class ChainSequence(LazySequence[T]):
+    """Sequences chained end to end without copying their items.
+
+    Args:
+        sequences: Sequences to chain.
+
+    Examples:
+        >>> chain_sequence = ChainSequence((('hey', 'ok'), ProductSequence((('hi',), ('speaker', 'there')))))
+        >>> len(chain_sequence)
+        4
+        >>> chain_sequence[3]
+        'hi there'
+    """
+    __slots__ = ('_sequences', '_offsets')
+
+    def __init__(self, sequences: Sequence[Sequence[T]]) -> None:
+        self._sequences = tuple(sequences)
+        self._offsets = tuple(itertools.accumulate(len(sequence) for sequence in self._sequences))
+
+    def __len__(self) -> int:
+        return self._offsets[-1] if self._offsets else 0
+
+    def __iter__(self) -> Iterator[T]:
+        return itertools.chain.from_iterable(self._sequences)
+
+    def _get_item(self, index: int) -> T:
+        sequence_index = bisect_right(self._offsets, index)
+        start = self._offsets[sequence_index - 1] if sequence_index else 0
+        return self._sequences[sequence_index][index - start]
+
+    @property
+    def sequences(self) -> Sequence[Sequence[T]]:
+        """Read-only sequences, in order."""
+        return self._sequences
+
+def extend_sequence(sequence: Sequence[T], items: Sequence[T]) -> Sequence[T]:
+    """Returns sequence followed by items, chaining lazy sequences instead of reading every item.
+
+    Examples:
+        >>> extend_sequence(('fries',), ('a burger',))
+        ('fries', 'a burger')
+        >>> extended = extend_sequence(ProductSequence((('hi',), ('kanye', 'nico'))), ('hey',))
+        >>> extended = extend_sequence(extended, ('ok',))
+        >>> extended, len(extended.sequences)
+        (('hi kanye', 'hi nico', 'hey', 'ok'), 3)
+    """
+    if isinstance(sequence, ChainSequence):
+        return ChainSequence(tuple(sequence.sequences) + (tuple(items),))
+    if isinstance(sequence, LazySequence):
+        return ChainSequence((sequence, tuple(items)))
+    return tuple(sequence) + tuple(items)
+
+class PhrasePool(LazySequence[str]):
+    """Phrases encoded as utf-8 end to end in one buffer, delimited by an offsets array.
+
+    Phrases are decoded on access, so a pool backed by a memory mapped file
+    costs nothing until its phrases are used, and its pages are shared by every
+    process that maps the file.
+
+    Args:
+        buffer: A bytes-like object holding the encoded phrases.
+
+        offsets: The start of each phrase in buffer, followed by the end of the last phrase.
+
+    Examples:
+        >>> phrase_pool = PhrasePool.from_phrases(('can she get', 'may she get'))
+        >>> phrase_pool.offsets
+        array('Q', [0, 11, 22])
+        >>> phrase_pool[1]
+        'may she get'
+        >>> phrase_pool
+        ('can she get', 'may she get')
+    """
+    __slots__ = ('_buffer', '_offsets')
+
+    def __init__(self, buffer: Any, offsets: Sequence[int]) -> None:
+        self._buffer = buffer
+        self._offsets = offsets
+
+    @classmethod
+    def from_phrases(cls, phrases: Iterable[str]) -> 'PhrasePool':
+        """Encodes phrases into a new pool."""
+        offsets = array('Q', [0])
+        encoded_phrases = []
+        for phrase in phrases:
+            encoded_phrase = phrase.encode('utf-8')
+            encoded_phrases.append(encoded_phrase)
+            offsets.append(offsets[-1] + len(encoded_phrase))
+        return cls(b''.join(encoded_phrases), offsets)
+
+    @property
+    def buffer(self) -> Any:
+        """Read-only bytes-like object holding the encoded phrases."""
+        return self._buffer
+
+    @property
+    def offsets(self) -> Sequence[int]:
+        """Read-only start of each phrase in buffer, followed by the end of the last phrase."""
+        return self._offsets
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def _get_item(self, index: int) -> str:
+        return str(self._buffer[self._offsets[index]:self._offsets[index + 1]], 'utf-8')
+
+class StringPool(LazySequence[str]):
+    """Interned strings encoded as utf-8 end to end in one growable buffer.
+
+    Each distinct string is stored once and identified by its index in the pool, so
+    sequences of strings can be stored as compact arrays of ids with 'PooledSequence'.
+    Strings are found through an open addressing table of ids rather than a dict of
+    str objects, so the pool costs the encoded bytes plus about 16 bytes per string.
+
+    Examples:
+        >>> string_pool = StringPool()
+        >>> string_pool.intern('can she get'), string_pool.intern('fries'), string_pool.intern('can she get')
+        (0, 1, 0)
+        >>> string_pool[1]
+        'fries'
+        >>> PooledSequence(string_pool, (1, 0, 1))
+        ('fries', 'can she get', 'fries')
+    """
+    __slots__ = ('_buffer', '_offsets', '_table')
+
+    def __init__(self) -> None:
+        self._buffer = bytearray()
+        self._offsets = array('Q', [0])
+        self._table = array('q', [-1]) * 8
+
+    @property
+    def buffer(self) -> bytearray:
+        """Read-only buffer holding the encoded strings."""
+        return self._buffer
+
+    @property
+    def offsets(self) -> Sequence[int]:
+        """Read-only start of each string in buffer, followed by the end of the last string."""
+        return self._offsets
+
+    def intern(self, string: str) -> int:
+        """Adds string to the pool if it is not already in it, and returns its id."""
+        encoded_string = string.encode('utf-8')
+        slot = self._find_slot(encoded_string)
+        string_id = self._table[slot]
+        if string_id == -1:
+            string_id = len(self)
+            self._buffer.extend(encoded_string)
+            self._offsets.append(len(self._buffer))
+            self._table[slot] = string_id
+            if len(self) * 3 > len(self._table) * 2:
+                self._grow_table()
+        return string_id
+
+    def _find_slot(self, encoded_string: bytes) -> int:
+        mask = len(self._table) - 1
+        slot = hash(encoded_string) & mask
+        while True:
+            string_id = self._table[slot]
+            if string_id == -1 or self._buffer[self._offsets[string_id]:self._offsets[string_id + 1]] == encoded_string:
+                return slot
+            slot = (slot + 1) & mask
+
+    def _grow_table(self) -> None:
+        self._table = array('q', [-1]) * (len(self._table) * 2)
+        mask = len(self._table) - 1
+        for string_id in range(len(self)):
+            slot = hash(bytes(self._buffer[self._offsets[string_id]:self._offsets[string_id + 1]])) & mask
+            while self._table[slot] != -1:
+                slot = (slot + 1) & mask
+            self._table[slot] = string_id
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def _get_item(self, index: int) -> str:
+        return self._buffer[self._offsets[index]:self._offsets[index + 1]].decode('utf-8')
+
+class PooledSequence(LazySequence[str]):
+    """Strings stored as ids into a pool of strings, such as 'StringPool' or 'PhrasePool'.
+
+    Args:
+        pool: Strings that ids index.
+
+        ids: Index into pool of each string in the sequence.
+    """
+    __slots__ = ('_pool', '_ids')
+
+    def __init__(self, pool: Sequence[str], ids: Sequence[int]) -> None:
+        self._pool = pool
+        self._ids = ids
+
+    @property
+    def ids(self) -> Sequence[int]:
+        """Read-only index into pool of each string in the sequence."""
+        return self._ids
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def __iter__(self) -> Iterator[str]:
+        return map(self._pool.__getitem__, self._ids)
+
+    def _get_item(self, index: int) -> str:
+        return self._pool[self._ids[index]]
@@ -1,30 +1,49 @@
 import random
-from copy import deepcopy
-from functools import reduce
+from functools import partial
 from pathlib import Path
 from typing import Any
 from typing import Callable
 from typing import Dict  # pylint: disable=unused-import
 from typing import Iterable
+from typing import List  # pylint: disable=unused-import
 from typing import Mapping
 from typing import Optional
 from typing import Sequence
+from typing import Set  # pylint: disable=unused-import
 from typing import Tuple
 from typing import Type
 from typing import TypeVar
 from typing import Union
-from typing import overload
-
-import yaml
 
+from putput.cache import CacheInfo
+from putput.cache import LRUCache
+from putput.combiner import LabeledUtterance
 from putput.combiner import combine
+from putput.combiner import create_handler_caches
+from putput.combiner import is_with_spans
+from putput.compiled import CompiledExpansion
+from putput.compiled import CompiledPatternDef
+from putput.compiled import compile_pattern_def
+from putput.compiled import write_compiled_expansion
 from putput.expander import expand
-from putput.expander import expand_utterance_patterns_ranges_and_groups
+from putput.expander import expand_delta
+from putput.expander import expand_group_map
 from putput.expander import get_base_item_map
+from putput.expander import get_dynamic_tokens
+from putput.expander import get_intent_map
+from putput.expander import get_overlapping_token_patterns
+from putput.hooks import apply_combo_hooks
+from putput.hooks import execute_hooks
+from putput.hooks import get_hooks
 from putput.joiner import ComboOptions
-from putput.logger import get_logger
-from putput.presets.factory import get_preset
-from putput.validator import validate_pattern_def
+from putput.joiner import StringPool
+from putput.joiner import extend_sequence
+from putput.joiner import get_combo_options
+from putput.presets.factory import get_pipeline_kwargs
+from putput.selector import KeyExpander
+from putput.selector import select_utterance_patterns
+from putput.shards import digest_utterance_pattern
+from putput.shards import write_shards
 
 try:
     get_ipython() # type: ignore
@@ -35,10 +54,6 @@ except NameError:
 _E_H_MAP = Mapping[str, Sequence[Callable[[Sequence[Sequence[str]], Sequence[str], Sequence[Tuple[str, int]]],
                                           Tuple[Sequence[Sequence[str]], Sequence[str], Sequence[Tuple[str, int]]]]]]
 _C_H_MAP = Mapping[str, Sequence[Callable]]
-_T_UP_KEY = TypeVar('_T_UP_KEY',
-                    _C_H_MAP,
-                    _E_H_MAP,
-                    Mapping[str, ComboOptions])
 T_PIPELINE = TypeVar('T_PIPELINE', bound='Pipeline')
 
 class Pipeline:
@@ -59,7 +74,9 @@ class Pipeline:
 
     There are two stages in 'flow'. The first stage, 'expansion', expands
     the pattern definition file into an 'utterance_combo', 'tokens', and 'groups'
-    for each utterance pattern. At the end of the first stage,
+    for each utterance pattern. Utterance patterns discarded by 'discard_map', or
+    not selected by the arguments to 'flow', are skipped before they are expanded.
+    At the end of the first stage,
     if hooks in 'expansion_hooks_map' are specified for the
     current utterance pattern, they are applied in order where the output
     of a previous hook becomes the input to the next hook.
@@ -186,7 +203,7 @@ class Pipeline:
     """
     # pylint: disable=attribute-defined-outside-init, too-many-instance-attributes
     def __init__(self,
-                 pattern_def_path: Path,
+                 pattern_def_path: Union[Path, Mapping, CompiledPatternDef],
                  *,
                  dynamic_token_patterns_map: Optional[Mapping[str, Sequence[str]]] = None,
                  token_handler_map: Optional[Mapping[str, Callable[[str, str], str]]] = None,
@@ -194,7 +211,15 @@ class Pipeline:
                  expansion_hooks_map: Optional[_E_H_MAP] = None,
                  combo_hooks_map: Optional[_C_H_MAP] = None,
                  combo_options_map: Optional[Mapping[str, ComboOptions]] = None,
-                 seed: Optional[int] = None
+                 discard_map: Optional[Mapping[str, bool]] = None,
+                 seed: Optional[int] = None,
+                 cache_size: Optional[int] = 1024,
+                 dedupe_phrases: bool = False,
+                 pattern_def_cache_dir: Optional[Path] = None,
+                 compiled_path: Optional[Union[Path, CompiledExpansion]] = None,
+                 intern_phrases: bool = False,
+                 labeled_utterances: bool = False,
+                 batch_size: Optional[int] = None
                  ) -> None:
         """Instantiates 'Pipeline'.
 
@@ -202,7 +227,9 @@ class Pipeline:
         and sets public attributes.
 
         Args:
-            pattern_def_path: See property docstring.
+            pattern_def_path: See property docstring. An in-memory pattern definition
+                may be specified instead, see 'from_pattern_def', or a pattern definition
+                already compiled by compiled.compile_pattern_def, so it is not compiled again.
 
             dynamic_token_patterns_map: See property docstring.
 
@@ -216,19 +243,67 @@ class Pipeline:
 
             combo_options: See property docstring.
 
+            discard_map: See property docstring.
+
             seed: See property docstring.
 
+            cache_size: See property docstring.
+
+            dedupe_phrases: See property docstring.
+
+            pattern_def_cache_dir: See property docstring.
+
+            compiled_path: See property docstring. An already opened CompiledExpansion
+                may be specified instead, so it is not opened again.
+
+            intern_phrases: See property docstring.
+
+            labeled_utterances: See property docstring.
+
+            batch_size: See property docstring.
+
         Raises:
             PatternDefinitionValidationError: If the pattern definition file fails
                 validation rules in validator.
             yaml.YAMLError: If the pattern definition is invalid yaml.
+            ValueError: If compiled_path was compiled from a different pattern definition,
+                dynamic_token_patterns_map is specified with compiled_path, or batch_size <= 0.
         """
         self.seed = seed
-
-        pattern_def = _load_pattern_def(pattern_def_path)
-        validate_pattern_def(pattern_def)
-        self._pattern_def_path = pattern_def_path
+        # Expanded utterance components per token, shared by every utterance pattern across flows
+        self._components_cache = LRUCache(maxsize=cache_size) # type: LRUCache[str, Sequence[str]]
+        self._cached_dynamic_token_patterns = {} # type: Dict[str, Sequence[str]]
+        self._dedupe_phrases = dedupe_phrases
+        self._string_pool = StringPool() if intern_phrases else None
+        self._labeled_utterances = labeled_utterances
+        if batch_size is not None and batch_size <= 0:
+            raise ValueError('batch_size = {}, but needs to be > 0'.format(batch_size))
+        self._batch_size = batch_size
+
+        if compiled_path and not isinstance(compiled_path, CompiledExpansion):
+            compiled_path = CompiledExpansion(compiled_path)
+        compiled_expansion = compiled_path if isinstance(compiled_path, CompiledExpansion) else None
+        compiled_pattern_def = pattern_def_path
+        if not isinstance(compiled_pattern_def, CompiledPatternDef):
+            compiled_pattern_def = compile_pattern_def(compiled_pattern_def, cache_dir=pattern_def_cache_dir,
+                                                       compiled_expansion=compiled_expansion)
+        digest, pattern_def = compiled_pattern_def.digest, compiled_pattern_def.pattern_def
+        if compiled_expansion:
+            if compiled_expansion.metadata['pattern_def_digest'] != digest:
+                raise ValueError('{} was compiled from a different pattern definition'.format(
+                    compiled_expansion.path))
+            if dynamic_token_patterns_map:
+                raise ValueError('dynamic_token_patterns_map cannot be specified with compiled_path. '
+                                 'Dynamic token patterns are compiled into compiled_path.')
+        self._compiled_expansion = compiled_expansion
+        self._compiled_path = compiled_expansion.path if compiled_expansion else None
+        self._pattern_def_digest = digest
+        self._pattern_def_path = compiled_pattern_def.path
+        self._pattern_def_cache_dir = pattern_def_cache_dir
         self._pattern_def = pattern_def
+        # Groups are expanded once and shared by expansion and every map with utterance patterns as keys
+        self._expanded_group_map = expand_group_map(get_base_item_map(pattern_def, 'groups'))
+        self._key_expander = KeyExpander(self._expanded_group_map, maxsize=cache_size)
 
         self.dynamic_token_patterns_map = dynamic_token_patterns_map
         self.token_handler_map = token_handler_map
@@ -236,17 +311,178 @@ class Pipeline:
         self.expansion_hooks_map = expansion_hooks_map
         self.combo_hooks_map = combo_hooks_map
         self.combo_options_map = combo_options_map
+        self.discard_map = discard_map
 
     @property
-    def pattern_def_path(self) -> Path:
-        """Read-only path to the pattern definition."""
+    def pattern_def_path(self) -> Optional[Path]:
+        """Read-only path to the pattern definition. None if the pipeline was
+        instantiated from an in-memory pattern definition.
+        """
         return self._pattern_def_path
 
+    @classmethod
+    def from_pattern_def(cls: Type[T_PIPELINE], pattern_def: Mapping, **kwargs: Any) -> T_PIPELINE:
+        """Instantiates 'Pipeline' from an in-memory pattern definition.
+
+        The pattern definition is validated and expanded in memory, without being
+        written to or read from disk. Scalars are converted to str, as they are when
+        yaml is loaded, so ranges may be specified as int. 'PatternDefBuilder' builds
+        pattern definitions programmatically.
+
+        Args:
+            pattern_def: A mapping in the shape of the pattern definition yaml file.
+
+            kwargs: See __init__ docstring.
+
+        Raises:
+            PatternDefinitionValidationError: If the pattern definition fails
+                validation rules in validator.
+
+        Returns:
+            An instance of Pipeline.
+
+        Examples:
+            >>> pattern_def = {'token_patterns': [{'static': [{'WAKE': [[['hi', 'hey']]]}]},
+            ...                                   {'dynamic': ['ARTIST']}],
+            ...                'utterance_patterns': [['WAKE', 1, 'ARTIST']]}
+            >>> p = Pipeline.from_pattern_def(pattern_def, dynamic_token_patterns_map={'ARTIST': ('kanye',)})
+            >>> for utterance, tokens, groups in p.flow(disable_progress_bar=True):
+            ...     print(utterance)
+            hi kanye
+            hey kanye
+        """
+        return cls(pattern_def, **kwargs)
+
+    @property
+    def compiled_path(self) -> Optional[Path]:
+        """Read-only path to an expansion written by 'compile'. Utterance patterns, groups, and
+        phrases are read from the memory mapped file instead of being expanded, so processes
+        that share the file start generating immediately and share its pages. Expansion hooks
+        still apply. If None, the pattern definition is expanded.
+        """
+        return self._compiled_path
+
+    def compile(self, compiled_path: Path) -> None:
+        """Writes expanded utterance patterns, groups, and phrases to a binary file.
+
+        Pass the file as 'compiled_path' to instantiate pipelines, e.g. in worker
+        processes, that skip parsing, validation, and expansion.
+
+        Args:
+            compiled_path: Path to write the binary file to.
+
+        Examples:
+            >>> import tempfile
+            >>> pattern_def_path = Path(__file__).parent.parent / 'tests' / 'doc' / 'example_pattern_definition.yml'
+            >>> p = Pipeline(pattern_def_path, dynamic_token_patterns_map={'ITEM': ('fries',)})
+            >>> with tempfile.TemporaryDirectory() as compiled_dir:
+            ...     p.compile(Path(compiled_dir) / 'example.bin')
+            ...     p = Pipeline(pattern_def_path, compiled_path=Path(compiled_dir) / 'example.bin')
+            ...     for utterance, tokens, groups in p.flow(disable_progress_bar=True):
+            ...         print(utterance)
+            ...         break
+            can she get fries can she get fries and fries
+        """
+        self._invalidate_components_cache()
+        _, exp_gen = expand(self._pattern_def,
+                            dynamic_token_patterns_map=self._dynamic_token_patterns_map,
+                            components_cache=self._components_cache,
+                            expanded_group_map=self._expanded_group_map,
+                            dedupe_phrases=self._dedupe_phrases,
+                            string_pool=self._string_pool)
+        write_compiled_expansion(compiled_path,
+                                 exp_gen,
+                                 metadata={'pattern_def_digest': self._pattern_def_digest,
+                                           'pattern_def': self._pattern_def})
+
+    @property
+    def pattern_def_cache_dir(self) -> Optional[Path]:
+        """Read-only directory of compiled pattern definitions. A compiled pattern definition
+        is parsed and validated, and is stored under the digest of the file's content, so
+        pipelines that load the same file again skip parsing and validation. If None,
+        pattern definitions are compiled every time they are loaded.
+        """
+        return self._pattern_def_cache_dir
+
+    @property
+    def cache_size(self) -> Optional[int]:
+        """Read-only ceiling for the number of expanded tokens cached between flows.
+        The least recently used tokens are evicted first. If None, the cache is unbounded.
+        """
+        return self._components_cache.maxsize
+
+    @property
+    def dedupe_phrases(self) -> bool:
+        """Read-only option to remove duplicate phrases from each utterance component, keeping
+        the first occurrence, before any combination. Token patterns of a token that expand to the
+        same phrases would otherwise produce duplicate utterances. See 'overlapping_token_patterns'.
+        Lazy dynamic token patterns, such as providers, are read in full.
+        """
+        return self._dedupe_phrases
+
+    @property
+    def intern_phrases(self) -> bool:
+        """Read-only option to store expanded phrases in one compact pool shared by every token,
+        with each distinct phrase stored once, instead of as a str object per phrase. Utterance
+        components are arrays of ids into the pool, and phrases are decoded as they are combined.
+        The pool keeps phrases of token patterns that are later replaced. Lazy dynamic token
+        patterns, such as providers, are read in full.
+        """
+        return self._string_pool is not None
+
+    @property
+    def labeled_utterances(self) -> bool:
+        """Read-only option for 'flow' to yield combiner.LabeledUtterance records instead of tuples.
+        Records unpack like tuples, but build the utterance, handled tokens, and handled groups
+        only when they are first accessed, so consumers that read only some of them skip the rest.
+        Combo hooks receive the built values, and their results are yielded as is.
+        """
+        return self._labeled_utterances
+
+    @property
+    def batch_size(self) -> Optional[int]:
+        """Read-only number of utterances of an utterance pattern that are handled together.
+        Token handlers, group handlers, and combo hooks marked with combiner.batch are called once
+        per token, group, and hook of a batch instead of once per utterance. Does not apply to the
+        token and group handlers of 'labeled_utterances'. If None, batches hold a single utterance.
+        """
+        return self._batch_size
+
+    def overlapping_token_patterns(self) -> Mapping[str, Sequence[Tuple[int, int]]]:
+        """Returns pairs of indices of token patterns that expand to the same phrases, keyed by token.
+        Lazy dynamic token patterns, such as providers, are read in full.
+
+        Examples:
+            >>> pattern_def_path = Path(__file__).parent.parent / 'tests' / 'doc' / 'example_pattern_definition.yml'
+            >>> p = Pipeline(pattern_def_path, dynamic_token_patterns_map={'ITEM': ('fries', 'fries')})
+            >>> p.overlapping_token_patterns()
+            {'ITEM': ((0, 0),)}
+        """
+        return get_overlapping_token_patterns(self._pattern_def,
+                                              dynamic_token_patterns_map=self._dynamic_token_patterns_map)
+
+    def cache_info(self) -> Mapping[str, CacheInfo]:
+        """Returns hits, misses, maxsize, and current size of each cache, keyed by the cache's name.
+
+        Examples:
+            >>> pattern_def_path = Path(__file__).parent.parent / 'tests' / 'doc' / 'example_pattern_definition.yml'
+            >>> p = Pipeline(pattern_def_path, dynamic_token_patterns_map={'ITEM': ('fries',)})
+            >>> _ = list(p.flow(disable_progress_bar=True))
+            >>> p.cache_info()
+            {'components': CacheInfo(hits=3, misses=3, maxsize=1024, currsize=3), \
+'expanded_keys': CacheInfo(hits=0, misses=0, maxsize=1024, currsize=0)}
+        """
+        return {'components': self._components_cache.info(), 'expanded_keys': self._key_expander.cache_info()}
+
     @property
     def dynamic_token_patterns_map(self) -> Optional[Mapping[str, Sequence[str]]]:
         """The dynamic counterpart to the static section in the pattern definition.
         This mapping between token and token patterns is useful in
         scenarios where tokens and token patterns cannot be known before runtime.
+        Expanded tokens are cached between flows, and a token is only expanded again
+        after its token patterns are replaced in the mapping. Token patterns that are
+        modified in place are not detected, so replace them instead. Token patterns may be
+        any Sequence, such as the lazy providers in putput.providers, and are not copied.
         """
         return self._dynamic_token_patterns_map
 
@@ -256,6 +492,64 @@ class Pipeline:
                                    ) -> None:
         self._dynamic_token_patterns_map = token_patterns_map
 
+    def add_dynamic_token_patterns(self, token: str, token_patterns: Sequence[str]) -> None:
+        """Adds token patterns to a dynamic token in 'dynamic_token_patterns_map'.
+
+        Only the updated token is expanded again in the next flow. Every other
+        token is served from the cache of expanded tokens. Lazy token patterns,
+        such as providers, are chained with the new token patterns, not read.
+
+        Args:
+            token: A dynamic token in the pattern definition.
+
+            token_patterns: Token patterns to add after the token's existing token patterns.
+
+        Raises:
+            ValueError: If token is not a dynamic token, or the pipeline has a 'compiled_path'.
+
+        Examples:
+            >>> pattern_def_path = Path(__file__).parent.parent / 'tests' / 'doc' / 'example_pattern_definition.yml'
+            >>> p = Pipeline(pattern_def_path, dynamic_token_patterns_map={'ITEM': ('fries',)})
+            >>> p.add_dynamic_token_patterns('ITEM', ('a burger',))
+            >>> p.dynamic_token_patterns_map
+            {'ITEM': ('fries', 'a burger')}
+        """
+        current_token_patterns = self._get_dynamic_token_patterns(token)
+        self._set_dynamic_token_patterns(token, extend_sequence(current_token_patterns, token_patterns))
+
+    def remove_dynamic_token_patterns(self, token: str, token_patterns: Sequence[str]) -> None:
+        """Removes token patterns from a dynamic token in 'dynamic_token_patterns_map'.
+
+        Only the updated token is expanded again in the next flow. Every other
+        token is served from the cache of expanded tokens. The remaining token
+        patterns are copied into a tuple, so lazy token patterns, such as providers, are read in full.
+
+        Args:
+            token: A dynamic token in the pattern definition.
+
+            token_patterns: Token patterns to remove from the token's existing token patterns.
+
+        Raises:
+            ValueError: If token is not a dynamic token, or the pipeline has a 'compiled_path'.
+        """
+        removed_token_patterns = set(token_patterns)
+        current_token_patterns = self._get_dynamic_token_patterns(token)
+        self._set_dynamic_token_patterns(token, tuple(token_pattern for token_pattern in current_token_patterns
+                                                      if token_pattern not in removed_token_patterns))
+
+    def _get_dynamic_token_patterns(self, token: str) -> Sequence[str]:
+        if self._compiled_expansion:
+            raise ValueError('Dynamic token patterns are compiled into {}.'.format(self._compiled_path))
+        if token not in get_dynamic_tokens(self._pattern_def):
+            raise ValueError('{} is not a dynamic token in the pattern definition.'.format(token))
+        return (self._dynamic_token_patterns_map or {}).get(token, ())
+
+    def _set_dynamic_token_patterns(self, token: str, token_patterns: Sequence[str]) -> None:
+        # The other tokens keep their token patterns' identity, so only this token's cached expansion is invalidated
+        dynamic_token_patterns_map = dict(self._dynamic_token_patterns_map or {})
+        dynamic_token_patterns_map[token] = token_patterns
+        self._dynamic_token_patterns_map = dynamic_token_patterns_map
+
     @property
     def token_handler_map(self) -> Optional[Mapping[str, Callable[[str, str], str]]]:
         """A mapping between a token and a function with args (token, phrase to tokenize) that returns a handled token.
@@ -293,9 +587,7 @@ class Pipeline:
     @expansion_hooks_map.setter
     def expansion_hooks_map(self, hooks_map: Optional[_E_H_MAP]) -> None:
         if hooks_map:
-            groups_map = get_base_item_map(self._pattern_def, 'groups')
-            self._expansion_hooks_map = _expand_map_with_utterance_pattern_as_key(
-                hooks_map, groups_map) # type: Optional[_E_H_MAP]
+            self._expansion_hooks_map = self._key_expander.expand_map(hooks_map) # type: Optional[_E_H_MAP]
         else:
             self._expansion_hooks_map = hooks_map
 
@@ -305,16 +597,15 @@ class Pipeline:
         the combination phase. If 'DEFAULT' is specified as the utterance pattern, the hooks
         will apply to all utterance patterns not otherwise specified in the mapping. During,
         'flow', hooks are applied in order where the output of the previous hook becomes
-        the input to the next hook.
+        the input to the next hook. Hooks marked with combiner.with_spans are also given the
+        character spans of tokens and groups in the utterance.
         """
         return self._combo_hooks_map
 
     @combo_hooks_map.setter
     def combo_hooks_map(self, hooks_map: Optional[_C_H_MAP]) -> None:
         if hooks_map:
-            groups_map = get_base_item_map(self._pattern_def, 'groups')
-            self._combo_hooks_map = _expand_map_with_utterance_pattern_as_key(
-                hooks_map, groups_map) # type: Optional[_C_H_MAP]
+            self._combo_hooks_map = self._key_expander.expand_map(hooks_map) # type: Optional[_C_H_MAP]
         else:
             self._combo_hooks_map = hooks_map
 
@@ -329,12 +620,27 @@ class Pipeline:
     @combo_options_map.setter
     def combo_options_map(self, options_map: Optional[Mapping[str, ComboOptions]]) -> None:
         if options_map:
-            groups_map = get_base_item_map(self._pattern_def, 'groups')
-            self._combo_options_map = _expand_map_with_utterance_pattern_as_key(
-                options_map, groups_map) # type: Optional[Mapping[str, ComboOptions]]
+            expanded_options_map = self._key_expander.expand_map(options_map)
+            self._combo_options_map = expanded_options_map # type: Optional[Mapping[str, ComboOptions]]
         else:
             self._combo_options_map = options_map
 
+    @property
+    def discard_map(self) -> Optional[Mapping[str, bool]]:
+        """A mapping between an utterance pattern and whether the utterance pattern is discarded.
+        Discarded utterance patterns are skipped before expansion, so no utterances are generated
+        for them. If 'DEFAULT' is specified as the utterance pattern, the value will apply to all
+        utterance patterns not otherwise specified in the mapping.
+        """
+        return self._discard_map
+
+    @discard_map.setter
+    def discard_map(self, discard_map: Optional[Mapping[str, bool]]) -> None:
+        if discard_map:
+            self._discard_map = self._key_expander.expand_map(discard_map) # type: Optional[Mapping[str, bool]]
+        else:
+            self._discard_map = discard_map
+
     @property
     def seed(self) -> Optional[int]:
         """Seed to control random behavior for Pipeline."""
@@ -363,9 +669,9 @@ class Pipeline:
                 result of calling the preset's 'preset' function, or a Sequence
                 of the two. The Callable form allows more control over the
                 preset's behavior. If a Sequence is specified, the result of
-                calling the presets' 'preset' function may only overlap in
-                'combo_hooks_map' and 'expansion_hooks_map'. If there is overlap,
-                functions will be applied in the order of the Sequence.
+                calling the presets' 'preset' function may only overlap in 'combo_hooks_map',
+                'expansion_hooks_map', and 'discard_map'. Overlapping hooks are applied in the
+                order of the Sequence. Overlapping discard_map keys take the last value, so kwargs win.
 
             args: See __init__ docstring.
 
@@ -373,7 +679,7 @@ class Pipeline:
 
         Raises:
             ValueError: If presets or kwargs contain the same keys, and those
-                keys are not 'combo_hooks_map' or 'expansion_hooks_map'.
+                keys are not 'combo_hooks_map', 'expansion_hooks_map', or 'discard_map'.
 
         Returns:
             An instance of Pipeline.
@@ -415,43 +721,63 @@ class Pipeline:
             ('O O O', 'B-ITEM', 'O O O', 'B-ITEM', 'O', 'B-ITEM')
             ('B-ADD_ITEM I-ADD_ITEM I-ADD_ITEM I-ADD_ITEM', 'B-ADD_ITEM I-ADD_ITEM I-ADD_ITEM I-ADD_ITEM', 'O', 'O')
         """
-        if args:
-            pattern_def = _load_pattern_def(args[0])
-        else:
-            pattern_def = _load_pattern_def(kwargs['pattern_def_path'])
-
-        intent_entities_kwargs = {'__intent_map_from_pipeline':_extract_intent_map(pattern_def),
-                                  '__entities_from_pipeline':_extract_entities(pattern_def)}
-        if isinstance(preset, str):
-            init_kwargs = get_preset(preset)(**intent_entities_kwargs)
-        elif isinstance(preset, Sequence):
-            warning = ('Presets are not guaranteed to work together. Choose presets that logically fit together. '
-                       'When in doubt, check the shapes of the return values of the hooks '
-                       'as well the transformations done in the handlers.')
-            logger = get_logger(__name__)
-            logger.warning(warning)
-            for pre in preset: # type: ignore
-                if isinstance(pre, str):
-                    init_kwargs = get_preset(pre)(**intent_entities_kwargs)
-                else:
-                    init_kwargs = pre(**intent_entities_kwargs)
-                try:
-                    accumulated_init_kwargs = _merge_kwargs(accumulated_init_kwargs, init_kwargs)
-                except NameError:
-                    accumulated_init_kwargs = _merge_kwargs({}, init_kwargs)
-            init_kwargs = accumulated_init_kwargs
-        else:
-            init_kwargs = preset(**intent_entities_kwargs)
-        init_kwargs = _merge_kwargs(init_kwargs, kwargs)
-        return cls(*args, **init_kwargs)
-
-    def flow(self, *, disable_progress_bar: bool = False) -> Iterable:
+        if kwargs.get('compiled_path') and not isinstance(kwargs['compiled_path'], CompiledExpansion):
+            kwargs['compiled_path'] = CompiledExpansion(kwargs['compiled_path'])
+        pattern_def_path = args[0] if args else kwargs.pop('pattern_def_path')
+        if not isinstance(pattern_def_path, CompiledPatternDef):
+            pattern_def_path = compile_pattern_def(pattern_def_path, cache_dir=kwargs.get('pattern_def_cache_dir'),
+                                                   compiled_expansion=kwargs.get('compiled_path'))
+        return cls(pattern_def_path, *args[1:], **get_pipeline_kwargs(preset, pattern_def_path.pattern_def, kwargs))
+
+    def flow(self,
+             *,
+             disable_progress_bar: bool = False,
+             utterance_patterns: Optional[Sequence[str]] = None,
+             intents: Optional[Sequence[str]] = None,
+             tokens: Optional[Sequence[str]] = None,
+             streaming: bool = False,
+             delta: Optional[Mapping[str, Sequence[str]]] = None,
+             fields: Optional[Sequence[str]] = None
+             ) -> Iterable:
         """Generates labeled data one utterance at a time.
 
+        'utterance_patterns', 'intents', and 'tokens' select which utterance patterns
+        flow through 'Pipeline'. Unselected utterance patterns are skipped during expansion,
+        so they cost nothing to combine. If more than one is specified, an utterance pattern
+        must satisfy all of them to be selected.
+
         Args:
             disable_progress_bar: Option to display progress of expansion
                 and combination stages as the Iterable is consumed.
 
+            utterance_patterns: Utterance patterns to select, in the same format as the
+                keys of 'combo_hooks_map', e.g. 'WAKE, PLAY_ARTIST, 1-2'.
+
+            intents: Intents, as defined in the pattern definition, to select.
+
+            tokens: Tokens, at least one of which must appear in a selected utterance pattern.
+
+            streaming: Option to expand utterance patterns as they are needed instead of
+                expanding, de-duplicating, and sorting all of them before the first utterance.
+                Utterance patterns flow in the order they are generated from the pattern
+                definition rather than in sorted order, so seeded results differ from
+                non-streaming results. The expansion progress bar has no total.
+
+            delta: A mapping between a token and its newly added phrases, e.g. values recently
+                added to 'dynamic_token_patterns_map'. If specified, only utterances with at least
+                one new phrase flow through 'Pipeline', each once. Utterance patterns without a token
+                in delta are skipped during expansion. Combination options apply separately to each
+                position of a token in delta that holds the first new phrase.
+
+            fields: Names of the fields to compute, any of 'utterance', 'handled_tokens', and
+                'handled_groups'. Fields that are not specified are None, and the token handlers,
+                group handlers, and joins that only they need are skipped. Combo hooks receive
+                None in place of fields that are not specified. If None, every field is computed.
+
+        Raises:
+            ValueError: If fields includes a name that is not a field, or streaming is specified
+                with a 'compiled_path', whose utterance patterns are already expanded.
+
         Yields:
             Labeled data.
 
@@ -473,146 +799,201 @@ class Pipeline:
             ('{ADD_ITEM([ADD(can she get)] [ITEM(fries)])}', '{ADD_ITEM([ADD(can she get)] [ITEM(fries)])}',
             '{None([CONJUNCTION(and)])}', '{None([ITEM(fries)])}')
         """
-        for utterance_combo, tokens, groups in self._expand(disable_progress_bar=disable_progress_bar):
-            for result in self._combine(utterance_combo,
+        if streaming and self._compiled_expansion:
+            raise ValueError('streaming cannot be specified with compiled_path. '
+                             'Utterance patterns are expanded into {}.'.format(self._compiled_path))
+        selector = self._get_selector(utterance_patterns=utterance_patterns,
+                                      intents=intents,
+                                      tokens=tokens,
+                                      delta_tokens=delta)
+        partitions_cache = {} # type: Dict[str, Any]
+        handler_caches = create_handler_caches()
+        for utterance_combo, pattern_tokens, groups in self._expand(disable_progress_bar=disable_progress_bar,
+                                                                    selector=selector,
+                                                                    streaming=streaming):
+            if delta:
+                utterance_combos = expand_delta(utterance_combo,
+                                                pattern_tokens,
+                                                delta,
+                                                partitions_cache=partitions_cache) # type: Iterable
+            else:
+                utterance_combos = (utterance_combo,)
+            for combo in utterance_combos:
+                for result in self._combine(combo,
+                                            pattern_tokens,
+                                            groups,
+                                            disable_progress_bar=disable_progress_bar,
+                                            fields=fields,
+                                            handler_caches=handler_caches):
+                    if result is not None:
+                        yield result
+
+    def write(self, output_dir: Path, *, disable_progress_bar: bool = False) -> Mapping[str, Path]:
+        """Writes labeled data to one shard per expanded utterance pattern, reusing shards that are unchanged.
+
+        Each shard is a json lines file named after the digest of its utterance pattern's
+        content: its tokens and groups, the phrases of its utterance_combo, the handlers,
+        hooks, and combination options that apply to it, and 'seed'. 'manifest.json' in
+        output_dir maps each digest to its shard. Later writes only generate shards whose
+        digest is not in the manifest, and remove shards whose digest no longer appears.
+        Every phrase is read to compute the digests, including those of lazy dynamic token
+        patterns such as providers, once per utterance component and write.
+        If 'seed' is set, each shard is generated with a seed derived from its digest, so
+        a shard's rows do not depend on which other shards are generated.
+
+        Handlers and hooks are identified as described in shards.identify. A function's
+        identity follows its code and closure, but not the globals it reads, and other
+        callables are identified by name only. Remove the manifest when their behavior
+        changes otherwise.
+
+        Args:
+            output_dir: Directory to write the shards and manifest to.
+
+            disable_progress_bar: See 'flow'.
+
+        Returns:
+            A mapping between the digest of each expanded utterance pattern and its shard, in order.
+
+        Examples:
+            >>> import tempfile
+            >>> pattern_def_path = Path(__file__).parent.parent / 'tests' / 'doc' / 'example_pattern_definition.yml'
+            >>> p = Pipeline(pattern_def_path, dynamic_token_patterns_map={'ITEM': ('fries',)})
+            >>> with tempfile.TemporaryDirectory() as output_dir:
+            ...     shards = p.write(Path(output_dir), disable_progress_bar=True)
+            ...     shard_path = next(iter(shards.values()))
+            ...     print(shard_path.read_text(encoding='utf-8').splitlines()[0])
+            ["can she get fries can she get fries and fries", ["[ADD(can she get)]", "[ITEM(fries)]",
+            "[ADD(can she get)]", "[ITEM(fries)]", "[CONJUNCTION(and)]", "[ITEM(fries)]"],
+            ["{ADD_ITEM([ADD(can she get)] [ITEM(fries)])}", "{ADD_ITEM([ADD(can she get)] [ITEM(fries)])}",
+            "{None([CONJUNCTION(and)])}", "{None([ITEM(fries)])}"]]
+        """
+        components_digests = {} # type: Dict[int, Tuple[Sequence[str], str]]
+        handler_caches = create_handler_caches()
+        shards = ((self._digest_utterance_pattern(utterance_combo, pattern_tokens, groups, components_digests),
+                   pattern_tokens,
+                   groups,
+                   partial(self._generate_rows,
+                           utterance_combo,
+                           pattern_tokens,
+                           groups,
+                           disable_progress_bar=disable_progress_bar,
+                           handler_caches=handler_caches))
+                  for utterance_combo, pattern_tokens, groups in self._expand(disable_progress_bar=disable_progress_bar,
+                                                                              selector=self._get_selector()))
+        return write_shards(output_dir, shards, seed=getattr(self, '_seed', None))
+
+    def _digest_utterance_pattern(self,
+                                  utterance_combo: Sequence[Sequence[str]],
+                                  tokens: Sequence[str],
+                                  groups: Sequence[Tuple[str, int]],
+                                  components_digests: Dict[int, Tuple[Sequence[str], str]]
+                                  ) -> str:
+        token_handler_map = self._token_handler_map or {}
+        group_handler_map = self._group_handler_map or {}
+        configuration = [getattr(self, '_seed', None),
+                         get_combo_options(tokens, self._combo_options_map),
+                         get_hooks(tokens, self._expansion_hooks_map),
+                         get_hooks(tokens, self._combo_hooks_map)] # type: List[Any]
+        configuration.extend(token_handler_map.get(token, token_handler_map.get('DEFAULT')) for token in tokens)
+        configuration.extend(group_handler_map.get(group, group_handler_map.get('DEFAULT')) for group, _ in groups)
+        return digest_utterance_pattern(utterance_combo,
                                         tokens,
                                         groups,
-                                        disable_progress_bar=disable_progress_bar):
-                if result is not None:
-                    yield result
+                                        configuration,
+                                        components_digests=components_digests)
+
+    def _generate_rows(self,
+                       utterance_combo: Sequence[Sequence[str]],
+                       tokens: Sequence[str],
+                       groups: Sequence[Tuple[str, int]],
+                       **kwargs: Any
+                       ) -> Iterable[Any]:
+        for result in self._combine(utterance_combo, tokens, groups, **kwargs):
+            if result is not None:
+                yield tuple(result) if isinstance(result, LabeledUtterance) else result
 
     def _combine(self,
                  utterance_combo: Sequence[Sequence[str]],
                  tokens: Sequence[str],
                  groups: Sequence[Tuple[str, int]],
                  *,
-                 disable_progress_bar: bool = False
-                 ) -> Iterable[Tuple[str, Sequence[str], Sequence[str]]]:
-        combo_options = _get_combo_options(tokens, self._combo_options_map) if self._combo_options_map else None
+                 disable_progress_bar: bool = False,
+                 fields: Optional[Sequence[str]] = None,
+                 handler_caches: Optional[Tuple[LRUCache, LRUCache]] = None
+                 ) -> Iterable[Any]:
+        token_handler_cache, group_handler_cache = handler_caches or (None, None)
+        combo_options = get_combo_options(tokens, self._combo_options_map)
+        spans = any(map(is_with_spans, get_hooks(tokens, self._combo_hooks_map)))
 
         sample_size, combo_gen = combine(utterance_combo,
                                          tokens,
                                          groups,
                                          token_handler_map=self._token_handler_map,
                                          group_handler_map=self._group_handler_map,
-                                         combo_options=combo_options)
+                                         combo_options=combo_options,
+                                         labeled_utterances=self._labeled_utterances,
+                                         fields=fields,
+                                         token_handler_cache=token_handler_cache,
+                                         group_handler_cache=group_handler_cache,
+                                         batch_size=self._batch_size,
+                                         spans=spans)
         with tqdm(combo_gen,
                   desc='Combination...',
                   total=sample_size,
                   disable=disable_progress_bar,
                   leave=False,
                   miniters=1) as pbar:
-            for utterance, handled_tokens, handled_groups in pbar:
-                if self._combo_hooks_map:
-                    result = _execute_hooks(tokens,
-                                            (utterance, handled_tokens, handled_groups),
-                                            self._combo_hooks_map)
-                else:
-                    result = (utterance, handled_tokens, handled_groups)
-                yield result
+            yield from apply_combo_hooks(tokens,
+                                         pbar,
+                                         self._combo_hooks_map,
+                                         spans=spans,
+                                         batch_size=self._batch_size)
 
     def _expand(self,
                 *,
-                disable_progress_bar: bool = False
+                disable_progress_bar: bool = False,
+                selector: Optional[Callable[[Sequence[str]], bool]] = None,
+                streaming: bool = False
                 ) -> Iterable[Tuple[Sequence[Sequence[str]], Sequence[str], Sequence[Tuple[str, int]]]]:
-        ilen, exp_gen = expand(self._pattern_def, dynamic_token_patterns_map=self._dynamic_token_patterns_map)
+        if self._compiled_expansion:
+            ilen, exp_gen = self._compiled_expansion.expand(selector=selector) # type: Tuple[Optional[int], Iterable]
+        else:
+            self._invalidate_components_cache()
+            ilen, exp_gen = expand(self._pattern_def,
+                                   dynamic_token_patterns_map=self._dynamic_token_patterns_map,
+                                   selector=selector,
+                                   streaming=streaming,
+                                   components_cache=self._components_cache,
+                                   expanded_group_map=self._expanded_group_map,
+                                   dedupe_phrases=self._dedupe_phrases,
+                                   string_pool=self._string_pool)
         with tqdm(exp_gen, desc='Expansion...', total=ilen, disable=disable_progress_bar, miniters=1) as expansion_tqdm:
             for utterance_combo, tokens, groups in expansion_tqdm:
                 if self._expansion_hooks_map:
-                    utterance_combo, tokens, groups = _execute_hooks(tokens,
+                    utterance_combo, tokens, groups = execute_hooks(tokens,
                                                                      (utterance_combo, tokens, groups),
                                                                      self._expansion_hooks_map)
                 yield utterance_combo, tokens, groups
 
-@overload
-def _execute_hooks(tokens: Sequence[str],
-                   args: Tuple[Sequence[Sequence[str]], Sequence[str], Sequence[Tuple[str, int]]],
-                   hooks_map: _E_H_MAP,
-                   ) -> Tuple[Sequence[Sequence[str]], Sequence[str], Sequence[Tuple[str, int]]]:
-    # pylint: disable=unused-argument
-    pass # pragma: no cover
-
-@overload
-def _execute_hooks(tokens: Sequence[str],
-                   args: Tuple[str, Sequence[str], Sequence[str]],
-                   hooks_map: _C_H_MAP,
-                   ) -> Any:
-    # pylint: disable=unused-argument
-    pass # pragma: no cover
-
-def _execute_hooks(tokens: Sequence[str],
-                   args: Union[Tuple[Sequence[Sequence[str]], Sequence[str], Sequence[Tuple[str, int]]],
-                               Tuple[str, Sequence[str], Sequence[str]]],
-                   hooks_map: Union[_E_H_MAP, _C_H_MAP]
-                   ) -> Union[Tuple[Sequence[Sequence[str]], Sequence[str], Sequence[Tuple[str, int]]], Any]:
-    key = ', '.join(tokens)
-    if key not in hooks_map:
-        key = 'DEFAULT'
-    if key in hooks_map:
-        args = reduce(lambda args, hook: hook(*args), hooks_map[key], args)
-    return args
-
-def _get_combo_options(tokens: Sequence[str],
-                       combo_options_map: Mapping[str, ComboOptions]
-                       ) -> Optional[ComboOptions]:
-    # pylint: disable=no-self-use
-    options_map = {} # type: Dict[str, ComboOptions]
-    options_map.update(combo_options_map)
-    key = ', '.join(tokens)
-    return options_map.get(key) or options_map.get('DEFAULT')
-
-def _expand_map_with_utterance_pattern_as_key(map_with_utterance_pattern_as_key: _T_UP_KEY,
-                                              groups_map: Mapping[str, Sequence[str]]
-                                              ) -> _T_UP_KEY:
-    expanded_map = {}
-    for key, hooks in map_with_utterance_pattern_as_key.items():
-        if key == 'DEFAULT':
-            expanded_map[key] = hooks
-        else:
-            utterance_pattern = key.split(', ')
-            expanded_utterance_patterns, _ = expand_utterance_patterns_ranges_and_groups((utterance_pattern,),
-                                                                                         groups_map)
-            for expanded_utterance_pattern in expanded_utterance_patterns:
-                expanded_map[', '.join(expanded_utterance_pattern)] = hooks
-    return expanded_map
-
-def _load_pattern_def(pattern_def_path: Path) -> Mapping:
-    with pattern_def_path.open(encoding='utf-8') as pattern_def_file:
-        pattern_def = yaml.load(pattern_def_file, Loader=yaml.BaseLoader)
-    return pattern_def
-
-def _extract_intent_map(pattern_def: Mapping) -> Mapping[str, str]:
-    intent_map = {}
-    for utterance_pattern_tokens in pattern_def['utterance_patterns']:
-        if isinstance(utterance_pattern_tokens, dict):
-            for intent, utterance_patterns in utterance_pattern_tokens.items():
-                for utterance_pattern in utterance_patterns:
-                    utterance_pattern_key = ', '.join(utterance_pattern)
-                    intent_map[utterance_pattern_key] = intent
-    return intent_map
-
-def _extract_entities(pattern_def: Mapping) -> Sequence[str]:
-    if 'entities' in pattern_def:
-        return pattern_def['entities']
-    return []
-
-def _merge_kwargs(accumulated_kwargs: Mapping, kwargs_to_add: Mapping) -> Mapping:
-    accumulated_kwargs = dict(deepcopy(accumulated_kwargs))
-    hooks_maps = ('expansion_hooks_map', 'combo_hooks_map')
-    for key in kwargs_to_add:
-        if key in accumulated_kwargs:
-            if key in hooks_maps:
-                acc_hooks_map = accumulated_kwargs[key]
-                kwargs_hooks_map = kwargs_to_add[key]
-                for utterance_pattern in kwargs_hooks_map:
-                    if utterance_pattern in acc_hooks_map:
-                        acc_hooks_map[utterance_pattern] = (acc_hooks_map[utterance_pattern] +
-                                                            kwargs_hooks_map[utterance_pattern])
-                    else:
-                        acc_hooks_map[utterance_pattern] = kwargs_hooks_map[utterance_pattern]
-            else:
-                raise ValueError('Multiple presets return the key: {}. Only keys in {} may overlap.'.format(key,
-                                                                                                            hooks_maps))
-        else:
-            accumulated_kwargs[key] = kwargs_to_add[key]
-    return accumulated_kwargs
+    def _invalidate_components_cache(self) -> None:
+        dynamic_token_patterns_map = self._dynamic_token_patterns_map or {}
+        for token in set(self._cached_dynamic_token_patterns) | set(dynamic_token_patterns_map):
+            if (self._cached_dynamic_token_patterns.get(token) is not dynamic_token_patterns_map.get(token) and
+                    token in self._components_cache):
+                del self._components_cache[token]
+        self._cached_dynamic_token_patterns = dict(dynamic_token_patterns_map)
+
+    def _get_selector(self,
+                      *,
+                      utterance_patterns: Optional[Sequence[str]] = None,
+                      intents: Optional[Sequence[str]] = None,
+                      tokens: Optional[Sequence[str]] = None,
+                      delta_tokens: Optional[Iterable[str]] = None
+                      ) -> Optional[Callable[[Sequence[str]], bool]]:
+        selected_keys = self._key_expander.select_keys(utterance_patterns=utterance_patterns,
+                                                       intents=intents,
+                                                       intent_map=get_intent_map(self._pattern_def))
+        return select_utterance_patterns(discard_map=self._discard_map,
+                                         selected_keys=selected_keys,
+                                         tokens=tokens,
+                                         delta_tokens=delta_tokens)
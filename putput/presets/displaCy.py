@@ -1,10 +1,11 @@
-import re
 from typing import Any
 from typing import Callable
 from typing import Mapping
 from typing import Sequence
 from typing import Tuple
 
+from putput.combiner import with_spans
+
 
 def preset() -> Callable:
     """Configures the Pipeline for the 'DISPLACY' ENT format.
@@ -53,41 +54,28 @@ def _preset(**kwargs: Any) -> Mapping: # pylint: disable=W0613
         'combo_hooks_map': combo_hooks_map
     }
 
-def _convert_to_ents(utterance: str,
-                     handled_items: Sequence[str],
-                     label_extractor: Callable[[str], str]
-                     ) -> Sequence[Mapping]:
-    ents = []
-    offset = 0
-    for handled_item in handled_items:
-        label = label_extractor(handled_item)
-        phrase = ' '.join(re.findall(r'\(([^()]+)\)', handled_item))
-        start = offset + utterance[offset:].index(phrase)
-        end = start + len(phrase)
-        ent = {
-            'start': start,
-            'end': end,
-            'label': label
-        }
-        ents.append(ent)
-        offset = end
-    return ents
+def _convert_to_ents(spans: Sequence[Tuple[str, int, int]]) -> Sequence[Mapping]:
+    return [{'start': start, 'end': end, 'label': label} for label, start, end in spans]
 
+@with_spans
 def _handled_groups_to_ent(utterance: str,
                            handled_tokens: Sequence,
-                           handled_groups: Sequence[str]
+                           handled_groups: Sequence[str], # pylint: disable=unused-argument
+                           *,
+                           token_spans: Sequence[Tuple[str, int, int]], # pylint: disable=unused-argument
+                           group_spans: Sequence[Tuple[str, int, int]]
                            ) -> Tuple[str, Sequence, Sequence[Mapping]]:
-    label_extractor = lambda s: s[s.index('{') + 1: s.index('(')]
-    ents = _convert_to_ents(utterance, handled_groups, label_extractor)
-    return utterance, handled_tokens, ents
+    return utterance, handled_tokens, _convert_to_ents(group_spans)
 
+@with_spans
 def _handled_tokens_to_ent(utterance: str,
-                           handled_tokens: Sequence[str],
-                           handled_groups: Sequence
+                           handled_tokens: Sequence[str], # pylint: disable=unused-argument
+                           handled_groups: Sequence,
+                           *,
+                           token_spans: Sequence[Tuple[str, int, int]],
+                           group_spans: Sequence[Tuple[str, int, int]] # pylint: disable=unused-argument
                            ) -> Tuple[str, Sequence[Mapping], Sequence]:
-    label_extractor = lambda s: s[s.index('[') + 1: s.index('(')]
-    ents = _convert_to_ents(utterance, handled_tokens, label_extractor)
-    return utterance, ents, handled_groups
+    return utterance, _convert_to_ents(token_spans), handled_groups
 
 def _convert_to_displaCy_visualizer(utterance: str,
                                     handled_tokens: Sequence[Mapping],
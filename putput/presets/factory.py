@@ -1,5 +1,13 @@
+from copy import deepcopy
+from typing import Any
 from typing import Callable
+from typing import Dict  # pylint: disable=unused-import
+from typing import Mapping
+from typing import Sequence
+from typing import Union
 
+from putput.expander import get_intent_map
+from putput.logger import get_logger
 from putput.presets import displaCy
 from putput.presets import iob2
 from putput.presets import luis
@@ -45,3 +53,73 @@ def get_preset(preset: str) -> Callable:
     if preset == 'STOCHASTIC': # pragma: no cover
         return stochastic.preset()
     raise ValueError('Unrecoginzed preset. Please choose from the supported presets: {}'.format(supported_presets))
+
+def get_pipeline_kwargs(preset: Union[str, Callable, Sequence[Union[str, Callable]]],
+                        pattern_def: Mapping,
+                        kwargs: Mapping[str, Any]
+                        ) -> Mapping[str, Any]:
+    """Merges the parameters presets return with the parameters for instantiating a Pipeline.
+
+    Args:
+        preset: See Pipeline.from_preset.
+
+        pattern_def: The pattern definition, whose intents and entities are passed to the presets.
+
+        kwargs: Parameters for instantiating a Pipeline.
+
+    Returns:
+        The merged parameters for instantiating a Pipeline.
+
+    Raises:
+        ValueError: If presets or kwargs contain the same keys, and those
+            keys are not 'combo_hooks_map', 'expansion_hooks_map', or 'discard_map'.
+
+    Examples:
+        >>> pattern_def = {'utterance_patterns': [['WAKE']]}
+        >>> sorted(get_pipeline_kwargs('LUIS', pattern_def, {'seed': 0}))
+        ['combo_hooks_map', 'discard_map', 'seed']
+    """
+    intent_entities_kwargs = {'__intent_map_from_pipeline': get_intent_map(pattern_def),
+                              '__entities_from_pipeline': pattern_def.get('entities', [])}
+    if isinstance(preset, str) or callable(preset):
+        presets = (preset,) # type: Sequence[Union[str, Callable]]
+    else:
+        warning = ('Presets are not guaranteed to work together. Choose presets that logically fit together. '
+                   'When in doubt, check the shapes of the return values of the hooks '
+                   'as well the transformations done in the handlers.')
+        logger = get_logger(__name__)
+        logger.warning(warning)
+        presets = preset
+    init_kwargs = {} # type: Mapping[str, Any]
+    for pre in presets:
+        preset_kwargs = get_preset(pre) if isinstance(pre, str) else pre
+        init_kwargs = _merge_kwargs(init_kwargs, preset_kwargs(**intent_entities_kwargs))
+    return _merge_kwargs(init_kwargs, kwargs)
+
+def _merge_kwargs(accumulated_kwargs: Mapping, kwargs_to_add: Mapping) -> Mapping:
+    accumulated_kwargs = dict(deepcopy(accumulated_kwargs))
+    hooks_maps = ('expansion_hooks_map', 'combo_hooks_map')
+    for key in kwargs_to_add:
+        if key in accumulated_kwargs:
+            if key == 'discard_map':
+                # Values added later win, so the discard_map passed to from_preset overrides the presets'.
+                # Keys added later are also expanded later, so they win over other keys that expand to the same.
+                discard_map = {pattern: discard for pattern, discard in accumulated_kwargs[key].items()
+                               if pattern not in kwargs_to_add[key]}
+                discard_map.update(kwargs_to_add[key])
+                accumulated_kwargs[key] = discard_map
+            elif key in hooks_maps:
+                acc_hooks_map = accumulated_kwargs[key]
+                kwargs_hooks_map = kwargs_to_add[key]
+                for utterance_pattern in kwargs_hooks_map:
+                    if utterance_pattern in acc_hooks_map:
+                        acc_hooks_map[utterance_pattern] = (acc_hooks_map[utterance_pattern] +
+                                                            kwargs_hooks_map[utterance_pattern])
+                    else:
+                        acc_hooks_map[utterance_pattern] = kwargs_hooks_map[utterance_pattern]
+            else:
+                raise ValueError('Multiple presets return the key: {}. Only keys in {} may overlap.'.format(
+                    key, hooks_maps + ('discard_map',)))
+        else:
+            accumulated_kwargs[key] = kwargs_to_add[key]
+    return accumulated_kwargs
@@ -1,12 +1,15 @@
 from functools import partial
 from typing import Any
 from typing import Callable
-from typing import List
+from typing import FrozenSet
 from typing import Mapping
 from typing import Optional
 from typing import Sequence
 from typing import Tuple
 
+from putput.combiner import pure
+from putput.combiner import split_words
+
 
 def preset(*,
            tokens_to_include: Optional[Sequence[str]] = None,
@@ -78,102 +81,56 @@ def _preset(*, # pylint: disable=W0613
     if groups_to_include and groups_to_exclude:
         raise ValueError("Cannot specify groups_to_include AND groups_to_exclude")
 
-    token_handler_map = {'DEFAULT': _iob_token_handler}
-    group_handler_map = {'DEFAULT': _iob_group_handler}
-
-    combo_hooks_map = {}
-    default_hooks = []
-
-    tokens_hook = None
-    if tokens_to_include:
-        tokens_hook = partial(_include_tokens, tokens_to_include=tokens_to_include)
-    if tokens_to_exclude:
-        tokens_hook = partial(_exclude_tokens, tokens_to_exclude=tokens_to_exclude)
-    if tokens_hook:
-        default_hooks.append(tokens_hook)
-
-    groups_hook = None
-    if groups_to_include:
-        groups_hook = partial(_include_groups, groups_to_include=groups_to_include)
-    if groups_to_exclude:
-        groups_hook = partial(_exclude_groups, groups_to_exclude=groups_to_exclude)
-    if groups_hook:
-        default_hooks.append(groups_hook)
-
-    if default_hooks:
-        combo_hooks_map.update({'DEFAULT': tuple(default_hooks)})
+    # Labels are filtered as tags are generated, so filtering costs a set lookup per distinct label and phrase
+    token_handler = _iob_token_handler
+    if tokens_to_include or tokens_to_exclude:
+        token_handler = partial(_iob_token_handler, label_filter=_compile_label_filter(tokens_to_include,
+                                                                                       tokens_to_exclude))
+    group_handler = _iob_group_handler
+    if groups_to_include or groups_to_exclude:
+        group_handler = partial(_iob_group_handler, label_filter=_compile_label_filter(groups_to_include,
+                                                                                       groups_to_exclude))
     return {
-        'token_handler_map': token_handler_map,
-        'group_handler_map': group_handler_map,
-        'combo_hooks_map': combo_hooks_map
+        'token_handler_map': {'DEFAULT': token_handler},
+        'group_handler_map': {'DEFAULT': group_handler}
     }
 
-def _iob_token_handler(token: str, phrase: str) -> str:
-    tokens = ['{}-{}'.format('B' if i == 0 else 'I', token)
-              for i, _ in enumerate(phrase.replace(" '", "'").split())]
-    return ' '.join(tokens)
-
-def _iob_group_handler(group_name: str, handled_tokens: Sequence[str]) -> str:
-    num_tokens = 0
-    for tokenized_phrase in handled_tokens:
-        num_tokens += len(tokenized_phrase.split())
-    groups = ['{}-{}'.format('B' if i == 0 else 'I', group_name)
-              for i in range(num_tokens)]
-    return ' '.join(groups)
-
-def _exclude_items(items_to_exclude: Sequence[str], iob_handled_items: List[str]) -> Sequence[str]:
-    iob_items_to_exclude = []
-    for token_to_exclude in items_to_exclude:
-        iob_items_to_exclude.append('B-{}'.format(token_to_exclude))
-        iob_items_to_exclude.append('I-{}'.format(token_to_exclude))
-
-    for i in range(len(iob_handled_items)): # pylint: disable=consider-using-enumerate
-        for token_to_exclude in iob_items_to_exclude:
-            iob_handled_items[i] = iob_handled_items[i].replace(token_to_exclude, 'O')
-    return tuple(iob_handled_items)
-
-def _include_items(items_to_include: Sequence[str], iob_handled_items: List[str]) -> Sequence[str]:
-    iob_items_to_include = set()
-    for item_to_include in items_to_include:
-        iob_items_to_include.add('B-{}'.format(item_to_include))
-        iob_items_to_include.add('I-{}'.format(item_to_include))
-
-    for i, handled_item in enumerate(iob_handled_items):
-        split_handled_item = handled_item.split()
-        for j, component in enumerate(split_handled_item):
-            if component not in iob_items_to_include:
-                split_handled_item[j] = 'O'
-        iob_handled_items[i] = ' '.join(split_handled_item)
-    return tuple(iob_handled_items)
-
-def _exclude_tokens(utterance: str,
-                    handled_tokens: Sequence[str],
-                    handled_groups: Sequence[str],
-                    tokens_to_exclude: Sequence[str]
-                    ) -> Tuple[str, Sequence[str], Sequence[str]]:
-    iob_handled_tokens = _exclude_items(tokens_to_exclude, list(handled_tokens))
-    return utterance, iob_handled_tokens, handled_groups
-
-def _exclude_groups(utterance: str,
-                    handled_tokens: Sequence[str],
-                    handled_groups: Sequence[str],
-                    groups_to_exclude: Sequence[str]
-                    ) -> Tuple[str, Sequence[str], Sequence[str]]:
-    iob_handled_groups = _exclude_items(groups_to_exclude, list(handled_groups))
-    return utterance, handled_tokens, iob_handled_groups
-
-def _include_tokens(utterance: str,
-                    handled_tokens: Sequence[str],
-                    handled_groups: Sequence[str],
-                    tokens_to_include: Sequence[str]
-                    ) -> Tuple[str, Sequence[str], Sequence[str]]:
-    iob_handled_tokens = _include_items(tokens_to_include, list(handled_tokens))
-    return utterance, iob_handled_tokens, handled_groups
-
-def _include_groups(utterance: str,
-                    handled_tokens: Sequence[str],
-                    handled_groups: Sequence[str],
-                    groups_to_include: Sequence[str]
-                    ) -> Tuple[str, Sequence[str], Sequence[str]]:
-    iob_handled_groups = _include_items(groups_to_include, list(handled_groups))
-    return utterance, handled_tokens, iob_handled_groups
+def _compile_label_filter(labels_to_include: Optional[Sequence[str]],
+                          labels_to_exclude: Optional[Sequence[str]]
+                          ) -> Tuple[bool, FrozenSet[str]]:
+    # (whether labels in the set are tagged, labels that are tagged or mapped to 'O')
+    if labels_to_include:
+        return True, frozenset(labels_to_include)
+    return False, frozenset(labels_to_exclude or ())
+
+# Both handlers are pure, so the pipeline's handler caches hold their tags for the duration of a flow
+@pure
+def _iob_token_handler(token: str,
+                       phrase: str,
+                       *,
+                       label_filter: Optional[Tuple[bool, FrozenSet[str]]] = None
+                       ) -> str:
+    return _iob_tags(_filter_label(token, label_filter), len(split_words(phrase)))
+
+@pure
+def _iob_group_handler(group_name: str,
+                       handled_tokens: Sequence[str],
+                       *,
+                       label_filter: Optional[Tuple[bool, FrozenSet[str]]] = None
+                       ) -> str:
+    # Handled tokens are tags joined by single spaces, so words are counted without splitting
+    num_tokens = sum(tokenized_phrase.count(' ') + 1 for tokenized_phrase in handled_tokens if tokenized_phrase)
+    return _iob_tags(_filter_label(group_name, label_filter), num_tokens)
+
+def _filter_label(label: str, label_filter: Optional[Tuple[bool, FrozenSet[str]]]) -> Optional[str]:
+    if label_filter is None:
+        return label
+    include, labels = label_filter
+    return label if (label in labels) == include else None
+
+def _iob_tags(label: Optional[str], num_words: int) -> str:
+    if label is None:
+        return ' '.join(['O'] * num_words)
+    if not num_words:
+        return ''
+    return ' '.join(['B-{}'.format(label)] + ['I-{}'.format(label)] * (num_words - 1))
@@ -1,10 +1,12 @@
-import re
 from functools import partial
 from typing import Any
 from typing import Callable
 from typing import Mapping
 from typing import Optional
 from typing import Sequence
+from typing import Tuple
+
+from putput.combiner import with_spans
 
 
 def preset(*,
@@ -78,51 +80,43 @@ def _preset(intent_map: Optional[Mapping[str, str]], # pylint: disable=W0613
     # Handle entities and no intent
     if entities and not intent_map:
         combo_hooks_map['DEFAULT'] = (partial(_handle_intents_and_entities, intent=None, entities=entities),)
-    else:
-        # Default case
-        combo_hooks_map['DEFAULT'] = (partial(_handle_intents_and_entities, intent='__DISCARD', entities=entities),)
+        return {
+            'combo_hooks_map': combo_hooks_map
+        }
+
+    # Default case
+    combo_hooks_map['DEFAULT'] = (partial(_handle_intents_and_entities, intent='__DISCARD', entities=entities),)
+    # Discarded utterance patterns are skipped before expansion instead of being generated and dropped
+    discard_map = {pattern: False for pattern in intent_map}
+    discard_map['DEFAULT'] = True
     return {
-        'combo_hooks_map': combo_hooks_map
+        'combo_hooks_map': combo_hooks_map,
+        'discard_map': discard_map
     }
 
-def _convert_to_luis_entities(utterance: str,
-                              entities: Sequence[str],
-                              handled_items: Sequence[str]
+def _convert_to_luis_entities(entities: Sequence[str],
+                              token_spans: Sequence[Tuple[str, int, int]]
                               ) -> Sequence[Mapping]:
-    ents = []
-    offset = 0
-    for handled_item in handled_items:
-        label = _token_extractor(handled_item)
-        phrase = ' '.join(re.findall(r'\(([^()]+)\)', handled_item))
-        start = offset + utterance[offset:].index(phrase)
-        end = start + len(phrase)
-        if label in entities:
-            ent = {
-                'entity': label,
-                'startPos': start,
-                'endPos': end
-            }
-            ents.append(ent)
-        offset = end
-    return ents
-
-def _token_extractor(handled_item: str) -> str:
-    return handled_item[handled_item.index('[') + 1: handled_item.index('(')]
+    return [{'entity': token, 'startPos': start, 'endPos': end}
+            for token, start, end in token_spans if token in entities]
 
-def _handle_intents_and_entities(utterance: str,
-                                 handled_tokens: Sequence[str],
+@with_spans
+def _handle_intents_and_entities(utterance: str, # pylint: disable=R0913
+                                 handled_tokens: Sequence[str], # pylint: disable=unused-argument
                                  _: Sequence[str],
                                  *,
                                  intent: Optional[str] = None,
-                                 entities: Sequence[str]
+                                 entities: Sequence[str],
+                                 token_spans: Sequence[Tuple[str, int, int]],
+                                 group_spans: Sequence[Tuple[str, int, int]] # pylint: disable=unused-argument
                                  ) -> Optional[Mapping]:
     if intent == '__DISCARD':
         return None
     if intent is None:
         intent = 'None'
     if len(entities) == 1 and entities[0] == '__ALL':
-        entities = list(map(_token_extractor, handled_tokens))
-    luis_entities = _convert_to_luis_entities(utterance, entities, handled_tokens)
+        entities = [token for token, _, _ in token_spans]
+    luis_entities = _convert_to_luis_entities(entities, token_spans)
     return {
         'text': utterance,
         'intent': intent,
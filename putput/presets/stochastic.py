@@ -3,18 +3,30 @@ from functools import partial
 from operator import itemgetter
 from typing import Any
 from typing import Callable
-from typing import List
+from typing import List  # pylint: disable=unused-import
 from typing import Mapping
+from typing import MutableMapping
+from typing import Optional
 from typing import Sequence
 from typing import Set
 from typing import Tuple
 
 import nltk
 
+from putput.cache import LRUCache
+from putput.combiner import with_spans
+
+_SYNONYM_PHRASES_CACHE_SIZE = 2 ** 16
+_POS_TAGS_CACHE_SIZE = 2 ** 16
+_SYNONYM_COMPONENTS_CACHE_SIZE = 2 ** 12
+
+# Between the id of utterance components and the components with their synonym components
+_SYNONYM_COMPONENTS_CACHE = MutableMapping[int, Tuple[Sequence[str], Sequence[str]]]
+
 WORDNET_POS_TAGS = set()  # type: Set[str]
 wordnet = None  # type: nltk.corpus.util.LazyCorpusLoader
 
-def preset(*, chance: int = 20) -> Callable:
+def preset(*, chance: int = 20, tag_phrases: bool = False, expand_phrases: bool = False) -> Callable:
     """Randomly replaces words with synonyms from wordnet synsets.
 
     Tags each word in the utterance with nltk's part of speech tagger. Using
@@ -23,6 +35,10 @@ def preset(*, chance: int = 20) -> Callable:
     to replace, subject to the specified chance. If no synset exists with the
     same part of speech, the original word will not be replaced.
 
+    With 'tag_phrases' or 'expand_phrases', parts of speech are cached per phrase
+    for the lifetime of the Pipeline, so a phrase is only tagged the first time it
+    is generated.
+
     Downloads nltk's wordnet, punkt, and averaged_perceptron_tagger if non-existent
     on the host.
 
@@ -30,6 +46,26 @@ def preset(*, chance: int = 20) -> Callable:
         chance: The chance between [0, 100] for each word to be replaced by
             a synonym.
 
+        tag_phrases: Option to tag each phrase on its own instead of tagging each
+            utterance. Phrases repeat across utterances far more than utterances do,
+            so tags are cached and the tagger runs much less often, but words are
+            tagged without the context of the rest of the utterance. Utterances
+            rarely repeat, so they are tagged every time without a cache.
+
+        expand_phrases: Option to replace words once per phrase during expansion instead
+            of once per utterance during combination. Each phrase of each utterance
+            component is tagged on its own, and its synonym variant, if different, is
+            added to the utterance component, so utterances are sampled from both the
+            original phrases and their variants without calling nltk per utterance.
+            The variant of a phrase is drawn once for the lifetime of the Pipeline, so
+            every utterance that contains the phrase samples from the same variant,
+            whereas without this option 'chance' is applied anew to every utterance.
+            Every phrase of an utterance component is read, including phrases of
+            dynamic tokens, so lazy sequences and providers, such as
+            putput.TextFileProvider, are materialized into a tuple. Each utterance
+            component is expanded once and shared by every utterance pattern that
+            uses it. 'tag_phrases' is implied.
+
     Returns:
         A Callable that when called returns parameters for instantiating a Pipeline.
         This Callable can be passed into putput.Pipeline as the 'preset' argument.
@@ -60,12 +96,33 @@ def preset(*, chance: int = 20) -> Callable:
     if chance not in range(101):
         raise ValueError('Invalid chance: {}. Chance accepts any integer between [0, 100]')
     _init_nltk()
-    return partial(_preset, chance=chance)
+    return partial(_preset, chance=chance, tag_phrases=tag_phrases, expand_phrases=expand_phrases)
 
 
-def _preset(chance: int, **kwargs: Any) -> Mapping: # pylint: disable=W0613
+def _preset(chance: int, # pylint: disable=W0613
+            tag_phrases: bool = False,
+            expand_phrases: bool = False,
+            **kwargs: Any
+            ) -> Mapping:
+    # Tags of each phrase, owned by the Pipeline the preset configures
+    pos_tags = LRUCache(maxsize=_POS_TAGS_CACHE_SIZE) # type: LRUCache[str, Tuple[str, ...]]
+    if expand_phrases:
+        # Variants are drawn once per phrase for the lifetime of the Pipeline
+        synonym_phrases = LRUCache(maxsize=_SYNONYM_PHRASES_CACHE_SIZE) # type: LRUCache[str, str]
+        # Utterance components are shared between utterance patterns through the components cache
+        synonym_components = LRUCache(maxsize=_SYNONYM_COMPONENTS_CACHE_SIZE) # type: _SYNONYM_COMPONENTS_CACHE
+        expansion_hooks_map = {
+            'DEFAULT': (partial(_add_synonym_phrases,
+                                chance=chance,
+                                synonym_phrases=synonym_phrases,
+                                synonym_components=synonym_components,
+                                pos_tags=pos_tags),)
+        }
+        return {
+            'expansion_hooks_map': expansion_hooks_map
+        }
     combo_hooks_map = {
-        'DEFAULT': (partial(_replace_with_synonyms, chance=chance),)
+        'DEFAULT': (partial(_replace_with_synonyms, chance=chance, pos_tags=pos_tags if tag_phrases else None),)
     }
     return {
         'combo_hooks_map': combo_hooks_map
@@ -82,65 +139,90 @@ def _init_nltk() -> None:
     WORDNET_POS_TAGS = {wordnet.ADJ, wordnet.VERB, wordnet.NOUN, wordnet.ADV}
 
 
-def _replace_with_synonyms(utterance: str,
+@with_spans
+def _replace_with_synonyms(utterance: str, # pylint: disable=R0913, R0914
                            handled_tokens: Sequence[str],
                            handled_groups: Sequence[str],
-                           chance: int
+                           chance: int,
+                           *,
+                           pos_tags: Optional[MutableMapping[str, Tuple[str, ...]]] = None,
+                           token_spans: Sequence[Tuple[str, int, int]],
+                           group_spans: Sequence[Tuple[str, int, int]]
                            ) -> Tuple[str, Sequence[str], Sequence[str]]:
     _, _ = handled_tokens, handled_groups
-    pos = _pos_tag_for_wordnet(utterance)
-    return _replace_utterance_tokens_groups_with_synonyms(handled_groups, pos, chance)
-
+    # Phrases are read from the utterance at the offsets of their tokens, so handled strings are never parsed
+    phrases = [utterance[start:end] for _, start, end in token_spans]
+    if pos_tags is not None:
+        pos = tuple(tag for phrase in phrases for tag in _pos_tag_phrase_for_wordnet(phrase, pos_tags))
+    else:
+        pos = _pos_tag_for_wordnet(utterance)
 
-def _replace_utterance_tokens_groups_with_synonyms(handled_groups: Sequence[str],
-                                                   pos: Sequence[str],
-                                                   chance: int
-                                                   ) -> Tuple[str, Sequence[str], Sequence[str]]:
     pos_position = 0
-    synonym_utterances, synonym_tokens, synonym_groups = [], [], [] # type: List[str], List[str], List[str]
-    for handled_group in handled_groups:
-        syn_utterance_components, syn_token_components, pos_position = _replace_components_with_synonyms(handled_group,
-                                                                                                         pos,
-                                                                                                         pos_position,
-                                                                                                         chance)
-        synonym_utterance_component = ' '.join(syn_utterance_components)
-        synonym_utterances.append(synonym_utterance_component)
-
-        synonym_token_components = ['[{}({})]'.format(t, u)
-                                    for u, t in zip(syn_utterance_components, syn_token_components)]
-        synonym_tokens += synonym_token_components
-
-        synonym_group_component = '{{{}}}'.format(' '.join(synonym_token_components))
-        synonym_groups.append(synonym_group_component)
+    synonym_phrases = []
+    for phrase in phrases:
+        num_words = len(phrase.split())
+        synonym_phrases.append(_replace_words_with_synonyms(phrase, pos[pos_position:pos_position + num_words], chance))
+        pos_position += num_words
+    synonym_tokens = ['[{}({})]'.format(token, synonym_phrase)
+                      for (token, _, _), synonym_phrase in zip(token_spans, synonym_phrases)]
+
+    synonym_utterances, synonym_groups = [], [] # type: List[str], List[str]
+    token_position = 0
+    for _, _, group_end in group_spans:
+        group_start_position = token_position
+        while token_position < len(token_spans) and token_spans[token_position][2] <= group_end:
+            token_position += 1
+        synonym_utterances.append(' '.join(synonym_phrases[group_start_position:token_position]))
+        synonym_groups.append('{{{}}}'.format(' '.join(synonym_tokens[group_start_position:token_position])))
     return ' '.join(synonym_utterances), tuple(synonym_tokens), tuple(synonym_groups)
 
 
-def _replace_components_with_synonyms(handled_group: str,
-                                      pos: Sequence[str],
-                                      pos_position: int,
-                                      chance: int
-                                      ) -> Tuple[Sequence[str], Sequence[str], int]:
-    num_parens = 0
-    syn_utterance_components, syn_token_components = [], [] # type: List[str], List[str]
-    for position, char in enumerate(handled_group):
-        if char == '[':
-            start_tokens_index = position + 1
-        if char == '(':
-            num_parens += 1
-            if num_parens == 2:
-                syn_token_components.append(handled_group[start_tokens_index:position])
-                start_utterance_index = position + 1
-        if char == ')':
-            num_parens -= 1
-            if num_parens == 1:
-                handled_original_utterance_component = handled_group[start_utterance_index:position]
-                handled_utterance_component_words = handled_original_utterance_component.split()
-                for i, word in enumerate(handled_utterance_component_words):
-                    if random.random() < (chance / 100) and pos[pos_position] in WORDNET_POS_TAGS:
-                        handled_utterance_component_words[i] = _get_synonym(word, pos[pos_position])
-                    pos_position += 1
-                syn_utterance_components.append(' '.join(handled_utterance_component_words))
-    return syn_utterance_components, syn_token_components, pos_position
+def _add_synonym_phrases(utterance_combo: Sequence[Sequence[str]], # pylint: disable=R0913
+                         tokens: Sequence[str],
+                         groups: Sequence[Tuple[str, int]],
+                         *,
+                         chance: int,
+                         synonym_phrases: MutableMapping[str, str],
+                         synonym_components: _SYNONYM_COMPONENTS_CACHE,
+                         pos_tags: MutableMapping[str, Tuple[str, ...]]
+                         ) -> Tuple[Sequence[Sequence[str]], Sequence[str], Sequence[Tuple[str, int]]]:
+    synonym_combo = []
+    for components in utterance_combo:
+        # Keyed by identity, and the components are held so that their id is not reused while cached
+        cached = synonym_components.get(id(components))
+        if cached is None or cached[0] is not components:
+            cached = (components,
+                      _add_synonym_phrases_to_components(components, chance, synonym_phrases, pos_tags))
+            synonym_components[id(components)] = cached
+        synonym_combo.append(cached[1])
+    return tuple(synonym_combo), tokens, groups
+
+
+def _add_synonym_phrases_to_components(components: Sequence[str],
+                                       chance: int,
+                                       synonym_phrases: MutableMapping[str, str],
+                                       pos_tags: MutableMapping[str, Tuple[str, ...]]
+                                       ) -> Sequence[str]:
+    synonym_components = list(components)
+    seen_phrases = set(components)
+    for phrase in components:
+        if phrase not in synonym_phrases:
+            synonym_phrases[phrase] = _replace_words_with_synonyms(phrase,
+                                                                   _pos_tag_phrase_for_wordnet(phrase, pos_tags),
+                                                                   chance)
+        synonym_phrase = synonym_phrases[phrase]
+        if synonym_phrase not in seen_phrases:
+            seen_phrases.add(synonym_phrase)
+            synonym_components.append(synonym_phrase)
+    return tuple(synonym_components)
+
+
+def _replace_words_with_synonyms(phrase: str, pos: Sequence[str], chance: int) -> str:
+    words = phrase.split()
+    for i, word in enumerate(words):
+        if random.random() < (chance / 100) and pos[i] in WORDNET_POS_TAGS:
+            words[i] = _get_synonym(word, pos[i])
+    return ' '.join(words)
 
 
 def _get_wordnet_pos(tag: str) -> str:
@@ -160,6 +242,17 @@ def _pos_tag_for_wordnet(utterance: str) -> Tuple[str, ...]:
     return tuple(map(_get_wordnet_pos, tuple(map(itemgetter(1), tags))))
 
 
+def _pos_tag_phrase_for_wordnet(phrase: str, pos_tags: MutableMapping[str, Tuple[str, ...]]) -> Tuple[str, ...]:
+    cached = pos_tags.get(phrase)
+    if cached is not None:
+        return cached
+    # Words are tagged as the hook splits them, so there is exactly one tag per word
+    words = phrase.split()
+    tags = tuple(map(_get_wordnet_pos, tuple(map(itemgetter(1), nltk.pos_tag(words))))) if words else ()
+    pos_tags[phrase] = tags
+    return tags
+
+
 def _get_synonym(word: str, tag: str) -> str:
     synsets = wordnet.synsets(word)
     for synset in synsets:
@@ -0,0 +1,110 @@
+import mmap
+import sqlite3
+from array import array
+from pathlib import Path
+from typing import Any
+
+from putput.joiner import LazySequence
+
+
+class TextFileProvider(LazySequence[str]):
+    """Dynamic token patterns read on demand from a text file with one token pattern per line.
+
+    The file is memory mapped and indexed by the start of each line, so only the
+    lines that are used, e.g. sampled with 'ComboOptions', are ever decoded. The index
+    costs 8 bytes per line. Use as a value in 'dynamic_token_patterns_map'.
+
+    Args:
+        path: Path to a utf-8 text file. Line endings are not part of token patterns.
+
+    Examples:
+        >>> import tempfile
+        >>> with tempfile.TemporaryDirectory() as catalog_dir:
+        ...     catalog_path = Path(catalog_dir) / 'artists.txt'
+        ...     _ = catalog_path.write_text('kanye west\\nthe beatles\\nnico\\n', encoding='utf-8')
+        ...     artists = TextFileProvider(catalog_path)
+        ...     print(len(artists), artists[1])
+        3 the beatles
+    """
+    __slots__ = ('_path', '_buffer', '_line_starts')
+
+    def __init__(self, path: Path) -> None:
+        self._path = path
+        with path.open('rb') as text_file:
+            if path.stat().st_size:
+                self._buffer = mmap.mmap(text_file.fileno(), 0, access=mmap.ACCESS_READ) # type: Any
+            else:
+                self._buffer = b''
+        line_starts = array('Q', [0])
+        position = self._buffer.find(b'\n')
+        while position != -1:
+            line_starts.append(position + 1)
+            position = self._buffer.find(b'\n', position + 1)
+        if line_starts[-1] != len(self._buffer):
+            # The last line has no trailing newline
+            line_starts.append(len(self._buffer) + 1)
+        self._line_starts = line_starts
+
+    @property
+    def path(self) -> Path:
+        """Read-only path to the text file."""
+        return self._path
+
+    def __len__(self) -> int:
+        return len(self._line_starts) - 1
+
+    def _get_item(self, index: int) -> str:
+        line = self._buffer[self._line_starts[index]:self._line_starts[index + 1] - 1]
+        if line.endswith(b'\r'):
+            line = line[:-1]
+        return line.decode('utf-8')
+
+class SQLiteProvider(LazySequence[str]):
+    """Dynamic token patterns read on demand from a column of a SQLite table.
+
+    Rows are ordered by rowid and indexed by it, so only the rows that are used,
+    e.g. sampled with 'ComboOptions', are ever queried. The index costs 8 bytes
+    per row. Use as a value in 'dynamic_token_patterns_map'.
+
+    Args:
+        database_path: Path to the SQLite database.
+
+        table: Name of the table.
+
+        column: Name of the column holding token patterns.
+
+    Examples:
+        >>> import tempfile
+        >>> with tempfile.TemporaryDirectory() as catalog_dir:
+        ...     database_path = Path(catalog_dir) / 'catalog.db'
+        ...     with sqlite3.connect(str(database_path)) as connection:
+        ...         _ = connection.execute('CREATE TABLE artists (name TEXT)')
+        ...         _ = connection.executemany('INSERT INTO artists VALUES (?)', [('kanye west',), ('nico',)])
+        ...     artists = SQLiteProvider(database_path, 'artists', 'name')
+        ...     print(len(artists), artists[-1])
+        ...     artists.close()
+        2 nico
+    """
+    __slots__ = ('_connection', '_query', '_rowids')
+
+    def __init__(self, database_path: Path, table: str, column: str) -> None:
+        self._connection = sqlite3.connect('file:{}?mode=ro'.format(database_path.as_posix()),
+                                           uri=True,
+                                           check_same_thread=False)
+        self._query = 'SELECT {} FROM {} WHERE rowid = ?'.format(_quote(column), _quote(table))
+        self._rowids = array('q', (rowid for rowid, in self._connection.execute(
+            'SELECT rowid FROM {} ORDER BY rowid'.format(_quote(table)))))
+
+    def close(self) -> None:
+        """Closes the connection to the database."""
+        self._connection.close()
+
+    def __len__(self) -> int:
+        return len(self._rowids)
+
+    def _get_item(self, index: int) -> str:
+        value, = self._connection.execute(self._query, (self._rowids[index],)).fetchone()
+        return str(value)
+
+def _quote(identifier: str) -> str:
+    return '"{}"'.format(identifier.replace('"', '""'))
@@ -0,0 +1,165 @@
+from functools import partial
+from typing import Callable
+from typing import Dict  # pylint: disable=unused-import
+from typing import Iterable
+from typing import List  # pylint: disable=unused-import
+from typing import Mapping
+from typing import Optional
+from typing import Sequence
+from typing import Set
+from typing import TypeVar
+
+from putput.cache import CacheInfo
+from putput.cache import LRUCache
+from putput.expander import expand_utterance_pattern_keys
+
+V = TypeVar('V')
+
+class KeyExpander:
+    """Expands utterance patterns used as keys, e.g. of 'combo_hooks_map' or to select utterance patterns to flow.
+
+    Expanded keys are cached, so a key is expanded once no matter how many maps and flows use it.
+
+    Args:
+        expanded_group_map: The result of expander.expand_group_map for the pattern definition.
+
+        maxsize: Ceiling for the number of expanded keys cached. If None, the cache is unbounded.
+
+    Examples:
+        >>> key_expander = KeyExpander({'PLAY_ARTIST': (('PLAY', 'ARTIST'),)})
+        >>> key_expander.expand_map({'WAKE, PLAY_ARTIST, 1-2': True, 'DEFAULT': False})
+        {'WAKE, PLAY, ARTIST': True, 'WAKE, PLAY, ARTIST, PLAY, ARTIST': True, 'DEFAULT': False}
+    """
+    def __init__(self,
+                 expanded_group_map: Mapping[str, Sequence[Sequence[str]]],
+                 *,
+                 maxsize: Optional[int] = 128
+                 ) -> None:
+        self._expanded_group_map = expanded_group_map
+        self._expanded_keys = LRUCache(maxsize=maxsize) # type: LRUCache[str, Sequence[str]]
+
+    def cache_info(self) -> CacheInfo:
+        """Returns hits, misses, maxsize, and current size of the cache of expanded keys."""
+        return self._expanded_keys.info()
+
+    def expand_keys(self, keys: Iterable[str]) -> Mapping[str, Sequence[str]]:
+        """Same as expander.expand_utterance_pattern_keys, but only expands keys that are not cached."""
+        expanded_keys = {} # type: Dict[str, Sequence[str]]
+        unexpanded_keys = [] # type: List[str]
+        for key in keys:
+            cached = self._expanded_keys.get(key) if key != 'DEFAULT' else None
+            if cached is not None:
+                expanded_keys[key] = cached
+            elif key != 'DEFAULT':
+                unexpanded_keys.append(key)
+        for key, expanded in expand_utterance_pattern_keys(unexpanded_keys, self._expanded_group_map).items():
+            self._expanded_keys[key] = expanded
+            expanded_keys[key] = expanded
+        return expanded_keys
+
+    def expand_map(self, map_with_utterance_pattern_as_key: Mapping[str, V]) -> Dict[str, V]:
+        """Same as 'expand_map_with_utterance_pattern_as_key', with the map's keys expanded by 'expand_keys'."""
+        return expand_map_with_utterance_pattern_as_key(map_with_utterance_pattern_as_key,
+                                                        self.expand_keys(map_with_utterance_pattern_as_key))
+
+    def select_keys(self,
+                    *,
+                    utterance_patterns: Optional[Sequence[str]] = None,
+                    intents: Optional[Sequence[str]] = None,
+                    intent_map: Optional[Mapping[str, str]] = None
+                    ) -> Optional[Set[str]]:
+        """Returns the expanded utterance patterns that are in utterance_patterns and have one of intents.
+
+        Args:
+            utterance_patterns: Utterance patterns to select, e.g. 'WAKE, PLAY_ARTIST, 1-2'.
+
+            intents: Intents to select.
+
+            intent_map: A mapping between an utterance pattern and its intent, see expander.get_intent_map.
+
+        Returns:
+            The selected keys, or None if neither utterance_patterns nor intents is specified.
+        """
+        selected_keys = None # type: Optional[Set[str]]
+        if utterance_patterns:
+            selected_keys = set(self.expand_map({pattern: True for pattern in utterance_patterns}))
+        if intents:
+            intent_keys = {key for key, intent in self.expand_map(intent_map or {}).items() if intent in intents}
+            selected_keys = intent_keys if selected_keys is None else selected_keys & intent_keys
+        return selected_keys
+
+def select_utterance_patterns(*,
+                              discard_map: Optional[Mapping[str, bool]] = None,
+                              selected_keys: Optional[Set[str]] = None,
+                              tokens: Optional[Iterable[str]] = None,
+                              delta_tokens: Optional[Iterable[str]] = None
+                              ) -> Optional[Callable[[Sequence[str]], bool]]:
+    """Returns a 'selector' for expander.expand that keeps utterance patterns that satisfy every argument.
+
+    Args:
+        discard_map: A mapping between an expanded utterance pattern, or 'DEFAULT',
+            and whether it is discarded.
+
+        selected_keys: Expanded utterance patterns, as ', ' separated tokens, to keep.
+
+        tokens: Tokens, at least one of which must appear in a kept utterance pattern.
+
+        delta_tokens: Tokens with new phrases, at least one of which must appear in a kept utterance pattern.
+
+    Returns:
+        The selector, or None if every utterance pattern is kept.
+
+    Examples:
+        >>> selector = select_utterance_patterns(discard_map={'WAKE, ARTIST': True}, tokens=('ARTIST',))
+        >>> selector(('WAKE', 'ARTIST')), selector(('PLAY', 'ARTIST')), selector(('WAKE',))
+        (False, True, False)
+    """
+    if not (discard_map or selected_keys is not None or tokens or delta_tokens):
+        return None
+    return partial(_is_selected,
+                   discard_map=discard_map,
+                   selected_keys=selected_keys,
+                   selected_tokens=set(tokens) if tokens else None,
+                   delta_tokens=set(delta_tokens) if delta_tokens else None)
+
+def expand_map_with_utterance_pattern_as_key(map_with_utterance_pattern_as_key: Mapping[str, V],
+                                             expanded_keys: Mapping[str, Sequence[str]]
+                                             ) -> Dict[str, V]:
+    """Replaces each utterance pattern key of a map with the keys of its expanded utterance patterns.
+
+    Args:
+        map_with_utterance_pattern_as_key: A map such as 'combo_hooks_map'. 'DEFAULT' is kept as is.
+
+        expanded_keys: The result of expander.expand_utterance_pattern_keys for the map's keys.
+
+    Examples:
+        >>> expanded_keys = {'WAKE, 1-2': ('WAKE', 'WAKE, WAKE')}
+        >>> expand_map_with_utterance_pattern_as_key({'WAKE, 1-2': True, 'DEFAULT': False}, expanded_keys)
+        {'WAKE': True, 'WAKE, WAKE': True, 'DEFAULT': False}
+    """
+    expanded_map = {} # type: Dict[str, V]
+    for key, value in map_with_utterance_pattern_as_key.items():
+        if key == 'DEFAULT':
+            expanded_map[key] = value
+        else:
+            for expanded_key in expanded_keys[key]:
+                expanded_map[expanded_key] = value
+    return expanded_map
+
+def _is_selected(tokens: Sequence[str],
+                 *,
+                 discard_map: Optional[Mapping[str, bool]],
+                 selected_keys: Optional[Set[str]],
+                 selected_tokens: Optional[Set[str]],
+                 delta_tokens: Optional[Set[str]] = None
+                 ) -> bool:
+    key = ', '.join(tokens)
+    if discard_map and discard_map.get(key, discard_map.get('DEFAULT', False)):
+        return False
+    if selected_keys is not None and key not in selected_keys:
+        return False
+    if selected_tokens is not None and selected_tokens.isdisjoint(tokens):
+        return False
+    if delta_tokens is not None and delta_tokens.isdisjoint(tokens):
+        return False
+    return True
@@ -0,0 +1,178 @@
+import hashlib
+import json
+import random
+from collections import OrderedDict
+from functools import partial
+from pathlib import Path
+from types import CodeType
+from typing import Any
+from typing import Callable
+from typing import Dict  # pylint: disable=unused-import
+from typing import Iterable
+from typing import Mapping
+from typing import Optional
+from typing import Sequence
+from typing import Tuple
+
+from putput.cache import LRUCache
+from putput.compiled import write_atomically
+from putput.joiner import ComboOptions
+
+MANIFEST_NAME = 'manifest.json'
+
+def write_shards(output_dir: Path,
+                 shards: Iterable[Tuple[str, Sequence[str], Sequence[Tuple[str, int]], Callable[[], Iterable[Any]]]],
+                 *,
+                 seed: Optional[int] = None
+                 ) -> Mapping[str, Path]:
+    """Writes one json lines shard per digest, reusing shards that are listed in the manifest of output_dir.
+
+    Args:
+        output_dir: Directory to write the shards and 'manifest.json' to.
+
+        shards: For each shard, its digest, utterance pattern, groups, and a function
+            that returns its rows. The function is only called if the shard is written.
+
+        seed: If specified, random is seeded from each digest before its rows are generated.
+
+    Returns:
+        A mapping between each digest and its shard, in order. Shards of digests that
+        are no longer present are removed.
+
+    Examples:
+        >>> import tempfile
+        >>> shards = [('0123456789abcdef', ('WAKE',), (('None', 1),), lambda: (('hi', ('[WAKE(hi)]',)),))]
+        >>> with tempfile.TemporaryDirectory() as output_dir:
+        ...     shard_paths = write_shards(Path(output_dir), shards)
+        ...     print(shard_paths['0123456789abcdef'].read_text(encoding='utf-8'))
+        ["hi", ["[WAKE(hi)]"]]
+        <BLANKLINE>
+    """
+    manifest_path = output_dir / MANIFEST_NAME
+    previous_manifest = {} # type: Mapping[str, Mapping[str, Any]]
+    if manifest_path.exists():
+        previous_manifest = json.loads(manifest_path.read_text(encoding='utf-8'))
+    manifest = OrderedDict() # type: Dict[str, Mapping[str, Any]]
+    for digest, tokens, groups, generate_rows in shards:
+        shard_path = output_dir / '{}.jsonl'.format(digest)
+        if digest not in previous_manifest or not shard_path.exists():
+            if seed is not None:
+                random.seed(int(digest[:16], 16))
+            write_atomically(shard_path, (json.dumps(row) + '\n' for row in generate_rows()))
+        manifest[digest] = {'utterance_pattern': ', '.join(tokens),
+                            'groups': groups,
+                            'shard': shard_path.name}
+    for digest, entry in previous_manifest.items():
+        if digest not in manifest and (output_dir / entry['shard']).exists():
+            (output_dir / entry['shard']).unlink()
+    write_atomically(manifest_path, (json.dumps(manifest, indent=2),))
+    return OrderedDict((digest, output_dir / entry['shard']) for digest, entry in manifest.items())
+
+def digest_utterance_pattern(utterance_combo: Sequence[Sequence[str]],
+                             tokens: Sequence[str],
+                             groups: Sequence[Tuple[str, int]],
+                             configuration: Sequence[Any],
+                             *,
+                             components_digests: Optional[Dict[int, Tuple[Sequence[str], str]]] = None
+                             ) -> str:
+    """Returns a digest of the content of an expanded utterance pattern.
+
+    Args:
+        utterance_combo: The utterance_combo of the utterance pattern.
+
+        tokens: Tokens of the utterance pattern.
+
+        groups: Groups of the utterance pattern.
+
+        configuration: Everything else that determines the utterance pattern's rows, e.g. its
+            handlers, hooks, combination options, and seed. Each item is identified by
+            'identify'.
+
+        components_digests: A cache of digests of utterance components that is shared across calls.
+
+    Examples:
+        >>> digest = digest_utterance_pattern((('hi', 'hey'),), ('WAKE',), (('None', 1),), (None,))
+        >>> len(digest)
+        64
+    """
+    if components_digests is None:
+        components_digests = {}
+    identities = [repr(tuple(tokens)), repr(tuple(map(tuple, groups)))]
+    identities.extend(map(identify, configuration))
+    # Components are shared between utterance patterns through the components cache, so they are digested once
+    for components in utterance_combo:
+        cached = components_digests.get(id(components))
+        if cached is None or cached[0] is not components:
+            components_hash = hashlib.sha256()
+            for phrase in components:
+                components_hash.update(phrase.encode('utf-8') + b'\x00')
+            cached = (components, components_hash.hexdigest())
+            components_digests[id(components)] = cached
+        identities.append(cached[1])
+    return hashlib.sha256('\x1f'.join(identities).encode('utf-8')).hexdigest()
+
+def identify(item: Any) -> str:
+    """Returns an identity of a handler, hook, ComboOptions, or value that is stable across processes.
+
+    Functions are identified by module and qualified name, and by a digest of their code, default
+    arguments, and closure, so lambdas and closures that share a qualified name are told apart,
+    and a function's identity changes with its code. Other callables are identified by module
+    and qualified name only. Caches that presets pass to their hooks hold results derived from
+    the hooks' other arguments, so they are identified by their size only.
+
+    Examples:
+        >>> identify(partial(max, default=0))
+        "partial(builtins.max, (), (('default', 0)))"
+        >>> identify(lambda phrase: phrase.upper()) == identify(lambda phrase: phrase.lower())
+        False
+        >>> identify(frozenset(('WAKE', 'PLAY')))
+        "{'PLAY', 'WAKE'}"
+    """
+    if isinstance(item, partial):
+        return 'partial({}, {}, {})'.format(identify(item.func),
+                                            identify(item.args),
+                                            identify(sorted(item.keywords.items())))
+    if callable(item):
+        return _identify_callable(item)
+    return _identify_value(item)
+
+def _identify_value(item: Any) -> str:
+    if isinstance(item, LRUCache):
+        return 'LRUCache({})'.format(item.maxsize)
+    if isinstance(item, ComboOptions):
+        return 'ComboOptions({}, {})'.format(item.max_sample_size, item.with_replacement)
+    if isinstance(item, (list, tuple)):
+        return '({})'.format(', '.join(map(identify, item)))
+    # The order of sets and dicts can depend on PYTHONHASHSEED, so their identities are sorted
+    if isinstance(item, (set, frozenset)):
+        return '{{{}}}'.format(', '.join(sorted(map(identify, item))))
+    if isinstance(item, Mapping):
+        return '{{{}}}'.format(', '.join(sorted('{}: {}'.format(identify(key), identify(value))
+                                                for key, value in item.items())))
+    return repr(item)
+
+def _identify_callable(item: Callable) -> str:
+    name = '{}.{}'.format(getattr(item, '__module__', None), getattr(item, '__qualname__', type(item).__qualname__))
+    function = getattr(item, '__func__', item)
+    if not isinstance(getattr(function, '__code__', None), CodeType):
+        return name
+    identities = [_identify_code(function.__code__),
+                  identify(function.__defaults__),
+                  identify(sorted((function.__kwdefaults__ or {}).items()))]
+    for cell in function.__closure__ or ():
+        try:
+            contents = cell.cell_contents
+        except ValueError:
+            identities.append('<empty cell>')
+            continue
+        # A recursive closure holds itself
+        identities.append(name if contents is function else identify(contents))
+    return '{}[{}]'.format(name, hashlib.sha256('\x1f'.join(identities).encode('utf-8')).hexdigest()[:16])
+
+def _identify_code(code: CodeType) -> str:
+    # repr of nested code objects includes their address, and of frozenset constants depends on PYTHONHASHSEED
+    identities = [code.co_code.hex()]
+    identities.extend(_identify_code(const) if isinstance(const, CodeType) else identify(const)
+                      for const in code.co_consts)
+    identities.extend(code.co_names)
+    return hashlib.sha256('\x1f'.join(identities).encode('utf-8')).hexdigest()
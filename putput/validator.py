@@ -3,6 +3,7 @@ import re
 from functools import reduce
 from typing import Any
 from typing import Iterable
+from typing import List
 from typing import Mapping
 from typing import Sequence
 from typing import Set
@@ -66,6 +67,57 @@ def _check_for_undefined_tokens(token_set_to_check: Set[str],
         err_msg = 'Undefined tokens: {}'.format(undefined_tokens_and_not_range)
         raise PatternDefinitionValidationError(err_msg)
 
+def _check_for_group_cycles(pattern_def: Mapping) -> None:
+    group_map = {name: [name_or_optional.strip('()').split('|') for name_or_optional in group]
+                 for group_dict in pattern_def['groups'] for name, group in group_dict.items()}
+    group_references = {name: {token for tokens in group for token in tokens if token in group_map}
+                        for name, group in group_map.items()}
+    order_groups(group_references)
+
+def order_groups(group_references: Mapping[str, Iterable[str]]) -> Sequence[str]:
+    """Orders groups so that each group comes after the groups it references.
+
+    Args:
+        group_references: A mapping between a group name and the names of the groups it references.
+
+    Returns:
+        Every group name, each after the groups it references.
+
+    Raises:
+        PatternDefinitionValidationError: If groups reference each other in a cycle.
+
+    Examples:
+        >>> order_groups({'PLAY_PHRASE': {'PLAYS'}, 'PLAYS': set()})
+        ['PLAYS', 'PLAY_PHRASE']
+        >>> order_groups({'PLAYS': {'REPLAY'}, 'REPLAY': {'PLAYS'}})
+        Traceback (most recent call last):
+        ...
+        putput.validator.PatternDefinitionValidationError: Groups cannot reference themselves: PLAYS -> REPLAY -> PLAYS
+    """
+    ordered_groups = [] # type: List[str]
+    visited = set() # type: Set[str]
+    for name in group_references:
+        _visit_group(name, group_references, visited, [], ordered_groups)
+    return ordered_groups
+
+def _visit_group(name: str,
+                 group_references: Mapping[str, Iterable[str]],
+                 visited: Set[str],
+                 path: List[str],
+                 ordered_groups: List[str]
+                 ) -> None:
+    if name in path:
+        cycle = path[path.index(name):] + [name]
+        raise PatternDefinitionValidationError('Groups cannot reference themselves: {}'.format(' -> '.join(cycle)))
+    if name in visited:
+        return
+    path.append(name)
+    for referenced_group in sorted(group_references[name]):
+        _visit_group(referenced_group, group_references, visited, path, ordered_groups)
+    path.pop()
+    visited.add(name)
+    ordered_groups.append(name)
+
 def _validate_base_pattern(pattern_def: Mapping, key: str) -> None:
     if key in pattern_def:
         _validate_instance(pattern_def[key], list, 'invalid {}'.format(key))
@@ -160,9 +212,9 @@ def validate_pattern_def(pattern_def: Mapping) -> None:
 
     Examples:
         >>> from pathlib import Path
-        >>> from putput.pipeline import _load_pattern_def
+        >>> from putput.compiled import load_pattern_def
         >>> pattern_def_path = Path(__file__).parent.parent / 'tests' / 'doc' / 'example_pattern_definition.yml'
-        >>> pattern_def = _load_pattern_def(pattern_def_path)
+        >>> pattern_def = load_pattern_def(pattern_def_path)
         >>> validate_pattern_def(pattern_def)
     """
     if not pattern_def:
@@ -207,6 +259,7 @@ def validate_pattern_def(pattern_def: Mapping) -> None:
         for base_token_dict in pattern_def['groups']:
             group_values = set(list(base_token_dict.values())[0])
             _check_for_undefined_tokens(group_values, [static_tokens, dynamic_tokens, groups])
+        _check_for_group_cycles(pattern_def)
     if 'entities' in pattern_def:
         entities = pattern_def['entities']
         _validate_instance(entities, list, 'entities must be a list and can\'t be empty')
@@ -0,0 +1,47 @@
+import unittest
+from pathlib import Path
+
+from putput.builder import PatternDefBuilder
+from putput.compiled import load_pattern_def
+
+
+class TestBuilder(unittest.TestCase):
+    def setUp(self) -> None:
+        self._base_dir = Path(__file__).parent / 'pattern_definitions' / 'valid'
+
+    def test_matches_yaml(self) -> None:
+        pattern_def = (PatternDefBuilder()
+                       .add_base_tokens('SUBJECT_PERSONAL_PRONOUN', ('he', 'she'))
+                       .add_static_token_patterns('START', (('SUBJECT_PERSONAL_PRONOUN', ('will',), ('want',)),))
+                       .add_static_token_patterns('PLAY', ((('to',), ('play', 'listen')),))
+                       .add_static_token_patterns('WAKE', ((('hi',),),))
+                       .add_group('PLAY_PHRASE', ('START', 'PLAY'))
+                       .add_utterance_patterns((('WAKE', 'PLAY_PHRASE'),))
+                       .build())
+        expected_pattern_def = load_pattern_def(self._base_dir / 'static_and_base_tokens_and_group_tokens.yml')
+        self.assertEqual(pattern_def, expected_pattern_def)
+
+    def test_intents_and_entities(self) -> None:
+        pattern_def = (PatternDefBuilder()
+                       .add_static_token_patterns('START', ((('he', 'she'), ('will',), ('want',)),))
+                       .add_static_token_patterns('PLAY', ((('to',), ('play', 'listen')),))
+                       .add_static_token_patterns('ARTIST', ((('nico', 'kanye', 'tom waits'),),))
+                       .add_static_token_patterns('SONG', ((('sunday morning', 'all falls down', 'table top joe'),),))
+                       .add_entities('ARTIST', 'SONG')
+                       .add_utterance_patterns((('START', 'PLAY', 'ARTIST'),), intent='PLAY_ARTIST')
+                       .add_utterance_patterns((('START', 'PLAY', 'SONG'),), intent='PLAY_SONG')
+                       .build())
+        expected_pattern_def = load_pattern_def(self._base_dir / 'intents_and_entities.yml')
+        self.assertEqual(pattern_def, expected_pattern_def)
+
+    def test_same_intent_listed_together(self) -> None:
+        pattern_def = (PatternDefBuilder()
+                       .add_dynamic_tokens('WAKE', 'PLAY')
+                       .add_utterance_patterns((('WAKE',),), intent='WAKE')
+                       .add_utterance_patterns((('PLAY',),))
+                       .add_utterance_patterns((('WAKE', 1, 'PLAY'),), intent='WAKE')
+                       .build())
+        self.assertEqual(pattern_def['utterance_patterns'], [{'WAKE': [['WAKE'], ['WAKE', '1', 'PLAY']]}, ['PLAY']])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+import unittest
+
+from putput.cache import CacheInfo
+from putput.cache import LRUCache
+
+
+class TestCache(unittest.TestCase):
+
+    def test_evicts_least_recently_used(self) -> None:
+        cache = LRUCache(maxsize=2) # type: LRUCache[str, int]
+        cache['a'] = 1
+        cache['b'] = 2
+        self.assertEqual(cache['a'], 1)
+        cache['c'] = 3
+        self.assertEqual(set(cache), {'a', 'c'})
+        self.assertEqual(len(cache), 2)
+
+    def test_setting_existing_key_refreshes_it(self) -> None:
+        cache = LRUCache(maxsize=2) # type: LRUCache[str, int]
+        cache['a'] = 1
+        cache['b'] = 2
+        cache['a'] = 3
+        cache['c'] = 4
+        self.assertEqual(dict(cache), {'a': 3, 'c': 4})
+
+    def test_unbounded(self) -> None:
+        cache = LRUCache(maxsize=None) # type: LRUCache[int, int]
+        for i in range(1000):
+            cache[i] = i
+        self.assertEqual(cache.info(), CacheInfo(hits=0, misses=0, maxsize=None, currsize=1000))
+
+    def test_info_counts_lookups_only(self) -> None:
+        cache = LRUCache(maxsize=4) # type: LRUCache[str, int]
+        cache['a'] = 1
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+        with self.assertRaises(KeyError):
+            cache['c'] # pylint: disable=pointless-statement
+        self.assertIn('a', cache)
+        self.assertNotIn('b', cache)
+        del cache['a']
+        self.assertEqual(cache.info(), CacheInfo(hits=1, misses=2, maxsize=4, currsize=0))
+
+    def test_invalid_maxsize(self) -> None:
+        for maxsize in (0, -1):
+            with self.assertRaises(ValueError):
+                LRUCache(maxsize=maxsize)
+
+if __name__ == '__main__':
+    unittest.main()
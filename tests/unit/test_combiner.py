@@ -1,8 +1,18 @@
 import random
 import unittest
+from functools import partial
+from typing import Sequence
 
+from putput.combiner import LabeledUtterance
+from putput.combiner import batch
 from putput.combiner import combine
+from putput.combiner import create_handler_caches
+from putput.combiner import is_batch
+from putput.combiner import is_pure
+from putput.combiner import pure
+from putput.combiner import split_words
 from putput.joiner import ComboOptions
+from putput.presets import iob2
 from tests.unit.helper_functions import compare_all_pairs
 
 
@@ -163,5 +173,231 @@ class TestCombiner(unittest.TestCase):
                  (actual_handled_groups, expected_handled_groups)]
         compare_all_pairs(self, pairs)
 
+    def test_labeled_utterances(self) -> None:
+        utterance_combo = (('he will want', 'she will want'), ('to play', 'to listen'))
+        tokens = ('START', 'PLAY')
+        groups = (('None', 1), ('None', 1))
+        combo_options = ComboOptions(max_sample_size=6, with_replacement=True)
+        _, generator = combine(utterance_combo, tokens, groups, combo_options=combo_options)
+        expected = tuple(generator)
+        random.seed(0)
+        _, generator = combine(utterance_combo, tokens, groups, combo_options=combo_options, labeled_utterances=True)
+        labeled_utterances = tuple(generator)
+        self.assertTrue(all(isinstance(record, LabeledUtterance) for record in labeled_utterances))
+        self.assertEqual(labeled_utterances, expected)
+
+        labeled_utterance = labeled_utterances[0]
+        self.assertEqual(labeled_utterance.utterance_components, ('she will want', 'to listen'))
+        self.assertEqual(labeled_utterance.tokens, tokens)
+        self.assertEqual(labeled_utterance[0], 'she will want to listen')
+        self.assertEqual(len(labeled_utterance), 3)
+        self.assertEqual(hash(labeled_utterance), hash(expected[0]))
+        self.assertFalse(hasattr(labeled_utterance, '__dict__'))
+
+    def test_labeled_utterances_build_lazily(self) -> None:
+        handled_phrases = []
+        def _token_handler(token: str, phrase: str) -> str:
+            handled_phrases.append(phrase)
+            return token
+        _, generator = combine((('hi', 'hey'),), ('WAKE',), (('None', 1),),
+                               token_handler_map={'DEFAULT': _token_handler},
+                               labeled_utterances=True)
+        labeled_utterance = next(iter(generator))
+        self.assertEqual(labeled_utterance.utterance, 'hi')
+        self.assertEqual(handled_phrases, [])
+        self.assertEqual(labeled_utterance.handled_groups, ('{None(WAKE)}',))
+        self.assertEqual(labeled_utterance.handled_tokens, ('WAKE',))
+        self.assertEqual(handled_phrases, ['hi'])
+
+    def test_fields(self) -> None:
+        handled_tokens = []
+        def _token_handler(token: str, phrase: str) -> str:
+            handled_tokens.append(token)
+            return '[{}]'.format(token)
+        def _group_handler(group_name: str, _: Sequence[str]) -> str:
+            raise AssertionError('{} should not be handled'.format(group_name))
+        utterance_combo = (('he will want', 'she will want'), ('to play', 'to listen'))
+        tokens = ('START', 'PLAY')
+        groups = (('None', 1), ('None', 1))
+        _, generator = combine(utterance_combo, tokens, groups,
+                               token_handler_map={'DEFAULT': _token_handler},
+                               group_handler_map={'DEFAULT': _group_handler},
+                               fields=('utterance',))
+        self.assertEqual(next(iter(generator)), ('he will want to play', None, None))
+        self.assertEqual(handled_tokens, [])
+        _, generator = combine(utterance_combo, tokens, groups,
+                               token_handler_map={'DEFAULT': _token_handler},
+                               group_handler_map={'DEFAULT': _group_handler},
+                               fields=('handled_tokens',))
+        self.assertEqual(next(iter(generator)), (None, ('[START]', '[PLAY]'), None))
+        _, generator = combine(utterance_combo, tokens, groups, fields=('handled_groups', 'utterance'))
+        self.assertEqual(next(iter(generator)),
+                         ('he will want to play', None, ('{None([START(he will want)])}', '{None([PLAY(to play)])}')))
+        _, generator = combine(utterance_combo, tokens, groups, fields=('utterance',), labeled_utterances=True)
+        self.assertEqual(next(iter(generator)), ('he will want to play', None, None))
+        with self.assertRaises(ValueError):
+            combine(utterance_combo, tokens, groups, fields=('utterances',))
+
+    def test_pure_handlers_are_cached(self) -> None:
+        calls = []
+        @pure
+        def _token_handler(token: str, phrase: str) -> str:
+            calls.append((token, phrase))
+            return '[{}]'.format(token)
+        def _group_handler(group_name: str, handled_tokens: Sequence[str]) -> str:
+            calls.append((group_name, handled_tokens))
+            return '{{{}}}'.format(group_name)
+        utterance_combo = (('he will want', 'she will want'), ('to play', 'to listen'))
+        tokens = ('START', 'PLAY')
+        groups = (('START_PLAY', 2),)
+        token_handler_cache = {}
+        group_handler_cache = {}
+        for labeled_utterances in (False, True):
+            _, generator = combine(utterance_combo, tokens, groups,
+                                   token_handler_map={'DEFAULT': _token_handler},
+                                   group_handler_map={'DEFAULT': partial(pure(partial(_group_handler)))},
+                                   token_handler_cache=token_handler_cache,
+                                   group_handler_cache=group_handler_cache,
+                                   labeled_utterances=labeled_utterances)
+            self.assertEqual(len(list(generator)), 4)
+        self.assertEqual(calls, [('START', 'he will want'), ('PLAY', 'to play'), ('START_PLAY', ('[START]', '[PLAY]')),
+                                 ('PLAY', 'to listen'), ('START', 'she will want')])
+
+    def test_iob2_handlers_cached_in_handler_caches(self) -> None:
+        iob2_kwargs = iob2.preset()()
+        token_handler_cache, group_handler_cache = create_handler_caches()
+        _, generator = combine((('he will want', 'she will want'), ("kanye 's", 'the beatles')),
+                               ('START', 'ARTIST'),
+                               (('None', 1), ('None', 1)),
+                               token_handler_map=iob2_kwargs['token_handler_map'],
+                               group_handler_map=iob2_kwargs['group_handler_map'],
+                               token_handler_cache=token_handler_cache,
+                               group_handler_cache=group_handler_cache)
+        self.assertEqual([handled_tokens for _, handled_tokens, _ in generator],
+                         [('B-START I-START I-START', 'B-ARTIST'),
+                          ('B-START I-START I-START', 'B-ARTIST I-ARTIST'),
+                          ('B-START I-START I-START', 'B-ARTIST'),
+                          ('B-START I-START I-START', 'B-ARTIST I-ARTIST')])
+        # Tags are computed once per distinct phrase and handled tokens of a flow
+        self.assertEqual(token_handler_cache.info().currsize, 4)
+        self.assertEqual(group_handler_cache.info().currsize, 3)
+
+    def test_filtered_iob2_handlers_cached_in_handler_caches(self) -> None:
+        iob2_kwargs = iob2.preset(tokens_to_include=('ARTIST',), groups_to_exclude=('None',))()
+        token_handler_cache, group_handler_cache = create_handler_caches()
+        for _ in range(2):
+            _, generator = combine((('he will want',), ("kanye 's", 'the beatles')),
+                                   ('START', 'ARTIST'),
+                                   (('None', 1), ('START_ARTIST', 1)),
+                                   token_handler_map=iob2_kwargs['token_handler_map'],
+                                   group_handler_map=iob2_kwargs['group_handler_map'],
+                                   token_handler_cache=token_handler_cache,
+                                   group_handler_cache=group_handler_cache)
+            self.assertEqual(list(generator),
+                             [("he will want kanye 's", ('O O O', 'B-ARTIST'), ('O O O', 'B-START_ARTIST')),
+                              ('he will want the beatles', ('O O O', 'B-ARTIST I-ARTIST'),
+                               ('O O O', 'B-START_ARTIST I-START_ARTIST'))])
+        # Handlers filtering labels are partials of pure handlers, so each phrase is tagged once
+        self.assertEqual(token_handler_cache.info().misses, 3)
+        self.assertEqual(group_handler_cache.info().misses, 3)
+
+    def test_is_pure(self) -> None:
+        def _token_handler(token: str, phrase: str) -> str:
+            return token + phrase
+        self.assertFalse(is_pure(_token_handler))
+        self.assertFalse(is_pure(partial(_token_handler, 'token')))
+        self.assertTrue(is_pure(partial(pure(_token_handler), 'token')))
+
+    def test_batch_handlers(self) -> None:
+        batches = []
+        @batch
+        def _token_handler(token: str, phrases: Sequence[str]) -> Sequence[str]:
+            batches.append((token, tuple(phrases)))
+            return ['[{}({})]'.format(token, phrase) for phrase in phrases]
+        @batch
+        def _group_handler(group_name: str, handled_tokens: Sequence[Sequence[str]]) -> Sequence[str]:
+            batches.append((group_name, len(handled_tokens)))
+            return ['{{{}({})}}'.format(group_name, ' '.join(group_handled_tokens))
+                    for group_handled_tokens in handled_tokens]
+        utterance_combo = (('he will want', 'she will want'), ('to play', 'to listen'))
+        tokens = ('START', 'PLAY')
+        groups = (('None', 1), ('None', 1))
+        _, generator = combine(utterance_combo, tokens, groups)
+        expected = tuple(generator)
+        for batch_size in (1, 3, 4, 10):
+            _, generator = combine(utterance_combo, tokens, groups,
+                                   token_handler_map={'DEFAULT': _token_handler},
+                                   group_handler_map={'DEFAULT': _group_handler},
+                                   batch_size=batch_size)
+            self.assertEqual(tuple(generator), expected)
+        _, generator = combine(utterance_combo, tokens, groups,
+                               token_handler_map={'DEFAULT': _token_handler},
+                               group_handler_map={'DEFAULT': _group_handler},
+                               labeled_utterances=True)
+        self.assertEqual(tuple(generator), expected)
+
+        batches.clear()
+        _, generator = combine(utterance_combo, tokens, groups,
+                               token_handler_map={'DEFAULT': _token_handler},
+                               fields=('handled_tokens',),
+                               batch_size=3)
+        self.assertEqual(tuple(generator), tuple((None, handled_tokens, None) for _, handled_tokens, _ in expected))
+        self.assertEqual(batches, [('START', ('he will want', 'he will want', 'she will want')),
+                                   ('PLAY', ('to play', 'to listen', 'to play')),
+                                   ('START', ('she will want',)),
+                                   ('PLAY', ('to listen',))])
+        with self.assertRaises(ValueError):
+            combine(utterance_combo, tokens, groups, batch_size=0)
+
+    def test_pure_batch_handlers_are_called_on_uncached_phrases(self) -> None:
+        batches = []
+        @pure
+        @batch
+        def _token_handler(token: str, phrases: Sequence[str]) -> Sequence[str]:
+            batches.append((token, tuple(phrases)))
+            return ['[{}]'.format(token)] * len(phrases)
+        utterance_combo = (('he will want', 'she will want'), ('to play', 'to listen'))
+        tokens = ('START', 'PLAY')
+        groups = (('None', 1), ('None', 1))
+        token_handler_cache = {}
+        for _ in range(2):
+            _, generator = combine(utterance_combo, tokens, groups,
+                                   token_handler_map={'DEFAULT': _token_handler},
+                                   token_handler_cache=token_handler_cache,
+                                   batch_size=3)
+            self.assertEqual(len(tuple(generator)), 4)
+        self.assertEqual(batches, [('START', ('he will want', 'she will want')),
+                                   ('PLAY', ('to play', 'to listen'))])
+        self.assertTrue(is_batch(partial(_token_handler, 'START')))
+        self.assertFalse(is_batch(partial(len)))
+
+    def test_spans(self) -> None:
+        utterance_combo = (('he (will) want', 'she will want'), ('to play',), ('', 'now'))
+        tokens = ('START', 'PLAY', 'TIME')
+        groups = (('START_PLAY', 2), ('None', 1))
+        for kwargs in ({}, {'fields': ('utterance',)}, {'batch_size': 3}):
+            _, generator = combine(utterance_combo, tokens, groups, spans=True, **kwargs)
+            results = list(generator)
+            self.assertEqual(len(results), 4)
+            for utterance, _, _, token_spans, group_spans in results:
+                self.assertEqual([token for token, _, _ in token_spans], list(tokens))
+                self.assertEqual([group for group, _, _ in group_spans], ['START_PLAY', 'None'])
+                self.assertEqual(' '.join(utterance[start:end] for _, start, end in token_spans), utterance)
+                self.assertEqual(utterance[group_spans[0][1]:group_spans[0][2]],
+                                 ' '.join(utterance[start:end] for _, start, end in token_spans[:2]))
+        self.assertEqual(results[0][3], (('START', 0, 14), ('PLAY', 15, 22), ('TIME', 23, 23)))
+        _, generator = combine(utterance_combo, tokens, groups, labeled_utterances=True)
+        labeled_utterance = next(iter(generator))
+        self.assertEqual((labeled_utterance.token_spans, labeled_utterance.group_spans), tuple(results[0][3:]))
+
+    def test_words(self) -> None:
+        self.assertEqual(split_words("  kanye 's  songs "), ("kanye's", 'songs'))
+        self.assertEqual(split_words(''), ())
+        _, generator = combine((('he will want',), ("kanye 's", ''),), ('START', 'ARTIST'), (('None', 2),),
+                               labeled_utterances=True)
+        labeled_utterances = list(generator)
+        self.assertEqual(labeled_utterances[0].words, (('he', 'will', 'want'), ("kanye's",)))
+        self.assertEqual([labeled_utterance.word_counts for labeled_utterance in labeled_utterances], [(3, 1), (3, 0)])
+
 if __name__ == '__main__':
     unittest.main()
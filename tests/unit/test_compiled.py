@@ -0,0 +1,57 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+from putput.compiled import CompiledExpansion
+from putput.compiled import load_pattern_def
+from putput.compiled import write_compiled_expansion
+from putput.expander import expand
+
+
+class TestCompiled(unittest.TestCase):
+    def setUp(self) -> None:
+        self._base_dir = Path(__file__).parent / 'pattern_definitions' / 'valid'
+        self._temp_dir = tempfile.TemporaryDirectory()
+        self._compiled_path = Path(self._temp_dir.name) / 'expansion.bin'
+
+    def tearDown(self) -> None:
+        self._temp_dir.cleanup()
+
+    def test_round_trip(self) -> None:
+        pattern_def = load_pattern_def(self._base_dir / 'nested_group_tokens_and_ranges.yml')
+        dynamic_token_patterns_map = {'ARTIST': ('kanye west', 'the beatles', 'beyoncé')}
+        _, generator = expand(pattern_def, dynamic_token_patterns_map=dynamic_token_patterns_map)
+        write_compiled_expansion(self._compiled_path, generator, metadata={'name': 'nested'})
+        compiled_expansion = CompiledExpansion(self._compiled_path)
+        self.assertEqual(compiled_expansion.metadata, {'name': 'nested'})
+
+        expected_length, expected_generator = expand(pattern_def, dynamic_token_patterns_map=dynamic_token_patterns_map)
+        actual_length, actual_generator = compiled_expansion.expand()
+        self.assertEqual(actual_length, expected_length)
+        self.assertEqual(tuple(actual_generator), tuple(expected_generator))
+
+    def test_shares_components(self) -> None:
+        components = ('hi', 'hey')
+        expansion = [((components, ('play',)), ('WAKE', 'PLAY'), (('None', 1), ('None', 1))),
+                     ((components,), ('WAKE',), (('None', 1),))]
+        write_compiled_expansion(self._compiled_path, expansion)
+        _, generator = CompiledExpansion(self._compiled_path).expand()
+        (first_combo, _, _), (second_combo, _, _) = generator
+        self.assertIs(first_combo[0], second_combo[0])
+
+    def test_selector(self) -> None:
+        expansion = [((('hi',), ('play',)), ('WAKE', 'PLAY'), (('None', 1), ('None', 1))),
+                     ((('hi',),), ('WAKE',), (('None', 1),))]
+        write_compiled_expansion(self._compiled_path, expansion)
+        length, generator = CompiledExpansion(self._compiled_path).expand(selector=lambda tokens: 'PLAY' in tokens)
+        self.assertEqual(length, 1)
+        _, actual_tokens, _ = zip(*generator)
+        self.assertEqual(actual_tokens, (('WAKE', 'PLAY'),))
+
+    def test_not_compiled(self) -> None:
+        self._compiled_path.write_bytes(b'not a compiled expansion')
+        with self.assertRaises(ValueError):
+            CompiledExpansion(self._compiled_path)
+
+if __name__ == '__main__':
+    unittest.main()
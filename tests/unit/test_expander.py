@@ -1,8 +1,15 @@
 import unittest
+from itertools import product
 from pathlib import Path
 
+from putput.compiled import load_pattern_def
 from putput.expander import expand
-from putput.pipeline import _load_pattern_def
+from putput.expander import expand_delta
+from putput.expander import expand_group_map
+from putput.expander import expand_utterance_pattern_keys
+from putput.expander import get_overlapping_token_patterns
+from putput.expander import stream_utterance_patterns_ranges_and_groups
+from putput.validator import PatternDefinitionValidationError
 from tests.unit.helper_functions import compare_all_pairs
 
 
@@ -14,7 +21,7 @@ class TestExpander(unittest.TestCase):
 
     def test_dynamic_token_patterns_only(self) -> None:
         dynamic_token_patterns_map = {'ARTIST': ('the beatles', 'kanye')}
-        pattern_def = _load_pattern_def(self._base_dir / 'dynamic_token_patterns_only.yml')
+        pattern_def = load_pattern_def(self._base_dir / 'dynamic_token_patterns_only.yml')
         expected_utterance_combo = ((('the beatles', 'kanye'),),)
         expected_tokens = (('ARTIST',),)
         expected_groups = (((('None', 1)),),)
@@ -26,7 +33,7 @@ class TestExpander(unittest.TestCase):
         compare_all_pairs(self, pairs)
 
     def test_static_token_patterns_only(self) -> None:
-        pattern_def = _load_pattern_def(self._base_dir / 'static_token_patterns_only.yml')
+        pattern_def = load_pattern_def(self._base_dir / 'static_token_patterns_only.yml')
         _, generator = expand(pattern_def)
         actual_utterance_combo, actual_tokens, actual_groups = zip(*generator)
         expected_utterance_combo = ((('he will want', 'she will want'), ('to play', 'to listen')),)
@@ -39,7 +46,7 @@ class TestExpander(unittest.TestCase):
 
     def test_dynamic_and_static_token_patterns(self) -> None:
         dynamic_token_patterns_map = {'ARTIST': ('the beatles', 'kanye')}
-        pattern_def = _load_pattern_def(self._base_dir / 'dynamic_and_static_token_patterns.yml')
+        pattern_def = load_pattern_def(self._base_dir / 'dynamic_and_static_token_patterns.yml')
         _, generator = expand(pattern_def, dynamic_token_patterns_map=dynamic_token_patterns_map)
         actual_utterance_combo, actual_tokens, actual_groups = zip(*generator)
         expected_utterance_combo = ((('he will want', 'she will want'),
@@ -53,7 +60,7 @@ class TestExpander(unittest.TestCase):
         compare_all_pairs(self, pairs)
 
     def test_static_and_base_tokens(self) -> None:
-        pattern_def = _load_pattern_def(self._base_dir / 'static_and_base_tokens.yml')
+        pattern_def = load_pattern_def(self._base_dir / 'static_and_base_tokens.yml')
         _, generator = expand(pattern_def)
         actual_utterance_combo, actual_tokens, actual_groups = zip(*generator)
         expected_utterance_combo = ((('he will want', 'she will want'), ('to play', 'to listen')),)
@@ -65,7 +72,7 @@ class TestExpander(unittest.TestCase):
         compare_all_pairs(self, pairs)
 
     def test_static_and_base_tokens_and_group_tokens(self) -> None:
-        pattern_def = _load_pattern_def(self._base_dir / 'static_and_base_tokens_and_group_tokens.yml')
+        pattern_def = load_pattern_def(self._base_dir / 'static_and_base_tokens_and_group_tokens.yml')
         _, generator = expand(pattern_def)
         actual_utterance_combo, actual_tokens, actual_groups = zip(*generator)
         expected_utterance_combo = ((('hi',), ('he will want', 'she will want'), ('to play', 'to listen')),)
@@ -78,7 +85,7 @@ class TestExpander(unittest.TestCase):
 
     def test_keys_in_addition_to_utterance_patterns_token_patterns(self) -> None:
         dynamic_token_patterns_map = {'ARTIST': ('the beatles', 'kanye')}
-        pattern_def = _load_pattern_def(self._base_dir / 'keys_in_addition_to_utterance_patterns_tokens_patterns.yml')
+        pattern_def = load_pattern_def(self._base_dir / 'keys_in_addition_to_utterance_patterns_tokens_patterns.yml')
         _, generator = expand(pattern_def, dynamic_token_patterns_map=dynamic_token_patterns_map)
         actual_utterance_combo, actual_tokens, actual_groups = zip(*generator)
         expected_utterance_combo = ((('he will want', 'she will want'),
@@ -94,7 +101,7 @@ class TestExpander(unittest.TestCase):
     def test_groups_with_range(self) -> None:
         artists = ('the beatles', 'kanye', 'nico', 'tom waits')
         dynamic_token_patterns_map = {'ARTIST': artists}
-        pattern_def = _load_pattern_def(self._base_dir / 'groups_with_range.yml')
+        pattern_def = load_pattern_def(self._base_dir / 'groups_with_range.yml')
         _, generator = expand(pattern_def, dynamic_token_patterns_map=dynamic_token_patterns_map)
         actual_utterance_combo, actual_tokens, actual_groups = zip(*generator)
         expected_utterance_combo = ((('she wants',), ('to play',), artists),
@@ -114,7 +121,7 @@ class TestExpander(unittest.TestCase):
     def test_groups_with_single_range(self) -> None:
         artists = ('the beatles', 'kanye', 'nico', 'tom waits')
         dynamic_token_patterns_map = {'ARTIST': artists}
-        pattern_def = _load_pattern_def(self._base_dir / 'groups_with_single_range.yml')
+        pattern_def = load_pattern_def(self._base_dir / 'groups_with_single_range.yml')
         _, generator = expand(pattern_def, dynamic_token_patterns_map=dynamic_token_patterns_map)
         actual_utterance_combo, actual_tokens, actual_groups = zip(*generator)
         expected_utterance_combo = ((('she wants',), ('to play',), artists, artists, artists),)
@@ -128,7 +135,7 @@ class TestExpander(unittest.TestCase):
     def test_utterance_patterns_with_range(self) -> None:
         artists = ('the beatles', 'kanye', 'nico', 'tom waits')
         dynamic_token_patterns_map = {'ARTIST': artists}
-        pattern_def = _load_pattern_def(self._base_dir / 'utterance_patterns_with_range.yml')
+        pattern_def = load_pattern_def(self._base_dir / 'utterance_patterns_with_range.yml')
         _, generator = expand(pattern_def, dynamic_token_patterns_map=dynamic_token_patterns_map)
         actual_utterance_combo, actual_tokens, actual_groups = zip(*generator)
         expected_utterance_combo = ((('she wants',), ('to play',), artists),
@@ -149,7 +156,7 @@ class TestExpander(unittest.TestCase):
     def test_utterance_patterns_with_range_and_non_range(self) -> None:
         artists = ('the beatles', 'kanye', 'nico', 'tom waits')
         dynamic_token_patterns_map = {'ARTIST': artists}
-        pattern_def = _load_pattern_def(self._base_dir / 'utterance_patterns_with_range_and_non_range.yml')
+        pattern_def = load_pattern_def(self._base_dir / 'utterance_patterns_with_range_and_non_range.yml')
         _, generator = expand(pattern_def, dynamic_token_patterns_map=dynamic_token_patterns_map)
         actual_utterance_combo, actual_tokens, actual_groups = zip(*generator)
         expected_utterance_combo = ((('she wants',),),
@@ -173,7 +180,7 @@ class TestExpander(unittest.TestCase):
     def test_groups_with_range_and_non_range(self) -> None:
         artists = ('the beatles', 'kanye', 'nico', 'tom waits')
         dynamic_token_patterns_map = {'ARTIST': artists}
-        pattern_def = _load_pattern_def(self._base_dir / 'groups_with_range_and_non_range.yml')
+        pattern_def = load_pattern_def(self._base_dir / 'groups_with_range_and_non_range.yml')
         _, generator = expand(pattern_def, dynamic_token_patterns_map=dynamic_token_patterns_map)
         actual_utterance_combo, actual_tokens, actual_groups = zip(*generator)
         expected_utterance_combo = ((('she wants',), ('to play',), artists, artists, artists),
@@ -188,7 +195,7 @@ class TestExpander(unittest.TestCase):
         compare_all_pairs(self, pairs)
 
     def test_nested_group_tokens(self) -> None:
-        pattern_def = _load_pattern_def(self._base_dir / 'nested_group_tokens.yml')
+        pattern_def = load_pattern_def(self._base_dir / 'nested_group_tokens.yml')
         _, generator = expand(pattern_def)
         actual_utterance_combo, actual_tokens, actual_groups = zip(*generator)
         expected_utterance_combo = ((('hi',), ('she wants',), ('to play', 'to listen'), ('to play', 'to listen')),)
@@ -200,7 +207,7 @@ class TestExpander(unittest.TestCase):
         compare_all_pairs(self, pairs)
 
     def test_nested_group_tokens_and_ranges(self) -> None:
-        pattern_def = _load_pattern_def(self._base_dir / 'nested_group_tokens_and_ranges.yml')
+        pattern_def = load_pattern_def(self._base_dir / 'nested_group_tokens_and_ranges.yml')
         _, generator = expand(pattern_def)
         actual_utterance_combo, actual_tokens, actual_groups = zip(*generator)
         expected_utterance_combo = ((('hi',), ('she wants',),
@@ -227,7 +234,7 @@ class TestExpander(unittest.TestCase):
         compare_all_pairs(self, pairs)
 
     def test_single_optional_group(self) -> None:
-        pattern_def = _load_pattern_def(self._base_dir / 'single_optional_group.yml')
+        pattern_def = load_pattern_def(self._base_dir / 'single_optional_group.yml')
         _, generator = expand(pattern_def)
         actual_utterance_combo, actual_tokens, actual_groups = zip(*generator)
         expected_utterance_combo = ((('hi',), ('she will want',), ('to play',)),
@@ -240,7 +247,7 @@ class TestExpander(unittest.TestCase):
         compare_all_pairs(self, pairs)
 
     def test_single_optional_utterance_pattern(self) -> None:
-        pattern_def = _load_pattern_def(self._base_dir / 'single_optional_utterance_pattern.yml')
+        pattern_def = load_pattern_def(self._base_dir / 'single_optional_utterance_pattern.yml')
         _, generator = expand(pattern_def)
         actual_utterance_combo, actual_tokens, actual_groups = zip(*generator)
         expected_utterance_combo = ((('hi',), ('she will want',), ('to play',)),
@@ -253,7 +260,7 @@ class TestExpander(unittest.TestCase):
         compare_all_pairs(self, pairs)
 
     def test_multiple_optional_group(self) -> None:
-        pattern_def = _load_pattern_def(self._base_dir / 'multiple_optional_group.yml')
+        pattern_def = load_pattern_def(self._base_dir / 'multiple_optional_group.yml')
         _, generator = expand(pattern_def)
         actual_utterance_combo, actual_tokens, actual_groups = zip(*generator)
         expected_utterance_combo = ((('hi',), ('she will want',), ('to play',), ('nico',)),
@@ -266,7 +273,7 @@ class TestExpander(unittest.TestCase):
         compare_all_pairs(self, pairs)
 
     def test_multiple_optional_utternace_pattern(self) -> None:
-        pattern_def = _load_pattern_def(self._base_dir / 'multiple_optional_utternace_pattern.yml')
+        pattern_def = load_pattern_def(self._base_dir / 'multiple_optional_utternace_pattern.yml')
         _, generator = expand(pattern_def)
         actual_utterance_combo, actual_tokens, actual_groups = zip(*generator)
         expected_utterance_combo = ((('hi',), ('she will want',), ('to play',), ('nico',)),
@@ -280,7 +287,7 @@ class TestExpander(unittest.TestCase):
         compare_all_pairs(self, pairs)
 
     def test_multiple_with_none_optional_group(self) -> None:
-        pattern_def = _load_pattern_def(self._base_dir / 'multiple_with_none_optional_group.yml')
+        pattern_def = load_pattern_def(self._base_dir / 'multiple_with_none_optional_group.yml')
         _, generator = expand(pattern_def)
         actual_utterance_combo, actual_tokens, actual_groups = zip(*generator)
         expected_utterance_combo = ((('hi',), ('she will want',), ('to play',)),
@@ -296,7 +303,7 @@ class TestExpander(unittest.TestCase):
         compare_all_pairs(self, pairs)
 
     def test_multiple_with_none_optional_utterance_pattern(self) -> None:
-        pattern_def = _load_pattern_def(self._base_dir / 'multiple_with_none_optional_utterance_pattern.yml')
+        pattern_def = load_pattern_def(self._base_dir / 'multiple_with_none_optional_utterance_pattern.yml')
         _, generator = expand(pattern_def)
         actual_utterance_combo, actual_tokens, actual_groups = zip(*generator)
         expected_utterance_combo = ((('hi',), ('she will want',), ('to play',)),
@@ -312,7 +319,7 @@ class TestExpander(unittest.TestCase):
         compare_all_pairs(self, pairs)
 
     def test_intents_and_entities(self) -> None:
-        pattern_def = _load_pattern_def(self._base_dir / 'intents_and_entities.yml')
+        pattern_def = load_pattern_def(self._base_dir / 'intents_and_entities.yml')
         _, generator = expand(pattern_def)
         actual_utterance_combo, actual_tokens, actual_groups = zip(*generator)
         expected_utterance_combo = ((('he will want', 'she will want'),
@@ -328,5 +335,149 @@ class TestExpander(unittest.TestCase):
                  (actual_groups, expected_groups)]
         compare_all_pairs(self, pairs)
 
+    def test_selector(self) -> None:
+        pattern_def = load_pattern_def(self._base_dir / 'intents_and_entities.yml')
+        num_utterance_patterns, generator = expand(pattern_def, selector=lambda tokens: 'SONG' in tokens)
+        actual_utterance_combo, actual_tokens, actual_groups = zip(*generator)
+        expected_utterance_combo = ((('he will want', 'she will want'),
+                                     ('to play', 'to listen'),
+                                     ('sunday morning', 'all falls down', 'table top joe')),)
+        expected_tokens = (('START', 'PLAY', 'SONG'),)
+        expected_groups = ((('None', 1), ('None', 1), ('None', 1)),)
+        self.assertEqual(num_utterance_patterns, 1)
+        pairs = [(actual_utterance_combo, expected_utterance_combo),
+                 (actual_tokens, expected_tokens),
+                 (actual_groups, expected_groups)]
+        compare_all_pairs(self, pairs)
+
+    def test_streaming(self) -> None:
+        dynamic_token_patterns_map = {'ARTIST': ('the beatles', 'kanye')}
+        for pattern_def_file in ('utterance_patterns_with_range_and_non_range.yml',
+                                 'multiple_with_none_optional_group.yml',
+                                 'nested_group_tokens_and_ranges.yml'):
+            pattern_def = load_pattern_def(self._base_dir / pattern_def_file)
+            _, generator = expand(pattern_def, dynamic_token_patterns_map=dynamic_token_patterns_map)
+            num_utterance_patterns, streaming_generator = expand(pattern_def,
+                                                                 dynamic_token_patterns_map=dynamic_token_patterns_map,
+                                                                 streaming=True)
+            self.assertIsNone(num_utterance_patterns)
+            pairs = [(list(streaming_generator), list(generator))]
+            compare_all_pairs(self, pairs)
+
+    def test_streaming_yields_before_expanding_everything(self) -> None:
+        utterance_patterns = [['WAKE', '1-1000'], ['WAKE', '1-1000'], ['PLAY']]
+        generator = stream_utterance_patterns_ranges_and_groups(utterance_patterns, {})
+        self.assertEqual(next(iter(generator)), (('WAKE',), (('None', 1),)))
+        patterns = [pattern for pattern, _ in generator]
+        self.assertEqual(len(patterns), 1000)
+        self.assertEqual(patterns[-1], ('PLAY',))
+
+    def test_components_cache(self) -> None:
+        artists = ('the beatles', 'kanye', 'nico', 'tom waits')
+        pattern_def = load_pattern_def(self._base_dir / 'utterance_patterns_with_range.yml')
+        components_cache = {} # type: dict
+        _, generator = expand(pattern_def,
+                              dynamic_token_patterns_map={'ARTIST': artists},
+                              components_cache=components_cache)
+        utterance_combos, _, _ = zip(*generator)
+        self.assertEqual(set(components_cache), {'START', 'PLAY', 'ARTIST'})
+        artist_components = {id(component) for utterance_combo in utterance_combos
+                             for component in utterance_combo if component == artists}
+        self.assertEqual(artist_components, {id(components_cache['ARTIST'])})
+
+        _, generator = expand(pattern_def,
+                              dynamic_token_patterns_map={'ARTIST': ('kanye',)},
+                              components_cache=components_cache)
+        utterance_combo, _, _ = next(iter(generator))
+        self.assertEqual(utterance_combo[-1], artists)
+
+    def test_shared_nested_groups(self) -> None:
+        utterance_patterns = [['GREETING', 'REQUEST']]
+        group_map = {'WAKES': ('WAKE', '1-2'),
+                     'GREETING': ('WAKES', 'START'),
+                     'REQUEST': ('WAKES', 'PLAY')}
+        actual_patterns = list(stream_utterance_patterns_ranges_and_groups(utterance_patterns, group_map))
+        expected_patterns = [(('WAKE', 'START', 'WAKE', 'PLAY'), (('GREETING', 2), ('REQUEST', 2))),
+                             (('WAKE', 'START', 'WAKE', 'WAKE', 'PLAY'), (('GREETING', 2), ('REQUEST', 3))),
+                             (('WAKE', 'WAKE', 'START', 'WAKE', 'PLAY'), (('GREETING', 3), ('REQUEST', 2))),
+                             (('WAKE', 'WAKE', 'START', 'WAKE', 'WAKE', 'PLAY'), (('GREETING', 3), ('REQUEST', 3)))]
+        self.assertEqual(actual_patterns, expected_patterns)
+
+    def test_group_cycle(self) -> None:
+        group_map = {'PLAYS': ('PLAY', '(|MORE_PLAYS)'), 'MORE_PLAYS': ('PLAYS',)}
+        with self.assertRaisesRegex(PatternDefinitionValidationError, 'PLAYS -> MORE_PLAYS -> PLAYS'):
+            list(stream_utterance_patterns_ranges_and_groups([['PLAYS']], group_map))
+
+    def test_expanded_group_map(self) -> None:
+        pattern_def = load_pattern_def(self._base_dir / 'nested_group_tokens_and_ranges.yml')
+        expanded_group_map = expand_group_map({'PLAY_PHRASE': ('PLAY', 'ARTIST')})
+        _, generator = expand(pattern_def,
+                              dynamic_token_patterns_map={'ARTIST': ('kanye',)},
+                              expanded_group_map=expanded_group_map)
+        _, actual_tokens, _ = zip(*generator)
+        for tokens in actual_tokens:
+            self.assertNotIn('START', tokens)
+
+    def test_expand_utterance_pattern_keys(self) -> None:
+        expanded_group_map = expand_group_map({'PLAY_PHRASE': ('(|START)', 'PLAY'), 'PLAYS': ('PLAY_PHRASE', '1-2')})
+        expected_keys = {
+            'WAKE, PLAYS': ('WAKE, PLAY', 'WAKE, PLAY, PLAY', 'WAKE, PLAY, START, PLAY', 'WAKE, START, PLAY',
+                            'WAKE, START, PLAY, PLAY', 'WAKE, START, PLAY, START, PLAY'),
+            'WAKE, PLAY_PHRASE': ('WAKE, PLAY', 'WAKE, START, PLAY')
+        }
+        actual_keys = expand_utterance_pattern_keys(['WAKE, PLAYS', 'WAKE, PLAY_PHRASE', 'DEFAULT'],
+                                                    expanded_group_map)
+        self.assertEqual({key: tuple(sorted(keys)) for key, keys in actual_keys.items()}, expected_keys)
+
+    def test_dedupe_phrases(self) -> None:
+        pattern_def = {
+            'token_patterns': [{'static': [{'ADD': [[['can'], ['she'], ['get']],
+                                                    [['can', 'may'], ['she'], ['get']]]}]},
+                               {'dynamic': ['ITEM']}],
+            'utterance_patterns': [['ADD', 'ITEM']]
+        }
+        dynamic_token_patterns_map = {'ITEM': ('fries', 'a burger', 'fries')}
+        _, generator = expand(pattern_def, dynamic_token_patterns_map=dynamic_token_patterns_map)
+        actual_utterance_combo, _, _ = next(iter(generator))
+        self.assertEqual(actual_utterance_combo, (('can she get', 'can she get', 'may she get'),
+                                                  ('fries', 'a burger', 'fries')))
+        _, generator = expand(pattern_def, dynamic_token_patterns_map=dynamic_token_patterns_map, dedupe_phrases=True)
+        actual_utterance_combo, _, _ = next(iter(generator))
+        self.assertEqual(actual_utterance_combo, (('can she get', 'may she get'), ('fries', 'a burger')))
+
+    def test_overlapping_token_patterns(self) -> None:
+        pattern_def = {
+            'token_patterns': [{'static': [{'ADD': [[['can'], ['get']],
+                                                    [['may'], ['get']],
+                                                    [['can', 'may'], ['get']],
+                                                    [['grab']]]},
+                                           {'CONJUNCTION': [[['and']]]}]},
+                               {'dynamic': ['ITEM']}]
+        }
+        actual_overlaps = get_overlapping_token_patterns(pattern_def,
+                                                         dynamic_token_patterns_map={'ITEM': ('fries', 'fries')})
+        self.assertEqual(actual_overlaps, {'ADD': ((0, 2), (1, 2)), 'ITEM': ((0, 0),)})
+
+    def test_expand_delta(self) -> None:
+        utterance_combo = (('hi', 'hey'), ('kanye', 'nico', 'tom'), ('and',), ('kanye', 'nico', 'tom'))
+        tokens = ('WAKE', 'ARTIST', 'CONJUNCTION', 'ARTIST')
+        delta = {'ARTIST': ('nico', 'tom')}
+        expected_combinations = [combination for combination in product(*utterance_combo)
+                                 if {'nico', 'tom'} & set(combination)]
+        actual_combinations = [combination
+                               for delta_combo in expand_delta(utterance_combo, tokens, delta)
+                               for combination in product(*delta_combo)]
+        self.assertEqual(sorted(actual_combinations), sorted(expected_combinations))
+
+    def test_expand_delta_adds_missing_phrases(self) -> None:
+        partitions_cache = {} # type: dict
+        actual_combos = tuple(expand_delta((('hi',), ('kanye',)),
+                                           ('WAKE', 'ARTIST'),
+                                           {'ARTIST': ('nico', 'nico'), 'SONG': ('sunday morning',)},
+                                           partitions_cache=partitions_cache))
+        self.assertEqual(actual_combos, ((('hi',), ('nico',)),))
+        self.assertEqual(tuple(partitions_cache), ('ARTIST',))
+        self.assertEqual(tuple(expand_delta((('hi',),), ('WAKE',), {'ARTIST': ('nico',)})), ())
+
 if __name__ == '__main__':
     unittest.main()
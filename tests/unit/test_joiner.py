@@ -5,8 +5,14 @@ from typing import List
 from typing import Optional
 from typing import Sequence
 
+from putput.joiner import ChainSequence
 from putput.joiner import ComboOptions
+from putput.joiner import PhrasePool
+from putput.joiner import PooledSequence
+from putput.joiner import ProductSequence
+from putput.joiner import StringPool
 from putput.joiner import join_combo
+from putput.joiner import join_combo_indices
 
 
 class TestJoiner(unittest.TestCase):
@@ -144,5 +150,78 @@ class TestJoiner(unittest.TestCase):
                        ComboOptions(max_sample_size=max_sample_size, with_replacement=True)]
         self._test_join_combo(pattern, expected_output, all_options=all_options)
 
+    def test_product_sequence_matches_join_combo(self) -> None:
+        pattern = (('he', 'she'), ('would', 'will'), ('want', 'need', 'like'))
+        expected_output = tuple(' '.join(joined) for joined in join_combo(pattern))
+        product_sequence = ProductSequence(pattern)
+        self.assertEqual(len(product_sequence), len(expected_output))
+        self.assertEqual(tuple(product_sequence[i] for i in range(len(product_sequence))), expected_output)
+        self.assertEqual(tuple(product_sequence), expected_output)
+        self.assertEqual(product_sequence[-1], expected_output[-1])
+        self.assertEqual(product_sequence[1:4], expected_output[1:4])
+        self.assertEqual(product_sequence, expected_output)
+        self.assertEqual(hash(product_sequence), hash(expected_output))
+        with self.assertRaises(IndexError):
+            product_sequence[len(expected_output)] # pylint: disable=pointless-statement
+
+    def test_product_sequence_is_lazy(self) -> None:
+        big_component = tuple(str(i) for i in range(10 ** 4))
+        product_sequence = ProductSequence((big_component, big_component, big_component))
+        self.assertEqual(len(product_sequence), 10 ** 12)
+        self.assertEqual(product_sequence[10 ** 12 - 1], '9999 9999 9999')
+        self.assertEqual(random.sample(product_sequence, 1)[0].count(' '), 2)
+
+    def test_chain_sequence(self) -> None:
+        sequences = (('hey', 'ok'), ProductSequence((('hi',), ('speaker', 'there'))), ('yo',))
+        expected_output = ('hey', 'ok', 'hi speaker', 'hi there', 'yo')
+        chain_sequence = ChainSequence(sequences)
+        self.assertEqual(len(chain_sequence), len(expected_output))
+        self.assertEqual(tuple(chain_sequence[i] for i in range(len(chain_sequence))), expected_output)
+        self.assertEqual(tuple(chain_sequence), expected_output)
+        self.assertEqual(chain_sequence[-2], 'hi there')
+        self.assertNotEqual(chain_sequence, 'hey')
+        with self.assertRaises(IndexError):
+            chain_sequence[-6] # pylint: disable=pointless-statement
+
+    def test_phrase_pool(self) -> None:
+        phrases = ('hey', '', 'café', 'ok speaker')
+        phrase_pool = PhrasePool.from_phrases(phrases)
+        self.assertEqual(len(phrase_pool), len(phrases))
+        self.assertEqual(phrase_pool, phrases)
+        self.assertEqual(phrase_pool[2], 'café')
+        self.assertEqual(phrase_pool[1:3], ('', 'café'))
+        self.assertEqual(PhrasePool(memoryview(phrase_pool.buffer), phrase_pool.offsets), phrases)
+        self.assertEqual(PhrasePool.from_phrases(()), ())
+
+    def test_join_combo_indices(self) -> None:
+        combo = (('hey', 'ok'), ('speaker', 'sound system', 'headphones'), ('play',))
+        component_lengths = tuple(map(len, combo))
+        for combo_options in (None,
+                              ComboOptions(max_sample_size=4, with_replacement=True),
+                              ComboOptions(max_sample_size=4, with_replacement=False),
+                              ComboOptions(max_sample_size=10, with_replacement=False)):
+            random.seed(0)
+            expected = tuple(join_combo(combo, combo_options=combo_options))
+            random.seed(0)
+            actual = tuple(tuple(combo[component_index][item_index]
+                                 for component_index, item_index in enumerate(component_indices))
+                           for component_indices in join_combo_indices(component_lengths, combo_options=combo_options))
+            self.assertEqual(actual, expected)
+        with self.assertRaises(ValueError):
+            join_combo_indices((1, 0))
+
+    def test_string_pool(self) -> None:
+        string_pool = StringPool()
+        phrases = ['phrase {}'.format(i) for i in range(100)] + ['', 'café']
+        string_ids = [string_pool.intern(phrase) for phrase in phrases]
+        self.assertEqual(string_ids, list(range(len(phrases))))
+        self.assertEqual([string_pool.intern(phrase) for phrase in reversed(phrases)], list(reversed(string_ids)))
+        self.assertEqual(string_pool, tuple(phrases))
+        self.assertEqual(PhrasePool(string_pool.buffer, string_pool.offsets), tuple(phrases))
+        pooled_sequence = PooledSequence(string_pool, (101, 0, 101))
+        self.assertEqual(pooled_sequence, ('café', 'phrase 0', 'café'))
+        self.assertEqual(pooled_sequence[1:], ('phrase 0', 'café'))
+        self.assertEqual(list(pooled_sequence), ['café', 'phrase 0', 'café'])
+
 if __name__ == '__main__':
     unittest.main()
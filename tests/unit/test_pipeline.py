@@ -1,5 +1,10 @@
 # pylint: disable=too-many-lines
+import json
+import os
 import random
+import subprocess
+import sys
+import tempfile
 import unittest
 from pathlib import Path
 from typing import Mapping  # pylint: disable=unused-import
@@ -7,11 +12,19 @@ from typing import Sequence
 from typing import Tuple
 
 from putput import ComboOptions
+from putput import PatternDefBuilder
 from putput import Pipeline
+from putput.combiner import batch
+from putput.combiner import LabeledUtterance
+from putput.combiner import pure
+from putput.compiled import compile_pattern_def
+from putput.compiled import CompiledExpansion
+from putput.compiled import write_compiled_expansion
 from putput.presets import displaCy
 from putput.presets import iob2
 from putput.presets import luis
 from putput.presets import stochastic
+from putput.validator import PatternDefinitionValidationError
 from tests.unit.helper_functions import compare_all_pairs
 
 
@@ -714,6 +727,23 @@ class TestPipeline(unittest.TestCase):
                  (actual_groups, expected_groups)]
         compare_all_pairs(self, pairs)
 
+    def test_iob2_preset_prefix_colliding_labels(self) -> None:
+        pattern_def = (PatternDefBuilder()
+                       .add_dynamic_tokens('ADD', 'ADD_ITEM')
+                       .add_group('ADD_GROUP', ('ADD',))
+                       .add_group('ADD_GROUP_ITEM', ('ADD_ITEM',))
+                       .add_utterance_patterns((('ADD_GROUP', 'ADD_GROUP_ITEM'),))
+                       .build())
+        dynamic_token_patterns_map = {'ADD': ('can i get',), 'ADD_ITEM': ('two fries',)}
+        for preset, expected in ((iob2.preset(tokens_to_exclude=('ADD',), groups_to_include=('ADD_GROUP_ITEM',)),
+                                  ('can i get two fries', ('O O O', 'B-ADD_ITEM I-ADD_ITEM'),
+                                   ('O O O', 'B-ADD_GROUP_ITEM I-ADD_GROUP_ITEM'))),
+                                 (iob2.preset(tokens_to_include=('ADD',), groups_to_exclude=('ADD_GROUP',)),
+                                  ('can i get two fries', ('B-ADD I-ADD I-ADD', 'O O'),
+                                   ('O O O', 'B-ADD_GROUP_ITEM I-ADD_GROUP_ITEM')))):
+            p = Pipeline.from_preset(preset, pattern_def, dynamic_token_patterns_map=dynamic_token_patterns_map)
+            self.assertEqual(list(p.flow(disable_progress_bar=self._disable_progress_bar)), [expected])
+
     def test_iob2_preset_tokens_to_include_and_tokens_to_exclude(self) -> None:
         pattern_def_path = self._base_dir / 'multiple_group_patterns.yml'
         with self.assertRaises(ValueError):
@@ -1044,6 +1074,54 @@ class TestPipeline(unittest.TestCase):
         pairs = [(luis_tests, expected_luis_tests)]
         compare_all_pairs(self, pairs)
 
+    def test_luis_and_displaCy_presets_use_spans(self) -> None:
+        pattern_def_path = self._base_dir / 'dynamic_and_static_token_patterns.yml'
+        dynamic_token_patterns_map = {'ARTIST': ('the (beatles)',)}
+        token_handler_map = {'DEFAULT': lambda token, phrase: token}
+        p = Pipeline.from_preset(luis.preset(entities=['ARTIST']),
+                                 pattern_def_path,
+                                 dynamic_token_patterns_map=dynamic_token_patterns_map,
+                                 token_handler_map=token_handler_map)
+        for luis_test in p.flow(disable_progress_bar=self._disable_progress_bar):
+            entity, = luis_test['entities']
+            self.assertEqual(luis_test['text'][entity['startPos']:entity['endPos']], 'the (beatles)')
+        p = Pipeline.from_preset(displaCy.preset(),
+                                 pattern_def_path,
+                                 dynamic_token_patterns_map=dynamic_token_patterns_map,
+                                 token_handler_map=token_handler_map,
+                                 batch_size=3)
+        for token_visualizer, _ in p.flow(disable_progress_bar=self._disable_progress_bar):
+            ents = [ent for ent in token_visualizer['ents'] if ent['label'] == 'ARTIST']
+            self.assertEqual([token_visualizer['text'][ent['start']:ent['end']] for ent in ents], ['the (beatles)'])
+
+    def test_spans_follow_utterance_changed_by_earlier_hook(self) -> None:
+        pattern_def_path = Path(__file__).parent.parent / 'doc' / 'example_pattern_definition_with_intents.yml'
+        dynamic_token_patterns_map = {'ITEM': ('fries',)}
+        # Hooks of an utterance pattern run before the hooks of the next preset for the same key
+        prefix_um_luis_preset = lambda **_: {'combo_hooks_map': {'ADD_ITEM, 2, CONJUNCTION, ITEM': (_prefix_um,)}}
+        prefix_um_displaCy_preset = lambda **_: {'combo_hooks_map': {'DEFAULT': (_prefix_um,)}}
+        for batch_size in (None, 2):
+            p = Pipeline.from_preset((prefix_um_luis_preset, 'LUIS'),
+                                     pattern_def_path,
+                                     dynamic_token_patterns_map=dynamic_token_patterns_map,
+                                     batch_size=batch_size)
+            luis_tests = list(p.flow(disable_progress_bar=self._disable_progress_bar))
+            self.assertEqual(luis_tests[0]['text'], 'um can she get fries can she get fries and fries')
+            self.assertEqual(luis_tests[0]['entities'][0], {'entity': 'ITEM', 'startPos': 15, 'endPos': 20})
+            for luis_test in luis_tests:
+                self.assertEqual([luis_test['text'][entity['startPos']:entity['endPos']]
+                                  for entity in luis_test['entities']], ['fries'] * 3)
+            p = Pipeline.from_preset((prefix_um_displaCy_preset, 'DISPLACY'),
+                                     pattern_def_path,
+                                     dynamic_token_patterns_map=dynamic_token_patterns_map,
+                                     batch_size=batch_size)
+            for token_visualizer, group_visualizer in p.flow(disable_progress_bar=self._disable_progress_bar):
+                self.assertEqual(token_visualizer['text'][:3], 'um ')
+                self.assertEqual([token_visualizer['text'][ent['start']:ent['end']]
+                                  for ent in token_visualizer['ents'] if ent['label'] == 'ITEM'], ['fries'] * 3)
+                group_ent = group_visualizer['ents'][0]
+                self.assertEqual(group_visualizer['text'][group_ent['start']:group_ent['end']][-13:], 'she get fries')
+
     def test_luis_preset_reserved_word(self) -> None:
         pattern_def_path = self._base_dir / 'multiple_group_patterns.yml'
         intent_map = {
@@ -1054,6 +1132,434 @@ class TestPipeline(unittest.TestCase):
                                  pattern_def_path,
                                  seed=0)
 
+    def test_flow_utterance_patterns_selector(self) -> None:
+        pattern_def_path = self._base_dir / 'multiple_group_patterns.yml'
+        p = Pipeline(pattern_def_path)
+        generator = p.flow(disable_progress_bar=self._disable_progress_bar, utterance_patterns=('WAKE',))
+        actual_utterances, _, _ = zip(*generator)
+        expected_utterances = ('hi',)
+        pairs = [(actual_utterances, expected_utterances)]
+        compare_all_pairs(self, pairs)
+
+    def test_flow_intents_selector(self) -> None:
+        pattern_def_path = self._base_dir / 'no_entities_multiple_intent.yml'
+        p = Pipeline(pattern_def_path)
+        generator = p.flow(disable_progress_bar=self._disable_progress_bar, intents=('PLAY_INTENT',))
+        actual_utterances, _, _ = zip(*generator)
+        expected_utterances = ('hi he will want to play', 'hi he will want to listen',
+                               'hi she will want to play', 'hi she will want to listen')
+        pairs = [(actual_utterances, expected_utterances)]
+        compare_all_pairs(self, pairs)
+
+    def test_flow_tokens_selector(self) -> None:
+        pattern_def_path = self._base_dir / 'multiple_group_patterns.yml'
+        p = Pipeline(pattern_def_path)
+        generator = p.flow(disable_progress_bar=self._disable_progress_bar, tokens=('PLAY',))
+        actual_utterances, _, _ = zip(*generator)
+        expected_utterances = ('hi he will want to play', 'hi he will want to listen',
+                               'hi she will want to play', 'hi she will want to listen')
+        pairs = [(actual_utterances, expected_utterances)]
+        compare_all_pairs(self, pairs)
+
+    def test_flow_selectors_combined(self) -> None:
+        pattern_def_path = self._base_dir / 'no_entities_multiple_intent.yml'
+        p = Pipeline(pattern_def_path)
+        generator = p.flow(disable_progress_bar=self._disable_progress_bar, intents=('WAKE_INTENT',), tokens=('PLAY',))
+        self.assertEqual(list(generator), [])
+
+    def test_flow_streaming(self) -> None:
+        pattern_def_path = self._base_dir / 'nested_group_tokens_and_ranges.yml'
+        p = Pipeline(pattern_def_path)
+        expected_results = list(p.flow(disable_progress_bar=self._disable_progress_bar))
+        actual_results = list(p.flow(disable_progress_bar=self._disable_progress_bar, streaming=True))
+        pairs = [(actual_results, expected_results)]
+        compare_all_pairs(self, pairs)
+
+    def test_components_cache_invalidated_per_token(self) -> None:
+        pattern_def_path = self._base_dir / 'dynamic_and_static_token_patterns.yml'
+        p = Pipeline(pattern_def_path, dynamic_token_patterns_map={'ARTIST': ('kanye west',)})
+        list(p.flow(disable_progress_bar=self._disable_progress_bar))
+        cached_start = p._components_cache['START'] # pylint: disable=protected-access
+
+        p.dynamic_token_patterns_map = {'ARTIST': ('the beatles',)}
+        actual_utterances, _, _ = zip(*p.flow(disable_progress_bar=self._disable_progress_bar))
+        self.assertIs(p._components_cache['START'], cached_start) # pylint: disable=protected-access
+        self.assertEqual(set(utterance[-len('the beatles'):] for utterance in actual_utterances), {'the beatles'})
+
+        p.dynamic_token_patterns_map['ARTIST'] = ('nico',) # type: ignore
+        actual_utterances, _, _ = zip(*p.flow(disable_progress_bar=self._disable_progress_bar))
+        self.assertEqual(set(utterance.split()[-1] for utterance in actual_utterances), {'nico'})
+
+    def test_add_and_remove_dynamic_token_patterns(self) -> None:
+        pattern_def_path = self._base_dir / 'dynamic_and_static_token_patterns.yml'
+        dynamic_token_patterns_map = {'ARTIST': ('kanye west',)}
+        p = Pipeline(pattern_def_path, dynamic_token_patterns_map=dynamic_token_patterns_map)
+        list(p.flow(disable_progress_bar=self._disable_progress_bar))
+        misses = p.cache_info()['components'].misses
+
+        p.add_dynamic_token_patterns('ARTIST', ('nico', 'the beatles'))
+        p.remove_dynamic_token_patterns('ARTIST', ('kanye west',))
+        self.assertEqual(dynamic_token_patterns_map, {'ARTIST': ('kanye west',)})
+        self.assertEqual(p.dynamic_token_patterns_map, {'ARTIST': ('nico', 'the beatles')})
+        actual_utterances, _, _ = zip(*p.flow(disable_progress_bar=self._disable_progress_bar))
+        self.assertEqual(p.cache_info()['components'].misses, misses + 1)
+        self.assertEqual({utterance.split(' want to ')[1].split(' ', 1)[1] for utterance in actual_utterances},
+                         {'nico', 'the beatles'})
+
+        with self.assertRaises(ValueError):
+            p.add_dynamic_token_patterns('START', ('he',))
+
+    def test_flow_delta(self) -> None:
+        pattern_def_path = self._base_dir / 'dynamic_and_static_token_patterns.yml'
+        p = Pipeline(pattern_def_path, dynamic_token_patterns_map={'ARTIST': ('kanye west', 'nico')})
+        old_results = set(p.flow(disable_progress_bar=self._disable_progress_bar))
+        p.add_dynamic_token_patterns('ARTIST', ('the beatles', 'tom waits'))
+        expected_results = set(p.flow(disable_progress_bar=self._disable_progress_bar)) - old_results
+        actual_results = list(p.flow(disable_progress_bar=self._disable_progress_bar,
+                                     delta={'ARTIST': ('the beatles', 'tom waits')}))
+        self.assertEqual(len(actual_results), len(expected_results))
+        self.assertEqual(set(actual_results), expected_results)
+        self.assertEqual(list(p.flow(disable_progress_bar=self._disable_progress_bar, delta={'SONG': ('x',)})), [])
+
+    def test_write_reuses_unchanged_shards(self) -> None:
+        pattern_def_path = self._base_dir / 'multiple_utterance_patterns.yml'
+        p = Pipeline(pattern_def_path, dynamic_token_patterns_map={'ARTIST': ('kanye west', 'nico')}, seed=0)
+        with tempfile.TemporaryDirectory() as output_dir:
+            shards = p.write(Path(output_dir), disable_progress_bar=self._disable_progress_bar)
+            self.assertEqual(len(shards), 2)
+            expected_rows = [json.loads(line) for shard in shards.values()
+                             for line in shard.read_text(encoding='utf-8').splitlines()]
+            actual_rows = [json.loads(json.dumps(row))
+                           for row in p.flow(disable_progress_bar=self._disable_progress_bar)]
+            self.assertEqual(sorted(actual_rows), sorted(expected_rows))
+            modified_times = {digest: shard.stat().st_mtime_ns for digest, shard in shards.items()}
+
+            self.assertEqual(p.write(Path(output_dir), disable_progress_bar=self._disable_progress_bar), shards)
+            self.assertEqual({digest: shard.stat().st_mtime_ns for digest, shard in shards.items()}, modified_times)
+
+            p.combo_hooks_map = {'ARTIST': (_lowercase_handled_tokens,)}
+            new_shards = p.write(Path(output_dir), disable_progress_bar=self._disable_progress_bar)
+            self.assertEqual(len(set(new_shards) & set(shards)), 1)
+            self.assertEqual(sorted(path.name for path in Path(output_dir).iterdir()),
+                             sorted([shard.name for shard in new_shards.values()] + ['manifest.json']))
+
+    def test_write_digests_do_not_depend_on_hash_seed(self) -> None:
+        # The label filter of iob2 is a frozenset, whose order depends on PYTHONHASHSEED
+        script = """
+import sys, tempfile
+from pathlib import Path
+from putput import Pipeline
+from putput.presets import iob2
+p = Pipeline.from_preset(iob2.preset(tokens_to_include=('ARTIST', 'PLAY', 'WAKE')),
+                         Path(sys.argv[1]),
+                         dynamic_token_patterns_map={'ARTIST': ('kanye west',)})
+with tempfile.TemporaryDirectory() as output_dir:
+    print(sorted(p.write(Path(output_dir), disable_progress_bar=True)))
+"""
+        pattern_def_path = self._base_dir / 'multiple_utterance_patterns.yml'
+        digests = set()
+        for hash_seed in ('1', '2', '3'):
+            env = dict(os.environ, PYTHONHASHSEED=hash_seed)
+            digests.add(subprocess.check_output([sys.executable, '-c', script, str(pattern_def_path)],
+                                                cwd=str(Path(__file__).parent.parent.parent),
+                                                env=env))
+        self.assertEqual(len(digests), 1)
+
+    def test_write_tells_lambdas_apart(self) -> None:
+        pattern_def_path = self._base_dir / 'multiple_utterance_patterns.yml'
+        p = Pipeline(pattern_def_path, dynamic_token_patterns_map={'ARTIST': ('kanye west',)})
+        p.combo_hooks_map = {'DEFAULT': (lambda utterance, tokens, groups: (utterance.upper(), tokens, groups),)}
+        with tempfile.TemporaryDirectory() as output_dir:
+            shards = p.write(Path(output_dir), disable_progress_bar=self._disable_progress_bar)
+            p.combo_hooks_map = {'DEFAULT': (lambda utterance, tokens, groups: (utterance.title(), tokens, groups),)}
+            new_shards = p.write(Path(output_dir), disable_progress_bar=self._disable_progress_bar)
+            self.assertFalse(set(new_shards) & set(shards))
+            rows = [json.loads(line) for shard in new_shards.values()
+                    for line in shard.read_text(encoding='utf-8').splitlines()]
+            self.assertIn('Kanye West', ' '.join(row[0] for row in rows))
+
+    def test_cache_size_bounds_components_cache(self) -> None:
+        pattern_def_path = self._base_dir / 'dynamic_and_static_token_patterns.yml'
+        p = Pipeline(pattern_def_path, dynamic_token_patterns_map={'ARTIST': ('kanye west',)}, cache_size=2)
+        expected_results = list(p.flow(disable_progress_bar=self._disable_progress_bar))
+        actual_results = list(p.flow(disable_progress_bar=self._disable_progress_bar))
+        cache_info = p.cache_info()['components']
+        self.assertEqual(p.cache_size, 2)
+        self.assertEqual(actual_results, expected_results)
+        self.assertEqual(cache_info.currsize, 2)
+        self.assertEqual(cache_info.misses, 6)
+
+    def test_discard_map(self) -> None:
+        pattern_def_path = self._base_dir / 'multiple_group_patterns.yml'
+        calls = [] # type: list
+        def _record(utterance_combo: Sequence[Sequence[str]],
+                    tokens: Sequence[str],
+                    groups: Sequence[Tuple[str, int]]
+                    ) -> Tuple[Sequence[Sequence[str]], Sequence[str], Sequence[Tuple[str, int]]]:
+            calls.append(tokens)
+            return utterance_combo, tokens, groups
+        p = Pipeline(pattern_def_path,
+                     expansion_hooks_map={'DEFAULT': (_record,)},
+                     discard_map={'DEFAULT': True, 'WAKE': False})
+        actual_utterances, _, _ = zip(*p.flow(disable_progress_bar=self._disable_progress_bar))
+        pairs = [(actual_utterances, ('hi',)),
+                 (calls, [('WAKE',)])]
+        compare_all_pairs(self, pairs)
+
+    def test_discard_map_expands_groups(self) -> None:
+        pattern_def_path = self._base_dir / 'multiple_group_patterns.yml'
+        p = Pipeline(pattern_def_path, discard_map={'WAKE, PLAY_PHRASE': True})
+        self.assertEqual(p.discard_map, {'WAKE, START, PLAY': True})
+
+    def test_maps_with_utterance_pattern_as_key_share_expanded_keys(self) -> None:
+        pattern_def_path = self._base_dir / 'multiple_group_patterns.yml'
+        p = Pipeline(pattern_def_path, discard_map={'WAKE, PLAY_PHRASE': True})
+        p.combo_options_map = {'WAKE, PLAY_PHRASE': ComboOptions(max_sample_size=1, with_replacement=True)}
+        self.assertEqual(tuple(p.combo_options_map), ('WAKE, START, PLAY',))
+        self.assertEqual(p.cache_info()['expanded_keys'][:2], (1, 1))
+
+    def test_dedupe_phrases(self) -> None:
+        pattern_def_path = self._base_dir / 'dynamic_and_static_token_patterns.yml'
+        dynamic_token_patterns_map = {'ARTIST': ('the beatles', 'kanye', 'the beatles')}
+        p = Pipeline(pattern_def_path, dynamic_token_patterns_map=dynamic_token_patterns_map)
+        self.assertFalse(p.dedupe_phrases)
+        self.assertEqual(p.overlapping_token_patterns(), {'ARTIST': ((0, 0),)})
+        utterances, _, _ = zip(*p.flow(disable_progress_bar=True))
+        self.assertEqual((len(utterances), len(set(utterances))), (12, 8))
+        p = Pipeline(pattern_def_path, dynamic_token_patterns_map=dynamic_token_patterns_map, dedupe_phrases=True)
+        self.assertTrue(p.dedupe_phrases)
+        utterances, _, _ = zip(*p.flow(disable_progress_bar=True))
+        self.assertEqual((len(utterances), len(set(utterances))), (8, 8))
+
+    def test_intern_phrases(self) -> None:
+        pattern_def_path = self._base_dir / 'dynamic_and_static_token_patterns.yml'
+        dynamic_token_patterns_map = {'ARTIST': ('the beatles', 'kanye', 'the beatles')}
+        expected = list(Pipeline(pattern_def_path, dynamic_token_patterns_map=dynamic_token_patterns_map).flow(
+            disable_progress_bar=True))
+        p = Pipeline(pattern_def_path, dynamic_token_patterns_map=dynamic_token_patterns_map, intern_phrases=True)
+        self.assertTrue(p.intern_phrases)
+        self.assertEqual(list(p.flow(disable_progress_bar=True)), expected)
+        p = Pipeline(pattern_def_path,
+                     dynamic_token_patterns_map=dynamic_token_patterns_map,
+                     intern_phrases=True,
+                     dedupe_phrases=True)
+        utterances, _, _ = zip(*p.flow(disable_progress_bar=True))
+        self.assertEqual((len(utterances), len(set(utterances))), (8, 8))
+
+    def test_labeled_utterances(self) -> None:
+        pattern_def_path = self._base_dir / 'multiple_utterance_patterns.yml'
+        dynamic_token_patterns_map = {'ARTIST': ('kanye west', 'nico')}
+        combo_hooks_map = {'ARTIST': (_lowercase_handled_tokens,)}
+        p = Pipeline(pattern_def_path, dynamic_token_patterns_map=dynamic_token_patterns_map, seed=0)
+        expected = list(p.flow(disable_progress_bar=self._disable_progress_bar))
+        p = Pipeline(pattern_def_path, dynamic_token_patterns_map=dynamic_token_patterns_map, seed=0,
+                     labeled_utterances=True)
+        self.assertTrue(p.labeled_utterances)
+        actual = list(p.flow(disable_progress_bar=self._disable_progress_bar))
+        self.assertTrue(all(isinstance(result, LabeledUtterance) for result in actual))
+        self.assertEqual(actual, expected)
+
+        p.combo_hooks_map = combo_hooks_map
+        with tempfile.TemporaryDirectory() as output_dir:
+            shards = p.write(Path(output_dir), disable_progress_bar=self._disable_progress_bar)
+            actual_rows = [json.loads(line) for shard in shards.values()
+                           for line in shard.read_text(encoding='utf-8').splitlines()]
+        p = Pipeline(pattern_def_path, dynamic_token_patterns_map=dynamic_token_patterns_map, seed=0,
+                     combo_hooks_map=combo_hooks_map)
+        with tempfile.TemporaryDirectory() as output_dir:
+            shards = p.write(Path(output_dir), disable_progress_bar=self._disable_progress_bar)
+            expected_rows = [json.loads(line) for shard in shards.values()
+                             for line in shard.read_text(encoding='utf-8').splitlines()]
+        self.assertEqual(actual_rows, expected_rows)
+
+    def test_flow_fields(self) -> None:
+        pattern_def_path = self._base_dir / 'multiple_utterance_patterns.yml'
+        p = Pipeline(pattern_def_path, dynamic_token_patterns_map={'ARTIST': ('kanye west', 'nico')})
+        expected = list(p.flow(disable_progress_bar=self._disable_progress_bar))
+        actual = list(p.flow(disable_progress_bar=self._disable_progress_bar, fields=('utterance', 'handled_tokens')))
+        self.assertEqual(actual, [(utterance, handled_tokens, None) for utterance, handled_tokens, _ in expected])
+
+    def test_pure_handlers_are_called_once_per_flow(self) -> None:
+        pattern_def_path = self._base_dir / 'multiple_utterance_patterns.yml'
+        calls = []
+        @pure
+        def _token_handler(token: str, phrase: str) -> str:
+            calls.append((token, phrase))
+            return '[{}({})]'.format(token, phrase)
+        p = Pipeline(pattern_def_path, dynamic_token_patterns_map={'ARTIST': ('kanye west', 'nico')})
+        expected = list(p.flow(disable_progress_bar=self._disable_progress_bar))
+        p.token_handler_map = {'DEFAULT': _token_handler}
+        self.assertEqual(list(p.flow(disable_progress_bar=self._disable_progress_bar)), expected)
+        self.assertEqual(len(calls), len(set(calls)))
+        self.assertLess(len(calls), sum(len(handled_tokens) for _, handled_tokens, _ in expected))
+
+    def test_batch_combo_hooks(self) -> None:
+        pattern_def_path = self._base_dir / 'multiple_utterance_patterns.yml'
+        dynamic_token_patterns_map = {'ARTIST': ('kanye west', 'nico', 'the beatles')}
+        batch_sizes = []
+        @batch
+        def _lowercase_handled_tokens_batch(batch_args: Sequence[Tuple[str, Sequence[str], Sequence[str]]]
+                                            ) -> Sequence[Tuple[str, Sequence[str], Sequence[str]]]:
+            batch_sizes.append(len(batch_args))
+            return [_lowercase_handled_tokens(*args) for args in batch_args]
+        p = Pipeline(pattern_def_path,
+                     dynamic_token_patterns_map=dynamic_token_patterns_map,
+                     combo_hooks_map={'DEFAULT': (_lowercase_handled_tokens, _add_handled_tokens_count)})
+        expected = list(p.flow(disable_progress_bar=self._disable_progress_bar))
+
+        p.combo_hooks_map = {'DEFAULT': (_lowercase_handled_tokens_batch, _add_handled_tokens_count)}
+        self.assertIsNone(p.batch_size)
+        self.assertEqual(list(p.flow(disable_progress_bar=self._disable_progress_bar)), expected)
+        self.assertEqual(set(batch_sizes), {1})
+
+        batch_sizes.clear()
+        p = Pipeline(pattern_def_path,
+                     dynamic_token_patterns_map=dynamic_token_patterns_map,
+                     combo_hooks_map={'DEFAULT': (_lowercase_handled_tokens_batch, _add_handled_tokens_count)},
+                     batch_size=2)
+        self.assertEqual(p.batch_size, 2)
+        self.assertEqual(list(p.flow(disable_progress_bar=self._disable_progress_bar)), expected)
+        self.assertEqual(sum(batch_sizes), len(expected))
+        self.assertEqual(max(batch_sizes), 2)
+        self.assertLess(len(batch_sizes), len(expected))
+        with self.assertRaises(ValueError):
+            Pipeline(pattern_def_path, dynamic_token_patterns_map=dynamic_token_patterns_map, batch_size=0)
+
+    def test_pattern_def_cache_dir(self) -> None:
+        pattern_def_path = self._base_dir / 'dynamic_and_static_token_patterns.yml'
+        dynamic_token_patterns_map = {'ARTIST': ('kanye',)}
+        with tempfile.TemporaryDirectory() as cache_dir:
+            p = Pipeline(pattern_def_path,
+                         dynamic_token_patterns_map=dynamic_token_patterns_map,
+                         pattern_def_cache_dir=Path(cache_dir))
+            self.assertEqual(p.pattern_def_cache_dir, Path(cache_dir))
+            compiled_paths = list(Path(cache_dir).iterdir())
+            self.assertEqual(len(compiled_paths), 1)
+
+            # compiled pattern definitions are loaded without parsing the yaml again
+            compiled_pattern_def = json.loads(compiled_paths[0].read_text(encoding='utf-8'))
+            compiled_pattern_def['utterance_patterns'] = [['ARTIST']]
+            compiled_paths[0].write_text(json.dumps(compiled_pattern_def), encoding='utf-8')
+            p = Pipeline(pattern_def_path,
+                         dynamic_token_patterns_map=dynamic_token_patterns_map,
+                         pattern_def_cache_dir=Path(cache_dir))
+            _, actual_tokens, _ = zip(*p.flow(disable_progress_bar=True))
+            self.assertEqual(actual_tokens, (('[ARTIST(kanye)]',),))
+
+    def test_compiled_pattern_def(self) -> None:
+        pattern_def_path = self._base_dir / 'dynamic_and_static_token_patterns.yml'
+        dynamic_token_patterns_map = {'ARTIST': ('kanye',)}
+        p = Pipeline.from_preset('IOB2', pattern_def_path, dynamic_token_patterns_map=dynamic_token_patterns_map)
+        expected = list(p.flow(disable_progress_bar=self._disable_progress_bar))
+        compiled_pattern_def = compile_pattern_def(pattern_def_path)
+        self.assertEqual(compiled_pattern_def.path, pattern_def_path)
+        # Each compiled pattern definition is its own
+        self.assertIsNot(compile_pattern_def(pattern_def_path).pattern_def, compiled_pattern_def.pattern_def)
+        for p in (Pipeline.from_preset('IOB2',
+                                       compiled_pattern_def,
+                                       dynamic_token_patterns_map=dynamic_token_patterns_map),
+                  Pipeline.from_preset('IOB2',
+                                       pattern_def_path=compiled_pattern_def,
+                                       dynamic_token_patterns_map=dynamic_token_patterns_map)):
+            self.assertEqual(p.pattern_def_path, pattern_def_path)
+            self.assertEqual(list(p.flow(disable_progress_bar=self._disable_progress_bar)), expected)
+
+    def test_compiled_path(self) -> None:
+        pattern_def_path = self._base_dir / 'nested_group_tokens_and_ranges.yml'
+        dynamic_token_patterns_map = {'ARTIST': ('kanye west', 'the beatles')}
+        p = Pipeline.from_preset('IOB2', pattern_def_path, dynamic_token_patterns_map=dynamic_token_patterns_map)
+        expected_output = tuple(p.flow(disable_progress_bar=True))
+        with tempfile.TemporaryDirectory() as compiled_dir:
+            compiled_path = Path(compiled_dir) / 'expansion.bin'
+            p.compile(compiled_path)
+            p = Pipeline.from_preset('IOB2', pattern_def_path, compiled_path=compiled_path)
+            self.assertEqual(p.compiled_path, compiled_path)
+            self.assertEqual(tuple(p.flow(disable_progress_bar=True)), expected_output)
+            with self.assertRaises(ValueError):
+                next(iter(p.flow(disable_progress_bar=True, streaming=True)))
+            p = Pipeline.from_preset('IOB2', pattern_def_path, compiled_path=CompiledExpansion(compiled_path))
+            self.assertEqual(p.compiled_path, compiled_path)
+            self.assertEqual(tuple(p.flow(disable_progress_bar=True)), expected_output)
+            with self.assertRaises(ValueError):
+                Pipeline(pattern_def_path,
+                         dynamic_token_patterns_map=dynamic_token_patterns_map,
+                         compiled_path=compiled_path)
+            with self.assertRaises(ValueError):
+                Pipeline(self._base_dir / 'dynamic_and_static_token_patterns.yml', compiled_path=compiled_path)
+
+    def test_compiled_path_pattern_def_is_validated(self) -> None:
+        pattern_def_path = self._base_dir / 'dynamic_and_static_token_patterns.yml'
+        dynamic_token_patterns_map = {'ARTIST': ('kanye',)}
+        expected_output = tuple(Pipeline(pattern_def_path, dynamic_token_patterns_map=dynamic_token_patterns_map)
+                                .flow(disable_progress_bar=True))
+        compiled_pattern_def = compile_pattern_def(pattern_def_path)
+        expansion = (((('kanye',),), ('ARTIST',), (('None', 1),)),)
+        with tempfile.TemporaryDirectory() as compiled_dir:
+            compiled_path = Path(compiled_dir) / 'expansion.bin'
+            # A file that claims the digest of the pattern definition, but carries an invalid one
+            write_compiled_expansion(compiled_path,
+                                     expansion,
+                                     metadata={'pattern_def_digest': compiled_pattern_def.digest,
+                                               'pattern_def': {'utterance_patterns': [['ARTIST']]}})
+            with self.assertRaises(PatternDefinitionValidationError):
+                Pipeline(pattern_def_path, compiled_path=compiled_path)
+            with self.assertRaises(PatternDefinitionValidationError):
+                Pipeline.from_preset('IOB2', pattern_def_path, compiled_path=compiled_path)
+        # The pattern definition of the file is local to the pipeline that opened it
+        p = Pipeline(pattern_def_path, dynamic_token_patterns_map=dynamic_token_patterns_map)
+        self.assertEqual(tuple(p.flow(disable_progress_bar=True)), expected_output)
+
+    def test_from_pattern_def(self) -> None:
+        pattern_def_path = self._base_dir / 'intents_and_entities.yml'
+        pattern_def = (PatternDefBuilder()
+                       .add_static_token_patterns('START', ((('he', 'she'), ('will',), ('want',)),))
+                       .add_static_token_patterns('PLAY', ((('to',), ('play', 'listen')),))
+                       .add_static_token_patterns('ARTIST', ((('nico', 'kanye', 'tom waits'),),))
+                       .add_static_token_patterns('SONG', ((('sunday morning', 'all falls down', 'table top joe'),),))
+                       .add_entities('ARTIST', 'SONG')
+                       .add_utterance_patterns((('START', 'PLAY', 'ARTIST'),), intent='PLAY_ARTIST')
+                       .add_utterance_patterns((('START', 'PLAY', 'SONG'),), intent='PLAY_SONG')
+                       .build())
+        expected_output = tuple(Pipeline.from_preset('LUIS', pattern_def_path).flow(disable_progress_bar=True))
+        p = Pipeline.from_pattern_def(pattern_def)
+        self.assertIsNone(p.pattern_def_path)
+        p = Pipeline.from_preset('LUIS', pattern_def)
+        self.assertEqual(tuple(p.flow(disable_progress_bar=True)), expected_output)
+
+    def test_from_pattern_def_validates(self) -> None:
+        pattern_def = PatternDefBuilder().add_dynamic_tokens('WAKE').add_utterance_patterns((('PLAY',),)).build()
+        with self.assertRaises(PatternDefinitionValidationError):
+            Pipeline.from_pattern_def(pattern_def)
+
+    def test_luis_preset_discards_before_expansion(self) -> None:
+        pattern_def_path = self._base_dir / 'no_entities_multiple_intent.yml'
+        intent_map = {
+            'WAKE': 'WAKE_INTENT'
+        }
+        p = Pipeline.from_preset(luis.preset(intent_map=intent_map, entities=[]), pattern_def_path)
+        self.assertEqual(p.discard_map, {'WAKE': False, 'DEFAULT': True})
+        generator = p._expand(disable_progress_bar=True, # pylint: disable=protected-access
+                              selector=p._get_selector()) # pylint: disable=protected-access
+        _, actual_tokens, _ = zip(*generator)
+        self.assertEqual(actual_tokens, (('WAKE',),))
+
+    def test_luis_preset_merges_discard_map(self) -> None:
+        pattern_def_path = self._base_dir / 'no_entities_multiple_intent.yml'
+        intent_map = {
+            'WAKE': 'WAKE_INTENT'
+        }
+        preset = luis.preset(intent_map=intent_map, entities=[])
+        p = Pipeline.from_preset(preset, pattern_def_path, discard_map={'WAKE': True})
+        # The discard_map passed to from_preset wins over the preset's
+        self.assertEqual(p.discard_map, {'WAKE': True, 'DEFAULT': True})
+        self.assertEqual(list(p.flow(disable_progress_bar=True)), [])
+        discard_preset = lambda **_: {'discard_map': {'DEFAULT': False}}
+        p = Pipeline.from_preset((preset, discard_preset), pattern_def_path)
+        # Presets later in the Sequence win
+        self.assertEqual(p.discard_map, {'WAKE': False, 'DEFAULT': False})
+        p = Pipeline.from_preset((discard_preset, preset), pattern_def_path)
+        self.assertEqual(p.discard_map, {'WAKE': False, 'DEFAULT': True})
+
     def test_properties_getter_setters_access_level(self) -> None:
         props = {} # type: dict
         props['pattern_def_path'] = self._base_dir / 'nested_group_tokens_and_ranges.yml'
@@ -1075,6 +1581,9 @@ class TestPipeline(unittest.TestCase):
         props['combo_options_map'] = {
             'WAKE': ComboOptions(max_sample_size=2, with_replacement=False)
         }
+        props['discard_map'] = {
+            'WAKE': False
+        }
         props['seed'] = 0
 
         p = Pipeline(**props)
@@ -1119,6 +1628,61 @@ class TestPipeline(unittest.TestCase):
                  (actual_groups, expected_groups)]
         compare_all_pairs(self, pairs)
 
+    def test_stochastic_preset_tag_phrases(self) -> None:
+        pattern_def_path = self._base_dir / 'all_pos.yml'
+        p = Pipeline.from_preset(stochastic.preset(chance=0, tag_phrases=True),
+                                 pattern_def_path,
+                                 seed=0)
+        expected = tuple(Pipeline(pattern_def_path, seed=0).flow(disable_progress_bar=self._disable_progress_bar))
+        actual = tuple(p.flow(disable_progress_bar=self._disable_progress_bar))
+        self.assertEqual(actual, expected)
+
+    def test_stochastic_preset_tag_phrases_cached(self) -> None:
+        pattern_def_path = self._base_dir / 'all_pos.yml'
+        p = Pipeline.from_preset(stochastic.preset(chance=80, tag_phrases=True),
+                                 pattern_def_path,
+                                 seed=0)
+        uncached = tuple(p.flow(disable_progress_bar=self._disable_progress_bar))
+        p.seed = 0
+        cached = tuple(p.flow(disable_progress_bar=self._disable_progress_bar))
+        self.assertEqual(cached, uncached)
+        expected = tuple(Pipeline(pattern_def_path, seed=0).flow(disable_progress_bar=self._disable_progress_bar))
+        for (utterance, handled_tokens, _), (expected_utterance, expected_handled_tokens, _) in zip(cached, expected):
+            # Tags are realigned to the words of each phrase, so words are replaced in place
+            self.assertEqual(len(utterance.split()), len(expected_utterance.split()))
+            self.assertEqual([handled_token.split('(')[0] for handled_token in handled_tokens],
+                             [handled_token.split('(')[0] for handled_token in expected_handled_tokens])
+        self.assertNotEqual(cached, expected)
+
+    def test_stochastic_preset_expand_phrases(self) -> None:
+        pattern_def_path = self._base_dir / 'all_pos.yml'
+        p = Pipeline.from_preset(stochastic.preset(chance=0, expand_phrases=True),
+                                 pattern_def_path,
+                                 seed=0)
+        self.assertIsNone(p.combo_hooks_map)
+        self.assertEqual(len(p.expansion_hooks_map['DEFAULT']), 1) # type: ignore
+        expected = tuple(Pipeline(pattern_def_path, seed=0).flow(disable_progress_bar=self._disable_progress_bar))
+        actual = tuple(p.flow(disable_progress_bar=self._disable_progress_bar))
+        self.assertEqual(actual, expected)
+
+    def test_stochastic_preset_expand_phrases_shares_components(self) -> None:
+        add_synonym_phrases = stochastic.preset(chance=0, expand_phrases=True)()['expansion_hooks_map']['DEFAULT'][0]
+        pos_tags = add_synonym_phrases.keywords['pos_tags']
+        for phrase in ('hi', 'hey', 'play', 'kanye'):
+            pos_tags[phrase] = ('',)
+        wake_components, artist_components = ('hi', 'hey'), ('kanye',)
+        synonym_combo, _, _ = add_synonym_phrases((wake_components, ('play',)), ('WAKE', 'PLAY'), (('None', 2),))
+        self.assertEqual(synonym_combo, (('hi', 'hey'), ('play',)))
+        other_synonym_combo, _, _ = add_synonym_phrases((wake_components, artist_components),
+                                                        ('WAKE', 'ARTIST'),
+                                                        (('None', 2),))
+        # The same utterance components map to the same synonym components across utterance patterns
+        self.assertIs(other_synonym_combo[0], synonym_combo[0])
+        self.assertEqual(other_synonym_combo[1], ('kanye',))
+        # Components are cached by identity, so equal components that are not shared are expanded again
+        equal_synonym_combo, _, _ = add_synonym_phrases((tuple(list(wake_components)),), ('WAKE',), (('None', 1),))
+        self.assertIsNot(equal_synonym_combo[0], synonym_combo[0])
+
     def test_chaining_preset_obj(self) -> None:
         pattern_def_path = self._base_dir / 'multiple_group_patterns.yml'
         presets = (iob2.preset(tokens_to_include=('WAKE',)),
@@ -1127,7 +1691,8 @@ class TestPipeline(unittest.TestCase):
                                  pattern_def_path,
                                  seed=0)
         self.assertTrue(hasattr(p, 'combo_hooks_map'))
-        self.assertEqual(len(p.combo_hooks_map['DEFAULT']), 2) # type: ignore
+        # iob2 filters tokens in its token handler, so only luis adds a combo hook
+        self.assertEqual(len(p.combo_hooks_map['DEFAULT']), 1) # type: ignore
         self.assertTrue(hasattr(p, 'token_handler_map'))
         self.assertTrue(hasattr(p, 'group_handler_map'))
 
@@ -1238,6 +1803,18 @@ def _add_random_words(utterance: str,
     utterance = ' '.join(utterances)
     return utterance, handled_tokens, handled_groups
 
+def _prefix_um(utterance: str,
+               handled_tokens: Sequence[str],
+               handled_groups: Sequence[str]
+               ) -> Tuple[str, Sequence[str], Sequence[str]]:
+    return 'um ' + utterance, handled_tokens, handled_groups
+
+def _add_handled_tokens_count(utterance: str,
+                              handled_tokens: Sequence[str],
+                              handled_groups: Sequence[str]
+                              ) -> Tuple[str, Sequence[str], Sequence[str], int]:
+    return utterance, handled_tokens, handled_groups, len(handled_tokens)
+
 def _lowercase_handled_tokens(utterance: str,
                               handled_tokens: Sequence[str],
                               handled_groups: Sequence[str]
@@ -0,0 +1,84 @@
+import sqlite3
+import tempfile
+import unittest
+from pathlib import Path
+
+from putput import ComboOptions
+from putput import Pipeline
+from putput.compiled import load_pattern_def
+from putput.expander import expand
+from putput.joiner import ChainSequence
+from putput.providers import SQLiteProvider
+from putput.providers import TextFileProvider
+
+
+class TestProviders(unittest.TestCase):
+    def setUp(self) -> None:
+        self._base_dir = Path(__file__).parent / 'pattern_definitions' / 'valid'
+        self._temp_dir = tempfile.TemporaryDirectory()
+        self._catalog_dir = Path(self._temp_dir.name)
+
+    def tearDown(self) -> None:
+        self._temp_dir.cleanup()
+
+    def test_text_file_provider(self) -> None:
+        catalog_path = self._catalog_dir / 'artists.txt'
+        catalog_path.write_bytes('kanye west\r\nbeyoncé\n\nnico'.encode('utf-8'))
+        artists = TextFileProvider(catalog_path)
+        self.assertEqual(artists.path, catalog_path)
+        self.assertEqual(artists, ('kanye west', 'beyoncé', '', 'nico'))
+        self.assertEqual(artists[-1], 'nico')
+        with self.assertRaises(IndexError):
+            artists[4] # pylint: disable=pointless-statement
+
+    def test_empty_text_file_provider(self) -> None:
+        catalog_path = self._catalog_dir / 'artists.txt'
+        catalog_path.write_bytes(b'')
+        self.assertEqual(len(TextFileProvider(catalog_path)), 0)
+
+    def test_sqlite_provider(self) -> None:
+        database_path = self._catalog_dir / 'catalog.db'
+        connection = sqlite3.connect(str(database_path))
+        connection.execute('CREATE TABLE "artist names" (id INTEGER, name TEXT)')
+        connection.executemany('INSERT INTO "artist names" VALUES (?, ?)', [(1, 'kanye west'), (2, 'nico'), (3, 'x')])
+        connection.execute('DELETE FROM "artist names" WHERE id = 2')
+        connection.commit()
+        connection.close()
+        artists = SQLiteProvider(database_path, 'artist names', 'name')
+        self.assertEqual(artists, ('kanye west', 'x'))
+        artists.close()
+
+    def test_providers_are_not_copied(self) -> None:
+        catalog_path = self._catalog_dir / 'artists.txt'
+        catalog_path.write_text('kanye west\nthe beatles\n', encoding='utf-8')
+        artists = TextFileProvider(catalog_path)
+        pattern_def = load_pattern_def(self._base_dir / 'dynamic_token_patterns_only.yml')
+        _, generator = expand(pattern_def, dynamic_token_patterns_map={'ARTIST': artists})
+        (utterance_combo, _, _), = generator
+        self.assertIs(utterance_combo[0], artists)
+
+    def test_adding_to_provider_keeps_it_lazy(self) -> None:
+        catalog_path = self._catalog_dir / 'artists.txt'
+        catalog_path.write_text('kanye west\nthe beatles\n', encoding='utf-8')
+        artists = TextFileProvider(catalog_path)
+        p = Pipeline(self._base_dir / 'dynamic_token_patterns_only.yml', dynamic_token_patterns_map={'ARTIST': artists})
+        p.add_dynamic_token_patterns('ARTIST', ('nico',))
+        p.add_dynamic_token_patterns('ARTIST', ('beyonce',))
+        token_patterns = p.dynamic_token_patterns_map['ARTIST']
+        self.assertIsInstance(token_patterns, ChainSequence)
+        self.assertEqual(token_patterns.sequences, (artists, ('nico',), ('beyonce',)))
+        self.assertEqual(token_patterns, ('kanye west', 'the beatles', 'nico', 'beyonce'))
+
+    def test_sampling_from_provider(self) -> None:
+        catalog_path = self._catalog_dir / 'artists.txt'
+        catalog_path.write_text('\n'.join('artist {}'.format(i) for i in range(1000)), encoding='utf-8')
+        p = Pipeline(self._base_dir / 'dynamic_and_static_token_patterns.yml',
+                     dynamic_token_patterns_map={'ARTIST': TextFileProvider(catalog_path)},
+                     combo_options_map={'DEFAULT': ComboOptions(max_sample_size=5, with_replacement=False)})
+        utterances, _, _ = zip(*p.flow(disable_progress_bar=True))
+        self.assertEqual(len(utterances), 5)
+        for utterance in utterances:
+            self.assertRegex(utterance, r'artist \d+$')
+
+if __name__ == '__main__':
+    unittest.main()
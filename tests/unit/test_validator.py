@@ -179,5 +179,10 @@ class TestValidator(unittest.TestCase):
         pattern_def = Path(__file__).parent / 'pattern_definitions' / 'valid' / 'groups_with_single_range.yml'
         Pipeline(pattern_def)
 
+    def test_groups_cycle(self) -> None:
+        pattern_def_file_name = 'groups_cycle.yml'
+        with self.assertRaisesRegex(PatternDefinitionValidationError, 'PLAYS -> MORE_PLAYS -> PLAYS'):
+            Pipeline(self._base_dir / pattern_def_file_name)
+
 if __name__ == '__main__':
     unittest.main()